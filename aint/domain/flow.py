@@ -1,9 +1,31 @@
+import asyncio
+import inspect
 from abc import abstractmethod
 from asyncio import Protocol
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from aint.domain.gen import CompilationRule, GeneratedSource
+from aint.domain.incremental import IncrementalBuild
+from aint.domain.scheduling import (
+    StageNode,
+    compile_node_name,
+    link_node_name,
+    run_stage_graph,
+    stage_dependencies,
+)
 from aint.domain.syntax import ParseRule, SourceFile
-from aint.domain.units import LinkingRule, Unit, Workspace
+from aint.domain.tracing import bind_context, tracer
+from aint.domain.units import (
+    LinkingRule,
+    Unit,
+    Workspace,
+    recording_writes,
+)
+
+# Stages that make model requests, by the `stage` tag of their spans.
+STAGES = ("explain", "parse", "link", "compile")
 
 
 class RuleParser(Protocol):
@@ -44,38 +66,297 @@ class UnitLinker(Protocol):
 
 
 class UnitCompiler(Protocol):
+    """Compiles units of the rule's type in workspace order.
+
+    Sources may be returned as a list or yielded one by one, so that
+    they reach the output while the rest is still being compiled.
+    """
+
+    @abstractmethod
+    def compile(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> Iterable[GeneratedSource]:
+        raise NotImplementedError
+
+
+class AsyncUnitCompiler(Protocol):
+    """Like UnitCompiler, compile is a coroutine returning the sources
+    or an asynchronous generator yielding them."""
+
     @abstractmethod
     def compile(
         self, workspace: Workspace, rule: CompilationRule
-    ) -> list[GeneratedSource]:
+    ) -> (
+        Awaitable[Iterable[GeneratedSource]]
+        | AsyncIterator[GeneratedSource]
+    ):
         raise NotImplementedError
 
 
+# Receives every generated source as soon as it is compiled, possibly
+# from several threads.
+GeneratedSink = Callable[[GeneratedSource], None]
+
+
+class CompilationError(Exception):
+    def __init__(
+        self,
+        generated: list[GeneratedSource],
+        errors: list[BaseException],
+        compiled: int | None = None,
+    ) -> None:
+        # Sources that were streamed to a sink are counted, not kept.
+        compiled = len(generated) if compiled is None else compiled
+        super().__init__(
+            f"{len(errors)} unit(s) failed to compile, {compiled} compiled"
+        )
+        self.generated = generated
+        self.errors = errors
+        self.compiled = compiled
+
+
+class LinkConflictError(Exception):
+    def __init__(self, rule: LinkingRule, conflicts: list[str]) -> None:
+        super().__init__(
+            f"Linking rule {rule.name!r} produced conflicting changes: "
+            + ", ".join(conflicts)
+        )
+        self.rule = rule
+        self.conflicts = conflicts
+
+
+async def iter_compiled(
+    compiler: UnitCompiler | AsyncUnitCompiler,
+    workspace: Workspace,
+    rule: CompilationRule,
+) -> AsyncIterator[GeneratedSource]:
+    """Sources of any kind of unit compiler as they become available."""
+    if inspect.isasyncgenfunction(compiler.compile):
+        async for source in compiler.compile(workspace, rule):
+            yield source
+    elif inspect.iscoroutinefunction(compiler.compile):
+        for source in await compiler.compile(workspace, rule):
+            yield source
+    else:
+        for source in compiler.compile(workspace, rule):
+            yield source
+
+
+async def _drain(
+    sources: AsyncIterator[GeneratedSource], sink: GeneratedSink
+) -> None:
+    async for source in sources:
+        sink(source)
+
+
+def _compile_rule(
+    compiler: UnitCompiler | AsyncUnitCompiler,
+    workspace: Workspace,
+    rule: CompilationRule,
+    incremental: IncrementalBuild | None,
+    sink: GeneratedSink,
+) -> int:
+    with tracer.span("compile", stage="compile", rule=rule.unit_type):
+        return _compile_rule_units(
+            compiler, workspace, rule, incremental, sink
+        )
+
+
+def _compile_rule_units(
+    compiler: UnitCompiler | AsyncUnitCompiler,
+    workspace: Workspace,
+    rule: CompilationRule,
+    incremental: IncrementalBuild | None,
+    sink: GeneratedSink,
+) -> int:
+    if incremental is not None:
+        workspace = Workspace(
+            incremental.units_to_compile(workspace, rule),
+            workspace.attributes,
+        )
+    # Only paths are kept, contents go straight to the sink.
+    paths = []
+
+    def emit(source: GeneratedSource) -> None:
+        paths.append(source.path)
+        sink(source)
+
+    try:
+        if inspect.isasyncgenfunction(compiler.compile) or (
+            inspect.iscoroutinefunction(compiler.compile)
+        ):
+            asyncio.run(_drain(iter_compiled(compiler, workspace, rule), emit))
+        else:
+            for source in compiler.compile(workspace, rule):
+                emit(source)
+    except CompilationError as exc:
+        for source in exc.generated:
+            emit(source)
+        raise CompilationError([], exc.errors, len(paths)) from exc
+    if incremental is not None:
+        incremental.record_outputs(
+            workspace,
+            rule,
+            workspace.units_of_types(rule.unit_type),
+            paths,
+        )
+    return len(paths)
+
+
+def _link_rule(
+    linker: UnitLinker,
+    workspace: Workspace,
+    rule: LinkingRule,
+    incremental: IncrementalBuild | None,
+) -> None:
+    with tracer.span("link", stage="link", rule=rule.name):
+        with recording_writes() as writes:
+            linker.apply_rule(workspace, rule)
+    if incremental is not None:
+        incremental.record_rule_writes(rule, writes)
+
+
+def _parse_source(
+    source_parser: SourceParser,
+    rules: dict[str, ParseRule],
+    source: SourceFile,
+    parse_algo: str,
+) -> list[Unit]:
+    with tracer.span("parse", stage="parse", source=source.path):
+        return source_parser.parse_source(rules, source, parse_algo)
+
+
+def _link_and_compile(
+    linker: UnitLinker,
+    compiler: UnitCompiler | AsyncUnitCompiler,
+    workspace: Workspace,
+    link_rules: list[LinkingRule],
+    compile_rules: list[CompilationRule],
+    incremental: IncrementalBuild | None,
+    jobs: int,
+    sink: GeneratedSink,
+) -> int:
+    dependencies = stage_dependencies(link_rules, compile_rules)
+    nodes = [
+        StageNode(
+            link_node_name(rule),
+            partial(_link_rule, linker, workspace, rule, incremental),
+            dependencies[link_node_name(rule)],
+        )
+        for rule in link_rules
+    ] + [
+        StageNode(
+            compile_node_name(rule),
+            partial(
+                _compile_rule, compiler, workspace, rule, incremental, sink
+            ),
+            dependencies[compile_node_name(rule)],
+            fatal=False,
+        )
+        for rule in compile_rules
+    ]
+    results = run_stage_graph(nodes, jobs)
+    for rule in link_rules:
+        result = results.get(link_node_name(rule))
+        if isinstance(result, BaseException):
+            raise result
+    if incremental is not None:
+        incremental.record_linking(workspace)
+    compiled = 0
+    errors = []
+    for rule in compile_rules:
+        result = results[compile_node_name(rule)]
+        if isinstance(result, CompilationError):
+            compiled += result.compiled
+            errors.extend(result.errors)
+        elif isinstance(result, BaseException):
+            errors.append(result)
+        else:
+            compiled += result
+    if errors:
+        raise CompilationError([], errors, compiled)
+    return compiled
+
+
 def run_compiler_flow(
     rule_parser: RuleParser,
     explainer: RuleExplainer,
     sources: list[SourceFile],
     source_parser: SourceParser,
     linker: UnitLinker,
-    compiler: UnitCompiler,
+    compiler: UnitCompiler | AsyncUnitCompiler,
     default_ws_attributes: dict[str, str] | None = None,
+    parse_jobs: int = 1,
+    stage_jobs: int = 1,
+    incremental: IncrementalBuild | None = None,
+    sink: GeneratedSink | None = None,
 ) -> list[GeneratedSource]:
+    """Parse, link and compile the sources.
+
+    Returns the generated sources, or passes each of them to `sink` as
+    soon as it is compiled and returns an empty list, so that outputs
+    need not be held in memory until the end.
+    """
+    generated: list[GeneratedSource] = []
+    if sink is None:
+        sink = generated.append
     parse_rules = rule_parser.get_parse_rules()
     parse_rules_dict = {rule.name: rule for rule in parse_rules}
     link_rules = rule_parser.get_linking_rules()
     compile_rules = rule_parser.get_compilation_rules()
-    parser_algo = explainer.explain_rules(parse_rules)
-    units = []
-    for source in sources:
-        units.extend(
-            source_parser.parse_source(
-                parse_rules_dict, source, parser_algo
+    units_per_source: list[list[Unit] | None] = [
+        None if incremental is None
+        else incremental.reuse_units(parse_rules_dict, source)
+        for source in sources
+    ]
+    changed_sources = [
+        source
+        for source, source_units in zip(sources, units_per_source)
+        if source_units is None
+    ]
+    if changed_sources:
+        with tracer.span("explain", stage="explain"):
+            parser_algo = explainer.explain_rules(parse_rules)
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(parse_jobs, len(changed_sources))),
+            thread_name_prefix="aint-parse",
+        ) as executor:
+            parsed = iter(
+                executor.map(
+                    bind_context(
+                        lambda source: _parse_source(
+                            source_parser,
+                            parse_rules_dict,
+                            source,
+                            parser_algo,
+                        )
+                    ),
+                    changed_sources,
+                )
             )
-        )
+            for i, source in enumerate(sources):
+                if units_per_source[i] is None:
+                    units_per_source[i] = next(parsed)
+                    if incremental is not None:
+                        incremental.record_units(source, units_per_source[i])
+    units = [
+        unit for source_units in units_per_source for unit in source_units
+    ]
     workspace = Workspace(units, attributes=default_ws_attributes or {})
-    for link_rule in link_rules:
-        linker.apply_rule(workspace, link_rule)
-    generated = []
-    for compile_rule in compile_rules:
-        generated.extend(compiler.compile(workspace, compile_rule))
+    if incremental is not None:
+        link_rules = incremental.prepare_linking(workspace, link_rules)
+    try:
+        _link_and_compile(
+            linker,
+            compiler,
+            workspace,
+            link_rules,
+            compile_rules,
+            incremental,
+            stage_jobs,
+            sink,
+        )
+    except CompilationError as exc:
+        exc.generated = generated
+        raise
     return generated
@@ -0,0 +1,265 @@
+import hashlib
+import json
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from aint.domain.gen import CompilationRule
+from aint.domain.scheduling import may_overlap
+from aint.domain.syntax import ParseRule, SourceFile, SourceSpan
+from aint.domain.units import (
+    AttributeWrites,
+    LinkingRule,
+    Unit,
+    Workspace,
+)
+
+MANIFEST_VERSION = 2
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _hash_json(data: Any) -> str:
+    return hash_text(
+        json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    )
+
+
+@dataclass
+class UnitRecord:
+    rule: str
+    slots: dict[str, Any]
+    span: SourceSpan | None = None
+
+
+@dataclass
+class SourceRecord:
+    hash: str
+    units: list[UnitRecord]
+
+
+@dataclass
+class LinkedUnitRecord:
+    type: str
+    attributes: dict[str, Any]
+
+
+@dataclass
+class RuleWritesRecord:
+    # Names of the attributes the linking rule set.
+    units: list[str] = field(default_factory=list)
+    workspace: list[str] = field(default_factory=list)
+
+
+@dataclass
+class OutputRecord:
+    input_hash: str
+    paths: list[str]
+
+
+@dataclass
+class BuildManifest:
+    version: int = MANIFEST_VERSION
+    definitions_hash: str = ""
+    sources: dict[str, SourceRecord] = field(default_factory=dict)
+    workspace_attributes: dict[str, Any] = field(default_factory=dict)
+    units: dict[str, LinkedUnitRecord] = field(default_factory=dict)
+    rule_writes: dict[str, RuleWritesRecord] = field(default_factory=dict)
+    outputs: dict[str, OutputRecord] = field(default_factory=dict)
+
+
+class IncrementalBuild:
+    """Decides which parts of a build can be reused from the last run.
+
+    Units are identified by a hash of their type and slots, so a unit
+    that was not edited keeps its identity even if its source changed.
+    """
+
+    def __init__(
+        self,
+        previous: BuildManifest | None,
+        definitions_hash: str,
+    ) -> None:
+        if (
+            previous is None
+            or previous.version != MANIFEST_VERSION
+            or previous.definitions_hash != definitions_hash
+        ):
+            previous = BuildManifest(definitions_hash=definitions_hash)
+        self.previous = previous
+        self.manifest = BuildManifest(definitions_hash=definitions_hash)
+        self._unit_keys: dict[int, str] = {}
+
+    def reuse_units(
+        self, rules: dict[str, ParseRule], source: SourceFile
+    ) -> list[Unit] | None:
+        record = self.previous.sources.get(source.path)
+        if record is None or record.hash != hash_text(source.content):
+            return None
+        if any(unit.rule not in rules for unit in record.units):
+            return None
+        self.manifest.sources[source.path] = record
+        return [
+            Unit(
+                used_rule=rules[unit.rule],
+                slots=unit.slots,
+                attributes={},
+                span=unit.span,
+            )
+            for unit in record.units
+        ]
+
+    def record_units(self, source: SourceFile, units: list[Unit]) -> None:
+        self.manifest.sources[source.path] = SourceRecord(
+            hash=hash_text(source.content),
+            units=[
+                UnitRecord(unit.type, unit.slots, unit.span)
+                for unit in units
+            ],
+        )
+
+    def _key_units(self, workspace: Workspace) -> None:
+        seen: Counter[str] = Counter()
+        for unit in workspace.units:
+            base = _hash_json([unit.type, unit.slots])
+            self._unit_keys[id(unit)] = f"{base}-{seen[base]}"
+            seen[base] += 1
+
+    def prepare_linking(
+        self, workspace: Workspace, rules: list[LinkingRule]
+    ) -> list[LinkingRule]:
+        """Restore last run's link results and return rules to re-run.
+
+        Rules re-run when units they select changed, or when an earlier
+        rule to re-run may change what they read: workspace attributes
+        it writes or attributes of units they both select. Attributes set
+        by rules that run again are not restored, so that values those
+        rules no longer set do not survive.
+        """
+        self._key_units(workspace)
+        current_keys = set()
+        changed_types = set()
+        for unit in workspace.units:
+            key = self._unit_keys[id(unit)]
+            current_keys.add(key)
+            if key not in self.previous.units:
+                changed_types.add(unit.type)
+        for key in self.previous.units.keys() - current_keys:
+            changed_types.add(self.previous.units[key].type)
+        rerun: list[LinkingRule] = []
+        for rule in rules:
+            if changed_types.intersection(rule.select) or any(
+                may_overlap(earlier.writes, rule.reads)
+                for earlier in rerun
+            ):
+                rerun.append(rule)
+                writes = self.previous.rule_writes.get(rule.name)
+                if writes is None or writes.units:
+                    changed_types.update(rule.select)
+        stale_unit_attrs: dict[str, set[str]] = {}
+        stale_ws_attrs = set()
+        for rule in rerun:
+            writes = self.previous.rule_writes.get(
+                rule.name, RuleWritesRecord()
+            )
+            for unit_type in rule.select:
+                stale_unit_attrs.setdefault(unit_type, set()).update(
+                    writes.units
+                )
+            stale_ws_attrs.update(writes.workspace, rule.writes or ())
+        kept_ws_attrs = set()
+        for rule in rules:
+            writes = self.previous.rule_writes.get(rule.name)
+            if rule not in rerun and writes is not None:
+                self.manifest.rule_writes[rule.name] = writes
+                kept_ws_attrs.update(writes.workspace)
+        for unit in workspace.units:
+            previous = self.previous.units.get(self._unit_keys[id(unit)])
+            if previous is None:
+                continue
+            stale = stale_unit_attrs.get(unit.type, set())
+            for name, value in previous.attributes.items():
+                if name not in stale:
+                    workspace.set_unit_attr(unit, name, value)
+        # Other workspace attributes are defaults given to this run.
+        for name in sorted(kept_ws_attrs - stale_ws_attrs):
+            if name in self.previous.workspace_attributes:
+                workspace.set_attr(
+                    name, self.previous.workspace_attributes[name]
+                )
+        return rerun
+
+    def record_rule_writes(
+        self, rule: LinkingRule, writes: AttributeWrites
+    ) -> None:
+        self.manifest.rule_writes[rule.name] = RuleWritesRecord(
+            sorted(writes.units), sorted(writes.workspace)
+        )
+
+    def record_linking(self, workspace: Workspace) -> None:
+        self.manifest.workspace_attributes = dict(workspace.attributes)
+        self.manifest.units = {
+            self._unit_keys[id(unit)]: LinkedUnitRecord(
+                unit.type, dict(unit.attributes)
+            )
+            for unit in workspace.units
+        }
+
+    def _input_hash(
+        self, workspace: Workspace, rule: CompilationRule, unit: Unit
+    ) -> str:
+        return _hash_json(
+            [
+                asdict(rule),
+                unit.type,
+                unit.slots,
+                unit.attributes,
+                workspace.attributes,
+            ]
+        )
+
+    def units_to_compile(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> list[Unit]:
+        dirty = []
+        for unit in workspace.units_of_types(rule.unit_type):
+            key = self._unit_keys[id(unit)]
+            previous = self.previous.outputs.get(key)
+            if (
+                previous is not None
+                and previous.input_hash
+                == self._input_hash(workspace, rule, unit)
+            ):
+                self.manifest.outputs[key] = previous
+            else:
+                dirty.append(unit)
+        return dirty
+
+    def record_outputs(
+        self,
+        workspace: Workspace,
+        rule: CompilationRule,
+        units: list[Unit],
+        paths: list[str],
+    ) -> None:
+        for unit, path in zip(units, paths, strict=True):
+            self.manifest.outputs[self._unit_keys[id(unit)]] = OutputRecord(
+                input_hash=self._input_hash(workspace, rule, unit),
+                paths=[path],
+            )
+
+    def stale_outputs(self) -> list[str]:
+        current = {
+            path
+            for record in self.manifest.outputs.values()
+            for path in record.paths
+        }
+        return sorted(
+            {
+                path
+                for record in self.previous.outputs.values()
+                for path in record.paths
+            } - current
+        )
@@ -0,0 +1,120 @@
+from collections.abc import Callable, Collection
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from typing import Any
+
+from aint.domain.gen import CompilationRule
+from aint.domain.tracing import bind_context
+from aint.domain.units import LinkingRule
+
+
+@dataclass
+class StageNode:
+    name: str
+    run: Callable[[], Any]
+    depends_on: set[str] = field(default_factory=set)
+    # Failure of a fatal node cancels everything not yet started.
+    fatal: bool = True
+
+
+def link_node_name(rule: LinkingRule) -> str:
+    return f"link:{rule.name}"
+
+
+def compile_node_name(rule: CompilationRule) -> str:
+    return f"compile:{rule.unit_type}"
+
+
+def may_overlap(
+    first: Collection[str] | None, second: Collection[str] | None
+) -> bool:
+    # None means the set of attributes is not declared, i.e. any.
+    if first is None:
+        return second is None or bool(second)
+    if second is None:
+        return bool(first)
+    return bool(set(first) & set(second))
+
+
+def _link_rules_conflict(first: LinkingRule, second: LinkingRule) -> bool:
+    return (
+        bool(set(first.select) & set(second.select))
+        or may_overlap(first.writes, second.reads)
+        or may_overlap(first.writes, second.writes)
+        or may_overlap(first.reads, second.writes)
+    )
+
+
+def stage_dependencies(
+    link_rules: list[LinkingRule], compile_rules: list[CompilationRule]
+) -> dict[str, set[str]]:
+    """Derive which stages must finish before each stage may start.
+
+    Linking rules keep their declared order wherever they may touch the
+    same units or workspace attributes. A compilation rule waits for the
+    rules selecting its unit type and for all rules that may change
+    workspace attributes.
+    """
+    dependencies = {}
+    for i, rule in enumerate(link_rules):
+        dependencies[link_node_name(rule)] = {
+            link_node_name(earlier)
+            for earlier in link_rules[:i]
+            if _link_rules_conflict(earlier, rule)
+        }
+    for rule in compile_rules:
+        dependencies[compile_node_name(rule)] = {
+            link_node_name(link_rule)
+            for link_rule in link_rules
+            if rule.unit_type in link_rule.select
+            or may_overlap(link_rule.writes, None)
+        }
+    return dependencies
+
+
+def run_stage_graph(
+    nodes: list[StageNode], jobs: int
+) -> dict[str, Any | BaseException]:
+    """Run every node as soon as its dependencies have completed.
+
+    Returns results or raised exceptions by node name. When a fatal node
+    fails, nodes that have not started yet are not run.
+    """
+    names = {node.name for node in nodes}
+    pending = {
+        node.name: (node, node.depends_on & names) for node in nodes
+    }
+    results: dict[str, Any | BaseException] = {}
+    running: dict[Future, StageNode] = {}
+    aborted = False
+    with ThreadPoolExecutor(
+        max_workers=max(1, jobs), thread_name_prefix="aint-stage"
+    ) as executor:
+        while pending or running:
+            if not aborted:
+                for name, (node, depends_on) in list(pending.items()):
+                    if depends_on <= results.keys():
+                        del pending[name]
+                        future = executor.submit(bind_context(node.run))
+                        running[future] = node
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                exc = future.exception()
+                results[node.name] = exc if exc is not None else (
+                    future.result()
+                )
+                if exc is not None and node.fatal:
+                    aborted = True
+    if pending and not aborted:
+        raise ValueError(
+            "Stage dependency cycle between " + ", ".join(sorted(pending))
+        )
+    return results
@@ -5,6 +5,14 @@ from dataclasses import dataclass
 class SourceFile:
     path: str
     content: str
+    offset: int = 0
+
+
+@dataclass
+class SourceSpan:
+    path: str
+    start: int
+    end: int
 
 
 @dataclass
@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+_tags: ContextVar[dict[str, Any]] = ContextVar(
+    "aint_trace_tags", default={}
+)
+
+
+@dataclass
+class TraceEvent:
+    name: str
+    category: str
+    start: float
+    duration: float
+    thread: int
+    tags: dict[str, Any]
+    metrics: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class SummaryRow:
+    stage: str
+    rule: str
+    requests: int = 0
+    wall_time: float = 0
+    queue_time: float = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_hits: int = 0
+    retries: int = 0
+    response_bytes: int = 0
+
+
+class Tracer:
+    """Collects timed spans tagged by stage, rule and unit.
+
+    Tags are kept in a context variable so that nested spans and model
+    requests inherit them. Work submitted to thread pools must be
+    wrapped with `bind_context` to keep its tags.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events: list[TraceEvent] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def reset(self, enabled: bool) -> None:
+        with self._lock:
+            self.enabled = enabled
+            self.events = []
+            self._origin = time.perf_counter()
+
+    @staticmethod
+    def current_tags() -> dict[str, Any]:
+        return _tags.get()
+
+    @contextmanager
+    def measure(
+        self, name: str, category: str = "stage", **tags: Any
+    ) -> Iterator[dict[str, float]]:
+        """Record a span without changing the tags seen by nested code."""
+        merged = {**_tags.get(), **tags}
+        metrics: dict[str, float] = {}
+        start = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            if self.enabled:
+                event = TraceEvent(
+                    name=name,
+                    category=category,
+                    start=start - self._origin,
+                    duration=time.perf_counter() - start,
+                    thread=threading.get_ident(),
+                    tags=merged,
+                    metrics=metrics,
+                )
+                with self._lock:
+                    self.events.append(event)
+
+    @contextmanager
+    def span(
+        self, name: str, category: str = "stage", **tags: Any
+    ) -> Iterator[dict[str, float]]:
+        token = _tags.set({**_tags.get(), **tags})
+        try:
+            with self.measure(name, category) as metrics:
+                yield metrics
+        finally:
+            _tags.reset(token)
+
+    def write_chrome_trace(self, path: Path) -> None:
+        with self._lock:
+            events = list(self.events)
+        threads = {
+            thread: number
+            for number, thread in enumerate(
+                dict.fromkeys(event.thread for event in events), start=1
+            )
+        }
+        trace = {
+            "traceEvents": [
+                {
+                    "name": event.name,
+                    "cat": event.category,
+                    "ph": "X",
+                    "ts": event.start * 1e6,
+                    "dur": event.duration * 1e6,
+                    "pid": 1,
+                    "tid": threads[event.thread],
+                    "args": {**event.tags, **event.metrics},
+                }
+                for event in events
+            ],
+            "displayTimeUnit": "ms",
+        }
+        path.write_text(json.dumps(trace, default=str))
+
+    def summary(self) -> list[SummaryRow]:
+        rows: dict[tuple[str, str], SummaryRow] = {}
+        with self._lock:
+            events = [
+                event for event in self.events
+                if event.category == "request"
+            ]
+        for event in events:
+            stage = str(event.tags.get("stage", "-"))
+            rule = str(event.tags.get("rule", "-"))
+            row = rows.setdefault((stage, rule), SummaryRow(stage, rule))
+            metrics = event.metrics
+            row.requests += 1
+            row.wall_time += event.duration
+            row.queue_time += metrics.get("queue_time", 0)
+            row.prompt_tokens += int(metrics.get("prompt_tokens", 0))
+            row.completion_tokens += int(
+                metrics.get("completion_tokens", 0)
+            )
+            row.cache_hits += int(metrics.get("cache_hit", 0))
+            row.retries += int(metrics.get("retries", 0))
+            row.response_bytes += int(metrics.get("response_bytes", 0))
+        return sorted(
+            rows.values(), key=lambda row: row.wall_time, reverse=True
+        )
+
+
+tracer = Tracer()
+
+
+def bind_context(fn: Callable[..., T]) -> Callable[..., T]:
+    """Make fn run with the caller's trace tags in any thread."""
+    context = copy_context()
+    return lambda *args: context.copy().run(fn, *args)
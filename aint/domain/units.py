@@ -1,13 +1,58 @@
-from dataclasses import dataclass
+import heapq
+import sys
+import threading
+from collections.abc import Hashable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
 
-from aint.domain.syntax import ParseRule
+from aint.domain.syntax import ParseRule, SourceSpan
+
+
+def _intern_keys(values: dict[str, Any]) -> dict[str, Any]:
+    return {sys.intern(key): value for key, value in values.items()}
+
+
+def _index_key(value: Any) -> Hashable:
+    return value if isinstance(value, Hashable) else repr(value)
 
 
 @dataclass
+class AttributeWrites:
+    """Names of the unit and workspace attributes set in a context."""
+
+    units: set[str] = field(default_factory=set)
+    workspace: set[str] = field(default_factory=set)
+
+
+_writes: ContextVar[AttributeWrites | None] = ContextVar(
+    "aint_attribute_writes", default=None
+)
+
+
+@contextmanager
+def recording_writes() -> Iterator[AttributeWrites]:
+    """Collect the names of attributes set in this context, including
+    threads it is bound to."""
+    writes = AttributeWrites()
+    token = _writes.set(writes)
+    try:
+        yield writes
+    finally:
+        _writes.reset(token)
+
+
+@dataclass(slots=True)
 class Unit:
     used_rule: ParseRule
     slots: dict[str, str]
     attributes: dict[str, str]
+    span: SourceSpan | None = None
+
+    def __post_init__(self) -> None:
+        self.slots = _intern_keys(self.slots)
+        self.attributes = _intern_keys(self.attributes)
 
     @property
     def type(self) -> str:
@@ -16,14 +61,124 @@ class Unit:
 
 @dataclass
 class Workspace:
+    """Units of a program with indexes by type and by attribute value.
+
+    Attribute indexes are built on first lookup of an attribute. Unit
+    attributes should be changed through `set_unit_attr` afterwards, so
+    that the indexes stay in sync.
+    """
+
     units: list[Unit]
     attributes: dict[str, str]
+    _positions: dict[int, int] = field(
+        init=False, repr=False, compare=False
+    )
+    _by_type: dict[str, list[Unit]] = field(
+        init=False, repr=False, compare=False
+    )
+    _by_attribute: dict[str, dict[Hashable, dict[int, Unit]]] = field(
+        init=False, repr=False, compare=False
+    )
+    _lock: threading.RLock = field(
+        default_factory=threading.RLock, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self._positions = {}
+        self._by_type = {}
+        self._by_attribute = {}
+        for position, unit in enumerate(self.units):
+            self._positions[id(unit)] = position
+            self._by_type.setdefault(unit.type, []).append(unit)
+
+    def _attr_index(self, name: str) -> dict[Hashable, dict[int, Unit]]:
+        index = self._by_attribute.get(name)
+        if index is None:
+            index = {}
+            for unit in self.units:
+                if name in unit.attributes:
+                    index.setdefault(
+                        _index_key(unit.attributes[name]), {}
+                    )[id(unit)] = unit
+            self._by_attribute[name] = index
+        return index
 
     def units_of_types(self, *unit_types: str) -> list[Unit]:
-        return [
-            unit for unit in self.units
-            if unit.type in unit_types
-        ]
+        if len(unit_types) == 1:
+            return list(self._by_type.get(unit_types[0], ()))
+        return list(
+            heapq.merge(
+                *(
+                    self._by_type.get(unit_type, ())
+                    for unit_type in set(unit_types)
+                ),
+                key=lambda unit: self._positions[id(unit)],
+            )
+        )
+
+    def units_with_attr(
+        self, name: str, value: Any = ...
+    ) -> list[Unit]:
+        with self._lock:
+            values = self._attr_index(name)
+            if value is ...:
+                found = [
+                    unit for units in values.values()
+                    for unit in units.values()
+                ]
+            else:
+                found = list(values.get(_index_key(value), {}).values())
+        return sorted(found, key=lambda unit: self._positions[id(unit)])
+
+    def set_unit_attr(self, unit: Unit, name: str, value: Any) -> None:
+        with self._lock:
+            name = sys.intern(name)
+            index = self._by_attribute.get(name)
+            if index is not None:
+                if name in unit.attributes:
+                    index[_index_key(unit.attributes[name])].pop(
+                        id(unit), None
+                    )
+                index.setdefault(_index_key(value), {})[id(unit)] = unit
+            unit.attributes[name] = value
+            writes = _writes.get()
+            if writes is not None:
+                writes.units.add(name)
+
+    def read_attributes(
+        self, names: list[str] | None = None
+    ) -> dict[str, Any]:
+        """Copy of the workspace attributes, only the named ones if
+        given."""
+        with self._lock:
+            if names is None:
+                return dict(self.attributes)
+            return {
+                name: self.attributes[name]
+                for name in names
+                if name in self.attributes
+            }
+
+    def set_attr(self, name: str, value: Any) -> None:
+        with self._lock:
+            self.attributes[name] = value
+            writes = _writes.get()
+            if writes is not None:
+                writes.workspace.add(name)
+
+
+@dataclass
+class LocalLinking:
+    """Expressions that carry out a linking rule without the model.
+
+    `let` names values computed once, `workspace` and `units` map
+    attribute names to the expressions of their new values. Unit
+    expressions are evaluated for every selected unit.
+    """
+
+    let: dict[str, str] = field(default_factory=dict)
+    workspace: dict[str, str] = field(default_factory=dict)
+    units: dict[str, str] = field(default_factory=dict)
 
 
 @dataclass
@@ -31,3 +186,17 @@ class LinkingRule:
     name: str
     select: list[str]
     rule: str
+    # "global" rules see all their units at once. "shard" rules may be
+    # applied to parts of them, if each unit's changes depend only on
+    # the units in the same part.
+    scope: str = "global"
+    # Workspace attributes the rule reads and writes, None if undeclared.
+    # Rules that declare them may run while others change the rest of
+    # the workspace attributes, so they only see the ones they read and
+    # may set only the ones they write.
+    reads: list[str] | None = None
+    writes: list[str] | None = None
+    local: LocalLinking | None = None
+
+    def may_write(self, name: str) -> bool:
+        return self.writes is None or name in self.writes
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+DEFAULT_CACHE_DIR = Path(".aint-cache")
+
+# Puts between full evictions, which also catch what other processes
+# sharing the file stored.
+_EVICT_INTERVAL = 256
+
+
+class _Abandoned(Exception):
+    """The stream a request was waiting for was not read to its end."""
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evicted: int = 0
+
+
+class ResponseCache:
+    """Disk-backed LRU cache of model responses.
+
+    Entries are keyed by a hash of everything that affects the completion.
+    Identical requests issued concurrently are coalesced, so only the
+    first one reaches the model. Puts keep a running total of the size
+    and only scan the table to evict once it exceeds `max_size` or every
+    `_EVICT_INTERVAL` puts.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_size: int = 256 * 1024 * 1024,
+        max_age: float | None = 30 * 24 * 3600,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future[str]] = {}
+        # Size as of the last eviction plus what was put since, None
+        # until the first eviction.
+        self._size: int | None = None
+        self._puts = 0
+        self._local = threading.local()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL"
+                ")"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed "
+                "ON responses (accessed)"
+            )
+
+    @staticmethod
+    def make_key(
+        model: str, temperature: float, system: str, user: str
+    ) -> str:
+        payload = json.dumps(
+            [model, temperature, system, user], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> str | None:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        now = time.time()
+        if self.max_age is not None and now - created > self.max_age:
+            with conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return value
+
+    def lookup(self, key: str) -> str | None:
+        value = self.get(key)
+        with self._lock:
+            if value is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        conn = self._connect()
+        now = time.time()
+        size = len(value.encode())
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+        with self._lock:
+            self._puts += 1
+            due = (
+                self._size is None
+                or self._size + size > self.max_size
+                or self._puts >= _EVICT_INTERVAL
+            )
+            if not due:
+                self._size += size
+        if due:
+            self.evict()
+
+    def evict(self) -> None:
+        conn = self._connect()
+        evicted = 0
+        with conn:
+            if self.max_age is not None:
+                cursor = conn.execute(
+                    "DELETE FROM responses WHERE created < ?",
+                    (time.time() - self.max_age,)
+                )
+                evicted += cursor.rowcount
+            (total,) = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if total > self.max_size:
+                # Leave room, so that the next puts do not evict again.
+                target = self.max_size * 9 // 10
+                rows = conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ).fetchall()
+                for key, size in rows:
+                    if total <= target:
+                        break
+                    conn.execute(
+                        "DELETE FROM responses WHERE key = ?", (key,)
+                    )
+                    total -= size
+                    evicted += 1
+        with self._lock:
+            self.stats.evicted += evicted
+            self._size = total
+            self._puts = 0
+
+    def clear(self) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses")
+
+    def _claim(self, key: str) -> tuple[Future[str], bool]:
+        """The future of the key's value and whether the caller is the
+        one to compute it."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats.coalesced += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            del self._in_flight[key]
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], str],
+        validate: Callable[[str], Any] | None = None,
+    ) -> str:
+        """Cached value of the key, computed once however many threads
+        ask for it. A computed value that `validate` rejects by raising
+        is not stored."""
+        future, owner = self._claim(key)
+        if not owner:
+            try:
+                return future.result()
+            except _Abandoned:
+                return self.get_or_compute(key, compute, validate)
+        try:
+            value = self.lookup(key)
+            if value is None:
+                value = compute()
+                if validate is not None:
+                    validate(value)
+                self.put(key, value)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._release(key)
+
+    def stream_or_compute(
+        self,
+        key: str,
+        stream: Callable[[], Iterator[str]],
+        validate: Callable[[str], Any] | None = None,
+    ) -> Iterator[str]:
+        """Like `get_or_compute` for a value computed in parts.
+
+        The parts are passed on as they arrive to the first caller, the
+        others get the whole value at once. A value that `validate`
+        rejects is passed on but not stored.
+        """
+        future, owner = self._claim(key)
+        if not owner:
+            try:
+                value = future.result()
+            except _Abandoned:
+                yield from self.stream_or_compute(key, stream, validate)
+                return
+            yield value
+            return
+        try:
+            value = self.lookup(key)
+            if value is not None:
+                yield value
+            else:
+                parts = []
+                for part in stream():
+                    parts.append(part)
+                    yield part
+                value = "".join(parts)
+                try:
+                    if validate is not None:
+                        validate(value)
+                except ValueError:
+                    pass
+                else:
+                    self.put(key, value)
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        except BaseException:
+            # Waiting callers request the value themselves.
+            future.set_exception(_Abandoned())
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            self._release(key)
@@ -1,26 +1,318 @@
+import itertools
+import logging
+import time
+from collections.abc import Callable, Iterator
+from functools import partial
+from typing import Any, TypeVar
+
 import openai
 
+from aint.domain.tracing import tracer
+from aint.infrastructure.ai.cache import ResponseCache
+from aint.infrastructure.ai.decoding import extract_json
+from aint.infrastructure.ai.engine import RequestEngine
+from aint.infrastructure.ai.routing import Endpoint, ModelRouter
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
 
 class AI:
-    def __init__(self, client: openai.Client, model: str) -> None:
+    def __init__(
+        self,
+        client: openai.Client,
+        model: str,
+        temperature: float = 0,
+        cache: ResponseCache | None = None,
+        engine: RequestEngine | None = None,
+        compact_prompts: bool = True,
+        router: ModelRouter | None = None,
+        json_mode: bool = False,
+    ) -> None:
         self.client = client
         self.model = model
+        self.temperature = temperature
+        self.cache = cache
+        self.engine = engine or RequestEngine()
+        self.compact_prompts = compact_prompts
+        self.router = router
+        self._default_endpoints = [
+            Endpoint("default", client, model, json_mode=json_mode)
+        ]
+
+    def _endpoints(self) -> list[Endpoint]:
+        if self.router is not None:
+            endpoints = self.router.route(tracer.current_tags())
+            if endpoints is not None:
+                return endpoints
+        return self._default_endpoints
+
+    def _cache_key(
+        self,
+        endpoints: list[Endpoint],
+        system: str,
+        user: str,
+        json_mode: bool,
+    ) -> str:
+        return self.cache.make_key(
+            ",".join(
+                endpoint.model + (
+                    "+json" if json_mode and endpoint.json_mode else ""
+                )
+                for endpoint in endpoints
+            ),
+            self.temperature,
+            system,
+            user,
+        )
 
     def request(self, system: str, user: str) -> str:
-        print(">>>>> " + system + " " + user)
-        completions = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system,
-                },
-                {
-                    "role": "user",
-                    "content": user,
-                },
-            ],
-            model=self.model,
-            temperature=0,
+        return self._request(system, user, False, None)
+
+    def request_json(
+        self,
+        system: str,
+        user: str,
+        decode: Callable[[str], T] = extract_json,
+    ) -> T:
+        """Request a JSON answer, in JSON mode where the endpoint has it.
+
+        A response that `decode` rejects is not cached, so that it is
+        requested again next time instead of failing for good.
+        """
+        return decode(self._request(system, user, True, decode))
+
+    def _request(
+        self,
+        system: str,
+        user: str,
+        json_mode: bool,
+        validate: Callable[[str], Any] | None,
+    ) -> str:
+        endpoints = self._endpoints()
+        with tracer.measure(
+            "request", "request", model=endpoints[0].model
+        ) as metrics:
+            metrics["prompt_bytes"] = len(system) + len(user)
+
+            complete = partial(
+                self._complete, system, user, endpoints, metrics, json_mode
+            )
+            if self.cache is None:
+                response = complete()
+            else:
+                metrics["cache_hit"] = 1
+                response = self.cache.get_or_compute(
+                    self._cache_key(endpoints, system, user, json_mode),
+                    complete,
+                    validate,
+                )
+            metrics["response_bytes"] = len(response)
+            return response
+
+    def request_stream(
+        self,
+        system: str,
+        user: str,
+        json_mode: bool = False,
+        validate: Callable[[str], Any] | None = None,
+    ) -> Iterator[str]:
+        """Parts of the response as they arrive.
+
+        Like with `request_json`, a response that `validate` rejects is
+        not cached.
+        """
+        endpoints = self._endpoints()
+        with tracer.measure(
+            "request", "request", model=endpoints[0].model, stream=True
+        ) as metrics:
+            metrics["prompt_bytes"] = len(system) + len(user)
+            stream = partial(
+                self._complete_stream,
+                system,
+                user,
+                endpoints,
+                metrics,
+                json_mode,
+            )
+            if self.cache is None:
+                parts = stream()
+            else:
+                metrics["cache_hit"] = 1
+                parts = self.cache.stream_or_compute(
+                    self._cache_key(endpoints, system, user, json_mode),
+                    stream,
+                    validate,
+                )
+            size = 0
+            for part in parts:
+                size += len(part)
+                yield part
+            metrics["response_bytes"] = size
+
+    def _messages(self, system: str, user: str) -> list[dict[str, str]]:
+        return [
+            {
+                "role": "system",
+                "content": system,
+            },
+            {
+                "role": "user",
+                "content": user,
+            },
+        ]
+
+    def _create(
+        self,
+        endpoint: Endpoint,
+        latencies: list[float],
+        system: str,
+        user: str,
+        json_mode: bool,
+        **kwargs,
+    ):
+        if json_mode and endpoint.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        start = time.monotonic()
+        result = endpoint.client.chat.completions.create(
+            messages=self._messages(system, user),
+            model=endpoint.model,
+            temperature=self.temperature,
+            timeout=self.engine.timeout,
+            **kwargs,
+        )
+        latencies.append(time.monotonic() - start)
+        return result
+
+    def _record_usage(
+        self, usage: Any, estimated: int, metrics: dict[str, float]
+    ) -> None:
+        if usage is None:
+            return
+        metrics["prompt_tokens"] = usage.prompt_tokens
+        metrics["completion_tokens"] = usage.completion_tokens
+        self.engine.report_usage(
+            estimated, usage.prompt_tokens + usage.completion_tokens
         )
-        print(completions.choices[0].message.content)
-        return completions.choices[0].message.content
+
+    def _fall_back(
+        self,
+        endpoints: list[Endpoint],
+        position: int,
+        exc: openai.APIError,
+    ) -> None:
+        """Record a failed endpoint, reraise if there is nothing left."""
+        endpoint = endpoints[position]
+        if self.router is not None:
+            self.router.record_failure(endpoint, tracer.current_tags())
+        if position == len(endpoints) - 1:
+            raise exc
+        logger.warning(
+            "%s failed (%s), falling back to %s",
+            endpoint.name, exc, endpoints[position + 1].name,
+        )
+
+    def _succeeded(
+        self,
+        endpoint: Endpoint,
+        position: int,
+        latencies: list[float],
+        metrics: dict[str, float],
+    ) -> None:
+        metrics["fallbacks"] = position
+        if self.router is not None and latencies:
+            self.router.record_success(
+                endpoint, tracer.current_tags(), latencies[-1], position > 0
+            )
+
+    def _ordered(self, endpoints: list[Endpoint]) -> list[Endpoint]:
+        if self.router is None:
+            return endpoints
+        return self.router.order(endpoints)
+
+    def _complete_stream(
+        self,
+        system: str,
+        user: str,
+        endpoints: list[Endpoint],
+        metrics: dict[str, float],
+        json_mode: bool,
+    ) -> Iterator[str]:
+        metrics["cache_hit"] = 0
+        logger.debug("request: %s %s", system, user)
+        estimated = estimate_tokens(system + user)
+        endpoints = self._ordered(endpoints)
+        for position, endpoint in enumerate(endpoints):
+            latencies: list[float] = []
+            chunks = self.engine.run_stream(
+                partial(
+                    self._create,
+                    endpoint,
+                    latencies,
+                    system,
+                    user,
+                    json_mode,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ),
+                estimated,
+                metrics,
+            )
+            # Falling back is only possible before the first chunk.
+            try:
+                first = next(chunks, None)
+            except openai.APIError as exc:
+                self._fall_back(endpoints, position, exc)
+                continue
+            self._succeeded(endpoint, position, latencies, metrics)
+            break
+        if first is None:
+            return
+        for chunk in itertools.chain([first], chunks):
+            if getattr(chunk, "usage", None) is not None:
+                self._record_usage(chunk.usage, estimated, metrics)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _complete(
+        self,
+        system: str,
+        user: str,
+        endpoints: list[Endpoint],
+        metrics: dict[str, float],
+        json_mode: bool,
+    ) -> str:
+        metrics["cache_hit"] = 0
+        logger.debug("request: %s %s", system, user)
+        estimated = estimate_tokens(system + user)
+        endpoints = self._ordered(endpoints)
+        for position, endpoint in enumerate(endpoints):
+            latencies: list[float] = []
+            try:
+                completions = self.engine.run(
+                    partial(
+                        self._create,
+                        endpoint,
+                        latencies,
+                        system,
+                        user,
+                        json_mode,
+                    ),
+                    estimated,
+                    metrics,
+                )
+            except openai.APIError as exc:
+                self._fall_back(endpoints, position, exc)
+                continue
+            self._succeeded(endpoint, position, latencies, metrics)
+            break
+        self._record_usage(completions.usage, estimated, metrics)
+        response = completions.choices[0].message.content
+        logger.debug("response: %s", response)
+        return response
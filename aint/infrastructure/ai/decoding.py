@@ -0,0 +1,173 @@
+import json
+import re
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Any
+
+_FENCE = re.compile(r"```[\w.+-]*[ \t]*\n?")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_LINE_BRACKET = re.compile(r"^[ \t]*([\[{])", re.MULTILINE)
+
+
+class TruncatedJsonError(ValueError):
+    """The response ended before its JSON value was complete."""
+
+
+def _first_bracket(text: str) -> int | None:
+    return min(
+        (i for i in (text.find("["), text.find("{")) if i >= 0),
+        default=None,
+    )
+
+
+def _unfence(text: str) -> str:
+    # Skips to the opening fence, whatever its language tag. The closing
+    # one is left to end the value, as fences after the first bracket
+    # may well be part of it, e.g. in generated markdown.
+    match = _FENCE.search(text)
+    if match is None:
+        return text
+    bracket = _first_bracket(text)
+    if bracket is not None and bracket < match.start():
+        return text
+    return text[match.end():]
+
+
+def _decode_value(text: str) -> Any:
+    # The value starts at the first bracket or, after prose that has
+    # brackets of its own, at a line starting with one. Whatever follows
+    # the value is ignored.
+    first = _first_bracket(text)
+    starts = [] if first is None else [first]
+    starts += [
+        match.start(1)
+        for match in _LINE_BRACKET.finditer(text)
+        if match.start(1) != first
+    ]
+    # Models write raw newlines into strings now and then.
+    decoder = json.JSONDecoder(strict=False)
+    for start in starts:
+        try:
+            return decoder.raw_decode(text, start)[0]
+        except ValueError:
+            continue
+    raise ValueError("Response contains no JSON value")
+
+
+def extract_json(text: str) -> Any:
+    """Decode the JSON value of a model response.
+
+    Markdown fences with any language tag, prose around the value,
+    control characters in strings and trailing commas are tolerated.
+    """
+    text = _unfence(text)
+    try:
+        return _decode_value(text)
+    except ValueError:
+        return _decode_value(_TRAILING_COMMA.sub(r"\1", text))
+
+
+class JsonListDecoder:
+    """Incrementally decodes the elements of a top-level JSON list.
+
+    Text is fed in arbitrary pieces. Every element is returned as soon
+    as it is complete, anything before the opening bracket (such as a
+    markdown fence or the key of an object wrapping the list) is
+    skipped. Elements that are not valid JSON are counted in `skipped`.
+    """
+
+    def __init__(self) -> None:
+        self.skipped = 0
+        self._started = False
+        self._finished = False
+        self._element: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def _decode(self, element: str, elements: list[Any]) -> None:
+        try:
+            elements.append(json.loads(element, strict=False))
+        except ValueError:
+            self.skipped += 1
+
+    def feed(self, text: str) -> list[Any]:
+        elements = []
+        for char in text:
+            if self._finished:
+                break
+            if not self._started:
+                self._started = char == "["
+                continue
+            if self._in_string:
+                self._element.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if self._depth == 0 and char in ",]":
+                element = "".join(self._element).strip()
+                self._element.clear()
+                if element:
+                    self._decode(element, elements)
+                self._finished = char == "]"
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+            self._element.append(char)
+            if self._depth == 0 and char in "}]":
+                self._decode("".join(self._element), elements)
+                self._element.clear()
+        return elements
+
+
+def iter_json_list(chunks: Iterable[str]) -> Iterator[Any]:
+    """Elements of a streamed JSON list, TruncatedJsonError after the
+    last complete one if the list was not closed."""
+    decoder = JsonListDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    if not decoder.finished:
+        raise TruncatedJsonError("JSON list was not closed")
+
+
+@dataclass
+class SalvagedList:
+    items: list[Any] = field(default_factory=list)
+    # False if the list was cut off, items then end before the cut.
+    complete: bool = True
+    skipped: int = 0
+
+
+def salvage_json_list(text: str) -> SalvagedList:
+    """Valid elements of the JSON list of a model response.
+
+    Unlike `extract_json` this does not fail on malformed elements or a
+    truncated tail, so that only what is missing has to be requested
+    again.
+    """
+    try:
+        value = extract_json(text)
+    except ValueError:
+        value = None
+    if isinstance(value, dict):
+        # JSON mode answers with an object wrapping the list.
+        lists = [item for item in value.values() if isinstance(item, list)]
+        if len(lists) == 1:
+            value = lists[0]
+    if isinstance(value, list):
+        return SalvagedList(value)
+    decoder = JsonListDecoder()
+    items = decoder.feed(_unfence(text))
+    return SalvagedList(items, decoder.finished, decoder.skipped)
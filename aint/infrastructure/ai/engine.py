@@ -0,0 +1,279 @@
+import email.utils
+import random
+import threading
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+_RETRYABLE_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Refills `rate` units per minute up to `capacity`.
+
+    The balance may go negative when actual usage turns out to be higher
+    than estimated, later acquisitions then wait for the debt to refill.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate / 60
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> float:
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount: float) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+
+class AdaptiveLimiter:
+    """Concurrency limit tuned with additive increase and
+    multiplicative decrease.
+
+    Throttling halves the limit, other transient failures shrink it a
+    little and every success grows it by about one slot per window.
+    Latency is not a signal, as answers of different prompts legitimately
+    take very different times.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1) -> None:
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        start = time.monotonic()
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+        return time.monotonic() - start
+
+    def release(self) -> None:
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_error(self) -> None:
+        with self._condition:
+            self.limit = max(self.minimum, self.limit * 0.9)
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 6
+    base_delay: float = 1
+    max_delay: float = 60
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt)
+        )
+
+
+@dataclass
+class EngineStats:
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    queue_time: float = 0
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return (
+        isinstance(exc, openai.APIStatusError)
+        and exc.status_code in _RETRYABLE_STATUSES
+    )
+
+
+class RequestEngine:
+    """Runs model calls within rate limits, retrying transient failures."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        retry: RetryPolicy | None = None,
+        timeout: float = 300,
+    ) -> None:
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.request_bucket = (
+            TokenBucket(requests_per_minute)
+            if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.retry = retry or RetryPolicy()
+        self.timeout = timeout
+        self.stats = EngineStats()
+        self._stats_lock = threading.Lock()
+
+    def _wait_for_budget(self, tokens: int) -> float:
+        waited = 0.0
+        if self.request_bucket is not None:
+            waited += self.request_bucket.acquire()
+        if self.token_bucket is not None:
+            waited += self.token_bucket.acquire(tokens)
+        return waited
+
+    def report_usage(self, estimated: int, actual: int) -> None:
+        if self.token_bucket is not None:
+            self.token_bucket.adjust(actual - estimated)
+
+    def _count(self, **increments: float) -> None:
+        with self._stats_lock:
+            for name, value in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+
+    def _acquire(self, tokens: int, metrics: dict[str, float]) -> None:
+        queued = self._wait_for_budget(tokens) + self.limiter.acquire()
+        self._count(requests=1, queue_time=queued)
+        metrics["queue_time"] = metrics.get("queue_time", 0) + queued
+
+    def _retry_delay(
+        self, exc: Exception, attempt: int, metrics: dict[str, float]
+    ) -> float | None:
+        """Delay before the next attempt, None if there is none."""
+        if not _is_retryable(exc) or attempt >= self.retry.max_attempts:
+            return None
+        delay = self.retry.backoff(attempt)
+        if isinstance(exc, openai.RateLimitError):
+            self.limiter.on_throttle()
+            self._count(throttled=1)
+        else:
+            self.limiter.on_error()
+        hint = _retry_after(exc)
+        if hint is not None:
+            delay = max(delay, min(hint, self.retry.max_delay))
+        self._count(retries=1)
+        metrics["retries"] = metrics.get("retries", 0) + 1
+        return delay
+
+    def run(
+        self,
+        call: Callable[[], T],
+        tokens: int,
+        metrics: dict[str, float] | None = None,
+    ) -> T:
+        if metrics is None:
+            metrics = {}
+        attempt = 0
+        while True:
+            self._acquire(tokens, metrics)
+            try:
+                result = call()
+            except Exception as exc:
+                self.limiter.release()
+                attempt += 1
+                delay = self._retry_delay(exc, attempt, metrics)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.limiter.release()
+            self.limiter.on_success()
+            return result
+
+    def run_stream(
+        self,
+        call: Callable[[], Iterator[T]],
+        tokens: int,
+        metrics: dict[str, float] | None = None,
+    ) -> Iterator[T]:
+        """Read a stream holding one slot until it ends.
+
+        Failures are retried like in `run` until the first chunk has been
+        passed on. Later ones are raised, as a stream cannot be resumed.
+        """
+        if metrics is None:
+            metrics = {}
+        attempt = 0
+        while True:
+            self._acquire(tokens, metrics)
+            passed_on = False
+            try:
+                for chunk in call():
+                    passed_on = True
+                    yield chunk
+            except Exception as exc:
+                self.limiter.release()
+                attempt += 1
+                delay = None if passed_on else self._retry_delay(
+                    exc, attempt, metrics
+                )
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.limiter.release()
+                raise
+            self.limiter.release()
+            self.limiter.on_success()
+            return
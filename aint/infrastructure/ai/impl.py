@@ -1,24 +1,56 @@
+import asyncio
 import json
-from dataclasses import dataclass
+import logging
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from dataclasses import dataclass, field
 from typing import Any
 
 import adaptix
+from adaptix.load_error import LoadError
 
 from aint.domain.flow import (
+    AsyncUnitCompiler,
+    CompilationError,
+    LinkConflictError,
     RuleExplainer,
     SourceParser,
     UnitCompiler,
     UnitLinker,
 )
 from aint.domain.gen import CompilationRule, GeneratedSource
-from aint.domain.syntax import ParseRule, SourceFile
+from aint.domain.syntax import ParseRule, SourceFile, SourceSpan
+from aint.domain.tracing import bind_context, tracer
 from aint.domain.units import LinkingRule, Unit, Workspace
-from aint.infrastructure.ai.client import AI
+from aint.infrastructure.ai.client import AI, estimate_tokens
+from aint.infrastructure.ai.decoding import (
+    SalvagedList,
+    TruncatedJsonError,
+    extract_json,
+    iter_json_list,
+    salvage_json_list,
+)
 from aint.infrastructure.ai.templates import (
-    COMPILE_UNIT_PROMPT, EXPLAIN_PROMPT,
-    LINK_UNITS_PROMPT, PARSE_SOURCE_PROMPT,
+    COMPILE_UNIT_PROMPT, COMPILE_UNITS_PROMPT, EXPLAIN_PROMPT,
+    LINK_REDUCE_PROMPT, LINK_UNITS_PROMPT, PARSE_SOURCE_PROMPT,
     render_templates,
 )
+from aint.infrastructure.local.chunking import boundary_chars, split_source
+from aint.infrastructure.local.rendering import (
+    render_template,
+    substitution_values,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _complete_json_list(text: str) -> SalvagedList:
+    salvaged = salvage_json_list(text)
+    if not salvaged.complete:
+        raise TruncatedJsonError("Response was cut off")
+    return salvaged
 
 
 @dataclass
@@ -29,7 +61,8 @@ class AIRuleExplainer(RuleExplainer):
         return self.ai.request(
             *render_templates(
                 EXPLAIN_PROMPT,
-                data={"rules": rules}
+                data={"rules": rules},
+                compact=self.ai.compact_prompts,
             )
         )
 
@@ -42,68 +75,629 @@ class _ParsedUnit:
 
 @dataclass
 class AISourceParser(SourceParser):
+    """Parses sources with the model.
+
+    Answers are not streamed: linking needs the units of every source,
+    so units decoded early would only wait for the rest.
+    """
+
     ai: AI
 
-    def parse_source(
+    def _request_units(
         self,
         rules: dict[str, ParseRule],
         source: SourceFile,
         parse_algo: str
     ) -> list[Unit]:
-        units_json = self.ai.request(
+        salvaged = self.ai.request_json(
             *render_templates(
                 PARSE_SOURCE_PROMPT,
-                data={"parse_algo": parse_algo, "code": source.content}
+                data={"parse_algo": parse_algo, "code": source.content},
+                compact=self.ai.compact_prompts,
+            ),
+            decode=salvage_json_list,
+        )
+        if not salvaged.complete:
+            raise TruncatedJsonError(
+                f"Units parsed from {source.path} were cut off"
             )
-        ).removeprefix("```json").removesuffix("```")
-        units_list = json.loads(units_json)
-        parsed_units = adaptix.load(units_list, list[_ParsedUnit])
-        return [
-            Unit(
-                used_rule=rules[parsed_unit.rule],
-                slots=parsed_unit.slots,
-                attributes={}
+        span = SourceSpan(
+            source.path, source.offset, source.offset + len(source.content)
+        )
+        units = []
+        for unit_dict in salvaged.items:
+            try:
+                parsed_unit = adaptix.load(unit_dict, _ParsedUnit)
+                used_rule = rules[parsed_unit.rule]
+            except (LoadError, KeyError):
+                logger.warning(
+                    "Skipping malformed unit parsed from %s: %r",
+                    source.path, unit_dict,
+                )
+                continue
+            units.append(
+                Unit(
+                    used_rule=used_rule,
+                    slots=parsed_unit.slots,
+                    attributes={},
+                    span=span,
+                )
             )
-            for parsed_unit in parsed_units
-        ]
+        return units
+
+    def parse_source(
+        self,
+        rules: dict[str, ParseRule],
+        source: SourceFile,
+        parse_algo: str
+    ) -> list[Unit]:
+        try:
+            return self._request_units(rules, source, parse_algo)
+        except TruncatedJsonError:
+            # Units after the cut are unknown, halves of the source are
+            # more likely to fit the output limit. Without a boundary
+            # past the middle the source is split at every boundary.
+            terminators = boundary_chars(list(rules.values()))
+            parts = split_source(
+                source, len(source.content) // 2, terminators
+            )
+            if len(parts) < 2:
+                parts = split_source(source, 1, terminators)
+            if len(parts) < 2:
+                raise
+            with tracer.span("parse_split", parts=len(parts)):
+                return [
+                    unit
+                    for part in parts
+                    for unit in self.parse_source(rules, part, parse_algo)
+                ]
+
+
+def unit_label(unit: Unit) -> str:
+    name = unit.slots.get("name")
+    return f"{unit.type} {name}" if name is not None else unit.type
+
+
+def split_by_tokens(
+    sizes: list[int], budget: int, base: int = 0
+) -> list[list[int]]:
+    """Group item positions so that each group's size fits the budget."""
+    groups = []
+    group: list[int] = []
+    group_size = base
+    for position, size in enumerate(sizes):
+        if group and group_size + size > budget:
+            groups.append(group)
+            group = []
+            group_size = base
+        group.append(position)
+        group_size += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _unit_tokens(unit: Unit) -> int:
+    return estimate_tokens(
+        json.dumps([unit.slots, unit.attributes], default=str)
+    ) * 3
+
+
+def _change_targets(
+    changes: list[dict[str, Any]], rule: LinkingRule, unit_count: int
+) -> dict[tuple[str, int | None, str], Any]:
+    """Map changes to their targets, later changes win.
+
+    Malformed changes, changes of unknown units and of workspace
+    attributes the rule does not write are left out.
+    """
+    targets = {}
+    for change in changes:
+        if not (
+            isinstance(change, dict)
+            and isinstance(change.get("name"), str)
+            and "value" in change
+        ):
+            continue
+        index = change.get("index")
+        if change.get("type") == "set_workspace_attr":
+            if not rule.may_write(change["name"]):
+                logger.warning(
+                    "Linking rule %r may not set workspace attribute %r, "
+                    "change dropped",
+                    rule.name,
+                    change["name"],
+                )
+                continue
+            targets[change["type"], None, change["name"]] = change["value"]
+        elif (
+            change.get("type") == "set_unit_attr"
+            and isinstance(index, int)
+            and 0 <= index < unit_count
+        ):
+            targets[change["type"], index, change["name"]] = change["value"]
+    return targets
+
+
+def _given_units_changes(
+    rule: LinkingRule,
+    changes: list[Any],
+    indexed_units: list[tuple[int, Unit]],
+) -> list[Any]:
+    """Leave out changes of units the request was not given, which
+    requests for other parts of the units may set differently."""
+    given = {index for index, _ in indexed_units}
+    kept = [
+        change for change in changes
+        if not isinstance(change, dict)
+        or change.get("type") != "set_unit_attr"
+        or (
+            isinstance(change.get("index"), int)
+            and change["index"] in given
+        )
+    ]
+    if len(kept) < len(changes):
+        logger.warning(
+            "Linking rule %r changed %d units it was not given, "
+            "changes dropped",
+            rule.name,
+            len(changes) - len(kept),
+        )
+    return kept
+
+
+@dataclass
+class _Conflict:
+    type: str
+    index: int | None
+    name: str
+    values: list[Any]
 
 
 @dataclass
 class AIUnitLinker(UnitLinker):
     ai: AI
+    shard_tokens: int | None = None
+    jobs: int = 4
+
+    def request_changes(
+        self,
+        attributes: dict[str, Any],
+        rule: LinkingRule,
+        indexed_units: list[tuple[int, Unit]],
+    ) -> list[list[dict[str, Any]]]:
+        """Changes for the units, in several parts if the answer for all
+        of them was cut off and the rule is shard-local."""
+        # A cut off answer of a global rule cannot be completed by parts,
+        # which would miss relations between them. It is not cached, so
+        # that it is requested again next time.
+        decode = (
+            salvage_json_list if rule.scope == "shard"
+            else _complete_json_list
+        )
+        try:
+            salvaged = self.ai.request_json(
+                *render_templates(
+                    LINK_UNITS_PROMPT,
+                    data={
+                        "units": indexed_units,
+                        "attributes": attributes,
+                        "rule": rule,
+                    },
+                    compact=self.ai.compact_prompts,
+                ),
+                decode=decode,
+            )
+        except TruncatedJsonError as exc:
+            raise TruncatedJsonError(
+                f"Changes of linking rule {rule.name!r} were cut off"
+            ) from exc
+        if salvaged.complete:
+            return [
+                _given_units_changes(rule, salvaged.items, indexed_units)
+            ]
+        if len(indexed_units) < 2:
+            raise TruncatedJsonError(
+                f"Changes of linking rule {rule.name!r} were cut off"
+            )
+        # Like shards, the halves' changes are merged and reconciled.
+        half = len(indexed_units) // 2
+        with tracer.span("link_split", units=len(indexed_units)):
+            return [
+                *self.request_changes(
+                    attributes, rule, indexed_units[:half]
+                ),
+                *self.request_changes(
+                    attributes, rule, indexed_units[half:]
+                ),
+            ]
+
+    def _request_shard(
+        self,
+        attributes: dict[str, Any],
+        rule: LinkingRule,
+        units: list[Unit],
+        number: int,
+        shard: list[int],
+    ) -> list[list[dict[str, Any]]]:
+        with tracer.span("link_shard", shard=number):
+            return self.request_changes(
+                attributes, rule, [(i, units[i]) for i in shard]
+            )
+
+    def _map_shards(
+        self,
+        attributes: dict[str, Any],
+        rule: LinkingRule,
+        units: list[Unit],
+    ) -> list[list[dict[str, Any]]]:
+        base = estimate_tokens(rule.rule + json.dumps(attributes))
+        if self.shard_tokens is None or rule.scope != "shard":
+            shards = [list(range(len(units)))]
+        else:
+            shards = split_by_tokens(
+                [_unit_tokens(unit) for unit in units],
+                self.shard_tokens,
+                base,
+            )
+        if len(shards) == 1:
+            return self.request_changes(
+                attributes, rule, list(enumerate(units))
+            )
+        with ThreadPoolExecutor(
+            max_workers=min(self.jobs, len(shards)),
+            thread_name_prefix="aint-link",
+        ) as executor:
+            return [
+                changes
+                for shard_changes in executor.map(
+                    bind_context(
+                        lambda number, shard: self._request_shard(
+                            attributes, rule, units, number, shard
+                        )
+                    ),
+                    range(len(shards)),
+                    shards,
+                )
+                for changes in shard_changes
+            ]
+
+    def _reduce(
+        self,
+        attributes: dict[str, Any],
+        rule: LinkingRule,
+        conflicts: list[_Conflict],
+    ) -> list[dict[str, Any]]:
+        return self.ai.request_json(
+            *render_templates(
+                LINK_REDUCE_PROMPT,
+                data={
+                    "conflicts": conflicts,
+                    "attributes": attributes,
+                    "rule": rule,
+                },
+                compact=self.ai.compact_prompts,
+            ),
+            decode=salvage_json_list,
+        ).items
 
     def apply_rule(self, workspace: Workspace, rule: LinkingRule) -> None:
         units = workspace.units_of_types(*rule.select)
-        changes_json = self.ai.request(
-            *render_templates(
-                LINK_UNITS_PROMPT,
-                data={"units": units, "workspace": workspace, "rule": rule}
-            )
-        ).removeprefix("```json").removesuffix("```")
-        changes_list = json.loads(changes_json)
-        for change in changes_list:
-            if change["type"] == "set_workspace_attr":
-                workspace.attributes[change["name"]] = change["value"]
-            elif change["type"] == "set_unit_attr":
-                units[change["index"]].attributes[change["name"]] = change["value"]
+        attributes = workspace.read_attributes(rule.reads)
+        merged: dict[tuple[str, int | None, str], list[Any]] = {}
+        for shard_changes in self._map_shards(attributes, rule, units):
+            for target, value in _change_targets(
+                shard_changes, rule, len(units)
+            ).items():
+                values = merged.setdefault(target, [])
+                if value not in values:
+                    values.append(value)
+        conflicts = [
+            _Conflict(*target, values)
+            for target, values in merged.items()
+            if len(values) > 1
+        ]
+        if conflicts:
+            with tracer.span("link_reduce", conflicts=len(conflicts)):
+                resolved = _change_targets(
+                    self._reduce(attributes, rule, conflicts),
+                    rule,
+                    len(units),
+                )
+            unresolved = []
+            for conflict in conflicts:
+                target = (conflict.type, conflict.index, conflict.name)
+                if target in resolved:
+                    merged[target] = [resolved[target]]
+                else:
+                    unresolved.append(
+                        conflict.name if conflict.index is None
+                        else f"{conflict.name} of unit {conflict.index}"
+                    )
+            if unresolved:
+                raise LinkConflictError(rule, unresolved)
+        for (change_type, index, name), values in merged.items():
+            if change_type == "set_workspace_attr":
+                workspace.set_attr(name, values[-1])
+            else:
+                workspace.set_unit_attr(units[index], name, values[-1])
+
+
+def plan_batches(
+    workspace: Workspace,
+    rule: CompilationRule,
+    units: list[Unit],
+    batch_tokens: int | None,
+) -> list[list[Unit]]:
+    """Group units so that each batched prompt fits the token budget."""
+    if batch_tokens is None:
+        return [[unit] for unit in units]
+    base_tokens = estimate_tokens(
+        rule.template + rule.path + json.dumps(workspace.attributes)
+    )
+    return [
+        [units[position] for position in batch]
+        for batch in split_by_tokens(
+            [_unit_tokens(unit) for unit in units], batch_tokens, base_tokens
+        )
+    ]
+
+
+def _decode_source(text: str) -> GeneratedSource:
+    return adaptix.load(extract_json(text), GeneratedSource)
 
 
 @dataclass
-class AIUnitCompiler(UnitCompiler):
+class _IndexedSource:
+    index: int
+    path: str
+    content: str
+
+
+@dataclass
+class _AIUnitCompilerBase:
     ai: AI
+    batch_tokens: int | None = None
+    stream: bool = False
 
-    def compile(
-        self, workspace: Workspace, rule: CompilationRule
-    ) -> list[GeneratedSource]:
-        units = workspace.units_of_types(rule.unit_type)
-        generated = []
-        for unit in units:
-            generated_json = self.ai.request(
+    def _emit(
+        self,
+        workspace: Workspace,
+        rule: CompilationRule,
+        unit: Unit,
+        source: GeneratedSource,
+    ) -> GeneratedSource:
+        # Paths are deterministic whenever the path template is plain
+        # substitution, whatever the model answered.
+        path = render_template(
+            rule.path, substitution_values(unit, workspace.attributes)
+        )
+        if path is not None:
+            source = GeneratedSource(path, source.content)
+        return source
+
+    def _compile_unit(
+        self, workspace: Workspace, rule: CompilationRule, unit: Unit
+    ) -> GeneratedSource:
+        with tracer.span("compile_unit", unit=unit_label(unit)):
+            return self._compile_unit_request(workspace, rule, unit)
+
+    def _compile_unit_request(
+        self, workspace: Workspace, rule: CompilationRule, unit: Unit
+    ) -> GeneratedSource:
+        return self._emit(
+            workspace,
+            rule,
+            unit,
+            self.ai.request_json(
                 *render_templates(
                     COMPILE_UNIT_PROMPT,
-                    data={"unit": unit, "workspace": workspace, "rule": rule}
+                    data={
+                        "unit": unit, "workspace": workspace, "rule": rule
+                    },
+                    compact=self.ai.compact_prompts,
+                ),
+                decode=_decode_source,
+            ),
+        )
+
+    def _request_batch(
+        self,
+        workspace: Workspace,
+        rule: CompilationRule,
+        units: list[Unit],
+        on_source: Callable[[int, GeneratedSource], None] | None = None,
+    ) -> dict[int, GeneratedSource]:
+        prompts = render_templates(
+            COMPILE_UNITS_PROMPT,
+            data={
+                "units": list(enumerate(units)),
+                "workspace": workspace,
+                "rule": rule,
+            },
+            compact=self.ai.compact_prompts,
+        )
+        # Units missing from a partly broken answer are requested again.
+        if self.stream:
+            items = iter_json_list(
+                self.ai.request_stream(
+                    *prompts, json_mode=True, validate=_complete_json_list
                 )
-            ).removeprefix("```json").removesuffix("```")
-            generated_dict = json.loads(generated_json)
-            generated.append(adaptix.load(generated_dict, GeneratedSource))
-        return generated
+            )
+        else:
+            items = self.ai.request_json(
+                *prompts, decode=salvage_json_list
+            ).items
+        by_index: dict[int, GeneratedSource] = {}
+        try:
+            for item in items:
+                try:
+                    indexed = adaptix.load(item, _IndexedSource)
+                except LoadError:
+                    continue
+                if 0 <= indexed.index < len(units) and (
+                    indexed.index not in by_index
+                ):
+                    by_index[indexed.index] = self._emit(
+                        workspace,
+                        rule,
+                        units[indexed.index],
+                        GeneratedSource(indexed.path, indexed.content),
+                    )
+                    if on_source is not None:
+                        on_source(indexed.index, by_index[indexed.index])
+        except ValueError:
+            pass
+        return by_index
+
+    def _compile_batch(
+        self,
+        workspace: Workspace,
+        rule: CompilationRule,
+        units: list[Unit],
+        on_source: Callable[[int, GeneratedSource], None] | None = None,
+    ) -> list[GeneratedSource]:
+        """Sources of the units, those of the batch request also passed
+        to `on_source` as they are decoded."""
+        if len(units) == 1:
+            return [self._compile_unit(workspace, rule, units[0])]
+        try:
+            with tracer.span("compile_batch", units=len(units)):
+                by_index = self._request_batch(
+                    workspace, rule, units, on_source
+                )
+        except ValueError:
+            by_index = {}
+        missing = [i for i in range(len(units)) if i not in by_index]
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if part:
+                by_index.update(
+                    zip(
+                        part,
+                        self._compile_batch(
+                            workspace, rule, [units[i] for i in part]
+                        ),
+                        strict=True,
+                    )
+                )
+        return [by_index[i] for i in range(len(units))]
+
+
+@dataclass
+class AIUnitCompiler(_AIUnitCompilerBase, UnitCompiler):
+    def compile(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> Iterator[GeneratedSource]:
+        units = workspace.units_of_types(rule.unit_type)
+        for batch in plan_batches(workspace, rule, units, self.batch_tokens):
+            yield from self._compile_batch(workspace, rule, batch)
+
+
+@dataclass
+class _RunningBatch:
+    future: asyncio.Future[list[GeneratedSource]]
+    # Sources of a streamed batch as they are decoded, ended by None.
+    decoded: asyncio.Queue[tuple[int, GeneratedSource] | None] | None
+
+    async def sources(self) -> AsyncIterator[GeneratedSource]:
+        """The batch's sources in unit order, streamed ones as soon as
+        those before them are."""
+        passed = 0
+        if self.decoded is not None:
+            early: dict[int, GeneratedSource] = {}
+            while (item := await self.decoded.get()) is not None:
+                early[item[0]] = item[1]
+                while passed in early:
+                    yield early.pop(passed)
+                    passed += 1
+        for source in (await self.future)[passed:]:
+            yield source
+
+
+@dataclass
+class AIAsyncUnitCompiler(_AIUnitCompilerBase, AsyncUnitCompiler):
+    """Compiles batches concurrently.
+
+    With `stream` the sources of a batch request are passed on while the
+    model is still writing the rest. Single units are not streamed, an
+    answer with one source is of no use before it is complete.
+    """
+
+    jobs: int = 8
+    _executor: ThreadPoolExecutor | None = field(
+        default=None, init=False, repr=False
+    )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.jobs, thread_name_prefix="aint-compile"
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _start_batch(
+        self, workspace: Workspace, rule: CompilationRule, units: list[Unit]
+    ) -> _RunningBatch:
+        loop = asyncio.get_running_loop()
+        compile_batch = bind_context(self._compile_batch)
+        if not self.stream:
+            return _RunningBatch(
+                loop.run_in_executor(
+                    self._get_executor(), compile_batch, workspace, rule, units
+                ),
+                None,
+            )
+        decoded: asyncio.Queue[tuple[int, GeneratedSource] | None] = (
+            asyncio.Queue()
+        )
+
+        def on_source(index: int, source: GeneratedSource) -> None:
+            loop.call_soon_threadsafe(decoded.put_nowait, (index, source))
+
+        def run() -> list[GeneratedSource]:
+            try:
+                return compile_batch(workspace, rule, units, on_source)
+            finally:
+                loop.call_soon_threadsafe(decoded.put_nowait, None)
+
+        return _RunningBatch(
+            loop.run_in_executor(self._get_executor(), run), decoded
+        )
+
+    async def compile(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> AsyncIterator[GeneratedSource]:
+        units = workspace.units_of_types(rule.unit_type)
+        batches = iter(
+            plan_batches(workspace, rule, units, self.batch_tokens)
+        )
+        # Sources are yielded in unit order. Batches run at most twice the
+        # jobs ahead of the oldest unfinished one, which bounds how many
+        # finished ones wait in memory.
+        window = 2 * self.jobs
+        running: deque[_RunningBatch] = deque()
+        compiled = 0
+        errors = []
+        try:
+            while True:
+                for batch in islice(batches, window - len(running)):
+                    running.append(self._start_batch(workspace, rule, batch))
+                if not running:
+                    break
+                try:
+                    async for source in running.popleft().sources():
+                        compiled += 1
+                        yield source
+                except Exception as exc:
+                    errors.append(exc)
+        finally:
+            for batch in running:
+                batch.future.cancel()
+        if errors:
+            raise CompilationError([], errors, compiled)
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any
+
+import openai
+
+
+@dataclass
+class Endpoint:
+    name: str
+    client: openai.Client
+    model: str
+    # Average latency above which the endpoint is only used as fallback.
+    max_latency: float | None = None
+    # Whether the provider supports `response_format` JSON mode.
+    json_mode: bool = False
+
+
+@dataclass
+class Route:
+    # Endpoint names in order of preference.
+    endpoints: list[str]
+    stage: str | None = None
+    rule: str | None = None
+
+    def matches(self, tags: Mapping[str, Any]) -> bool:
+        return (
+            (self.stage is None or tags.get("stage") == self.stage)
+            and (self.rule is None or tags.get("rule") == self.rule)
+        )
+
+    @property
+    def specificity(self) -> int:
+        return (self.stage is not None) + 2 * (self.rule is not None)
+
+
+@dataclass
+class _Health:
+    latency: float | None = None
+    failures: int = 0
+    cooldown_until: float = 0
+
+
+@dataclass
+class RouteStats:
+    requests: int = 0
+    fallbacks: int = 0
+    failures: int = 0
+    latency: float = 0
+
+
+class ModelRouter:
+    """Picks endpoints for a request by its stage and rule tags.
+
+    Endpoints are tried in route order. One that failed `max_failures`
+    times in a row is put on cooldown, one slower on average than its
+    `max_latency` is tried after the others, both remain last resorts.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[Endpoint],
+        routes: list[Route],
+        max_failures: int = 2,
+        cooldown: float = 60,
+    ) -> None:
+        self.endpoints = {endpoint.name: endpoint for endpoint in endpoints}
+        for route in routes:
+            unknown = set(route.endpoints) - self.endpoints.keys()
+            if unknown:
+                raise ValueError(
+                    f"Route refers to unknown endpoints {sorted(unknown)}"
+                )
+        # Most specific route first, declaration order among equals.
+        self.routes = sorted(
+            routes, key=lambda route: route.specificity, reverse=True
+        )
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.stats: dict[tuple[str, str, str], RouteStats] = {}
+        self._health = {name: _Health() for name in self.endpoints}
+        self._lock = threading.Lock()
+
+    def route(self, tags: Mapping[str, Any]) -> list[Endpoint] | None:
+        """Endpoints configured for the tags, None if no route matches."""
+        for route in self.routes:
+            if route.matches(tags):
+                return [self.endpoints[name] for name in route.endpoints]
+        return None
+
+    def _rank(self, endpoint: Endpoint, now: float) -> int:
+        health = self._health.get(endpoint.name)
+        if health is None:
+            return 0
+        if health.cooldown_until > now:
+            return 2
+        if (
+            endpoint.max_latency is not None
+            and health.latency is not None
+            and health.latency > endpoint.max_latency
+        ):
+            return 1
+        return 0
+
+    def order(self, endpoints: list[Endpoint]) -> list[Endpoint]:
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                endpoints, key=lambda endpoint: self._rank(endpoint, now)
+            )
+
+    def _route_stats(
+        self, endpoint: Endpoint, tags: Mapping[str, Any]
+    ) -> RouteStats:
+        key = (
+            str(tags.get("stage", "-")),
+            str(tags.get("rule", "-")),
+            endpoint.name,
+        )
+        return self.stats.setdefault(key, RouteStats())
+
+    def record_success(
+        self,
+        endpoint: Endpoint,
+        tags: Mapping[str, Any],
+        latency: float,
+        fallback: bool,
+    ) -> None:
+        with self._lock:
+            health = self._health.setdefault(endpoint.name, _Health())
+            health.failures = 0
+            health.latency = latency if health.latency is None else (
+                0.8 * health.latency + 0.2 * latency
+            )
+            stats = self._route_stats(endpoint, tags)
+            stats.requests += 1
+            stats.fallbacks += fallback
+            stats.latency += latency
+
+    def record_failure(
+        self, endpoint: Endpoint, tags: Mapping[str, Any]
+    ) -> None:
+        with self._lock:
+            health = self._health.setdefault(endpoint.name, _Health())
+            health.failures += 1
+            if health.failures >= self.max_failures:
+                health.cooldown_until = time.monotonic() + self.cooldown
+            self._route_stats(endpoint, tags).failures += 1
@@ -1,265 +1,454 @@
 import textwrap
-from typing import Any
+from functools import cache, cached_property
+from typing import TYPE_CHECKING, Any
 
-from jinja2 import Environment, Template
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
 
 
-def _t(text: str) -> Template:
-    return Environment().from_string(textwrap.dedent(text))
+@cache
+def _environment(compact: bool) -> "Environment":
+    # Imported on first render, so that importing prompts stays cheap.
+    from jinja2 import Environment
+
+    if compact:
+        return _environment(compact=False).overlay(
+            trim_blocks=True, lstrip_blocks=True
+        )
+    return Environment()
+
+
+def _compact(text: str) -> str:
+    # Indentation of the template source is markup only, rendered values
+    # such as code and code templates keep their own whitespace.
+    return "\n".join(
+        line.strip() for line in text.splitlines() if line.strip()
+    )
+
+
+class Prompt:
+    """System and user templates in verbose and compact renderings.
+
+    User templates put content shared by many requests (rule text,
+    templates, workspace attributes) before per-request content, so that
+    providers can reuse a cached prompt prefix. Attributes are rendered
+    sorted by name, whatever order concurrent linking set them in.
+    Templates are compiled on first use.
+    """
+
+    def __init__(self, system: str, user: str) -> None:
+        self.system = textwrap.dedent(system)
+        self.user = textwrap.dedent(user)
+
+    @cached_property
+    def verbose(self) -> tuple["Template", "Template"]:
+        environment = _environment(compact=False)
+        return (
+            environment.from_string(self.system),
+            environment.from_string(self.user),
+        )
+
+    @cached_property
+    def compact(self) -> tuple["Template", "Template"]:
+        environment = _environment(compact=True)
+        return (
+            environment.from_string(_compact(self.system)),
+            environment.from_string(_compact(self.user)),
+        )
 
 
 def render_templates(
-    templates: tuple[Template, Template],
-    data: dict[str, Any]
+    prompt: Prompt,
+    data: dict[str, Any],
+    compact: bool = True,
 ) -> tuple[str, str]:
-    sys_template, user_template = templates
+    sys_template, user_template = (
+        prompt.compact if compact else prompt.verbose
+    )
     sys_template_s = sys_template.render(**data)
     user_template_s = user_template.render(**data)
     return sys_template_s, user_template_s
 
 
-EXPLAIN_PROMPT = (
-    _t(
-        """
-        <role>You're an AI-powered compiler.</role> 
-        <user-input>
-            A definition of a language in semi-free form. `$` denotes a
-            slot (variable) in syntactic construction, `#` starts a line
-            comment.
-        </user-input>
-        <task>
-            Based on definition given by user, create instructions for LLM
-            to parse programs using provided grammar. 
-        </task>
-        <output>
-            <format>XML</format>
-            <template>
-                <steps>
-                    <step>Step to parse</step>
-                </steps>
-                <rules>
-                    <rule>
-                        <name>Rule name exactly as in input data</name>
-                        <description>Rule description</description>
-                        <slots>
-                            <slot>
-                                <name>Slot name exactly as in input data</name>
-                                <type>Slot type exactly as in input data</type>
-                                <description>Slot description</description>
-                            </slot>
-                        </slots>
-                        <pattern>Rule pattern exactly as in input data</pattern>
-                    </rule>
-                </rules>
-            </template>
-            <example>
-                <steps>
-                    <step>Parse the input text to identify and extract syntactic constructions based on the provided grammar rules.</step>
-                    <step>For each identified construction, match the pattern and extract the slot values according to their types.</step>
-                    <step>Validate that the extracted slot values conform to their specified types (e.g., string, integer, etc.).</step>
-                    <step>Generate a structured representation of the parsed input, including the rule name, slot names, slot types, and extracted values.</step>
-                    <step>Return the structured representation as the output of the parsing process.</step>
-                </steps>
-                <rules>
-                    <rule>
-                        <name>addition</name>
-                        <description>Rule for parsing addition operations in the language.</description>
-                        <slots>
-                            <slot>
-                                <name>a</name>
-                                <type>string</type>
-                                <description>The first operand in the addition operation.</description>
-                            </slot>
-                            <slot>
-                                <name>b</name>
-                                <type>string</type>
-                                <description>The second operand in the addition operation.</description>
-                            </slot>
-                        </slots>
-                        <pattern>add $a to $b</pattern>
-                    </rule>
-                </rules>
-            </example>
-        </output>
-        """
-    ),
-    _t(
-        """
-        {% for rule in rules %}
-        <rule>
-            <name>{{ rule.name }}</name>
+EXPLAIN_PROMPT = Prompt(
+    """
+    <role>You're an AI-powered compiler.</role> 
+    <user-input>
+        A definition of a language in semi-free form. `$` denotes a
+        slot (variable) in syntactic construction, `#` starts a line
+        comment.
+    </user-input>
+    <task>
+        Based on definition given by user, create instructions for LLM
+        to parse programs using provided grammar. 
+    </task>
+    <output>
+        <format>XML</format>
+        <template>
+            <steps>
+                <step>Step to parse</step>
+            </steps>
+            <rules>
+                <rule>
+                    <name>Rule name exactly as in input data</name>
+                    <description>Rule description</description>
+                    <slots>
+                        <slot>
+                            <name>Slot name exactly as in input data</name>
+                            <type>Slot type exactly as in input data</type>
+                            <description>Slot description</description>
+                        </slot>
+                    </slots>
+                    <pattern>Rule pattern exactly as in input data</pattern>
+                </rule>
+            </rules>
+        </template>
+        <example>
+            <steps>
+                <step>Parse the input text to identify and extract syntactic constructions based on the provided grammar rules.</step>
+                <step>For each identified construction, match the pattern and extract the slot values according to their types.</step>
+                <step>Validate that the extracted slot values conform to their specified types (e.g., string, integer, etc.).</step>
+                <step>Generate a structured representation of the parsed input, including the rule name, slot names, slot types, and extracted values.</step>
+                <step>Return the structured representation as the output of the parsing process.</step>
+            </steps>
+            <rules>
+                <rule>
+                    <name>addition</name>
+                    <description>Rule for parsing addition operations in the language.</description>
+                    <slots>
+                        <slot>
+                            <name>a</name>
+                            <type>string</type>
+                            <description>The first operand in the addition operation.</description>
+                        </slot>
+                        <slot>
+                            <name>b</name>
+                            <type>string</type>
+                            <description>The second operand in the addition operation.</description>
+                        </slot>
+                    </slots>
+                    <pattern>add $a to $b</pattern>
+                </rule>
+            </rules>
+        </example>
+    </output>
+    """,
+    """
+    {% for rule in rules %}
+    <rule>
+        <name>{{ rule.name }}</name>
+        <slots>
+            {% for name, type in rule.slots.items() %}
+            <slot name="{{ name }}" type="{{ type }}"/>
+            {% endfor %}
+        </slots>
+        <pattern>
+            {{ rule.pattern }}
+        </pattern>
+    </rule>
+    {% endfor %}
+    """,
+)
+
+PARSE_SOURCE_PROMPT = Prompt(
+    """
+    <role>You're an AI-powered compiler.</role> 
+    <user-input>A program in defined language.</user-input>
+    <parse-instructions>{{ parse_algo }}</parse-instructions>
+    <task>Based on given instructions parse given program.</task>
+    <output>
+        <format>JSON list</format>
+        <template>
+            [{"rule": parse rule used name, 
+            "slots": {slot name: slot value}}]
+        </template>
+        <example>
+            [{"rule": "addition", "slots": {"a": "1", "b": "2"}}]
+        </example>
+    </output>
+    """,
+    """
+    <code>{{ code }}</code>
+    """,
+)
+
+LINK_UNITS_PROMPT = Prompt(
+    """
+    <role>You're an AI-powered compiler.</role> 
+    <user-input>
+        A rule followed by workspace attributes and a list of
+        compilation units.
+    </user-input>
+    <task>
+        Based on given rule carry out attribute modification (if needed)
+        on every affected unit and modify workspace attributes (if needed,
+        only settable ones when they are listed).
+    </task>
+    <output>
+        <format>JSON list of modifications</format>
+        <template>
+            [
+                {
+                    "type": "set_workspace_attr", 
+                    "name": attr name, 
+                    "value": attr value
+                },
+                {
+                    "type": "set_unit_attr",
+                    "index": index attribute of unit in input list,
+                    "name": attr name, 
+                    "value": attr value
+                }
+            ]
+        </template>
+        <example>
+            [
+                {
+                    "type": "set_workspace_attr", 
+                    "name": "package_path",
+                    "value": "com.my.package"
+                },
+                {
+                    "type": "set_unit_attr",
+                    "index": 425,
+                    "name": "used_by", 
+                    "value": ["unit 1234", "unit 5234"]
+                }
+            ]
+        </example>
+    </output>
+    """,
+    """
+    <rule>
+        {{ rule.rule }}
+    </rule>
+    {% if rule.writes is not none %}
+    <settable-workspace-attributes>
+        {{ rule.writes | join(", ") }}
+    </settable-workspace-attributes>
+    {% endif %}
+    {% if attributes %}
+    <workspace-attributes>
+        {% for name, value in attributes | dictsort(true) %}
+        <{{ name }}>{{ value }}</{{ name }}>
+        {% endfor %}
+    </workspace-attributes>
+    {% endif %}
+    <units>
+        {% for index, unit in units %}
+        <unit index="{{ index }}">
+            <type>{{ unit.type }}</type>
+            {% if unit.slots %}
             <slots>
-                {% for name, type in rule.slots.items() %}
-                <slot name="{{ name }}" type="{{ type }}"/>
+                {% for name, value in unit.slots.items() %}
+                <{{ name }}>{{ value }}</{{ name }}>
                 {% endfor %}
             </slots>
-            <pattern>
-                {{ rule.pattern }}
-            </pattern>
-        </rule>
+            {% endif %}
+            {% if unit.attributes %}
+            <attributes>
+                {% for name, value in unit.attributes | dictsort(true) %}
+                <{{ name }}>{{ value }}</{{ name }}>
+                {% endfor %}
+            </attributes>
+            {% endif %}
+        </unit>
         {% endfor %}
-        """
-    )
+    </units>
+    """,
 )
 
-PARSE_SOURCE_PROMPT = (
-    _t(
-        """
-        <role>You're an AI-powered compiler.</role> 
-        <user-input>A program in defined language.</user-input>
-        <parse-instructions>{{ parse_algo }}</parse-instructions>
-        <task>Based on given instructions parse given program.</task>
-        <output>
-            <format>JSON list</format>
-            <template>
-                [{"rule": parse rule used name, 
-                "slots": {slot name: slot value}}]
-            </template>
-            <example>
-                [{"rule": "addition", "slots": {"a": "1", "b": "2"}}]
-            </example>
-        </output>
-        """
-    ),
-    _t(
-        """
-        <code>{{ code }}</code>
-        """
-    )
-)
-
-LINK_UNITS_PROMPT = (
-    _t(
-        """
-        <role>You're an AI-powered compiler.</role> 
-        <user-input>
-            A list of compilation units and workspace attributes
-            followed by a some rule.
-        </user-input>
-        <task>
-            Based on given rule carry out attribute modification (if needed)
-            on every affected unit and modify workspace attributes (if needed).
-        </task>
-        <output>
-            <format>JSON list of modifications</format>
-            <template>
-                [
-                    {
-                        "type": "set_workspace_attr", 
-                        "name": attr name, 
-                        "value": attr value
-                    },
-                    {
-                        "type": "set_unit_attr",
-                        "index": index of unit in input list starting from 0,
-                        "name": attr name, 
-                        "value": attr value
-                    }
-                ]
-            </template>
-            <example>
-                [
-                    {
-                        "type": "set_workspace_attr", 
-                        "name": "package_path",
-                        "value": "com.my.package"
-                    },
-                    {
-                        "type": "set_unit_attr",
-                        "index": 425,
-                        "name": "used_by", 
-                        "value": ["unit 1234", "unit 5234"]
-                    }
-                ]
-            </example>
-        </output>
-        """
-    ),
-    _t(
-        """
-        <units>
-            {% for unit in units %}
-            <unit>
-                <type>{{ unit.type }}</type>
-                <slots>
-                    {% for name, value in unit.slots.items() %}
-                    <{{ name }}>{{ value }}</{{ name }}>
-                    {% endfor %}
-                </slots>
-                <attributes>
-                    {% for name, value in unit.attributes.items() %}
-                    <{{ name }}>{{ value }}</{{ name }}>
-                    {% endfor %}
-                </attributes>
-            </unit>
+COMPILE_UNIT_PROMPT = Prompt(
+    """
+    <role>You're an AI-powered compiler.</role> 
+    <user-input>
+        Generated file path template,
+        compilation template,
+        workspace attributes,
+        a compilation unit.
+    </user-input>
+    <task>Compile unit and create path from template.</task>
+    <output>
+        <format>JSON</format>
+        <template>
+            {
+                "path": file path,
+                "content": compiled code
+            }
+        </template>
+        <example>
+            {
+                "path": "com/my/package/file.py",
+                "content": "print('Hello, World')"
+            }
+        </example>
+    </output>
+    """,
+    """
+    <path-template>
+        {{ rule.path }}
+    </path-template>
+    <code-template>
+        {{ rule.template }}
+    </code-template>
+    {% if workspace.attributes %}
+    <workspace-attributes>
+        {% for name, value in workspace.attributes | dictsort(true) %}
+        <{{ name }}>{{ value }}</{{ name }}>
+        {% endfor %}
+    </workspace-attributes>
+    {% endif %}
+    <unit>
+        <type>{{ unit.type }}</type>
+        {% if unit.slots %}
+        <slots>
+            {% for name, value in unit.slots.items() %}
+            <{{ name }}>{{ value }}</{{ name }}>
             {% endfor %}
-        </units>
-        <workspace-attributes>
-            {% for name, value in workspace.attributes.items() %}
+        </slots>
+        {% endif %}
+        {% if unit.attributes %}
+        <attributes>
+            {% for name, value in unit.attributes | dictsort(true) %}
             <{{ name }}>{{ value }}</{{ name }}>
             {% endfor %}
-        </workspace-attributes>
-        <rule>
-            {{ rule }}
-        </rule>
-        """
-    )
+        </attributes>
+        {% endif %}
+    </unit>
+    """,
 )
 
-COMPILE_UNIT_PROMPT = (
-    _t(
-        """
-        <role>You're an AI-powered compiler.</role> 
-        <user-input>
-            A compilation unit, 
-            workspace attributes,
-            generated file path template,
-            compilation template.
-        </user-input>
-        <task>Compile unit and create path from template.</task>
-        <output>
-            <format>JSON</format>
-            <template>
+COMPILE_UNITS_PROMPT = Prompt(
+    """
+    <role>You're an AI-powered compiler.</role> 
+    <user-input>
+        Generated file path template,
+        compilation template,
+        workspace attributes,
+        a list of indexed compilation units of the same type.
+    </user-input>
+    <task>
+        Compile every unit separately and create its path from template.
+    </task>
+    <output>
+        <format>JSON list with exactly one entry per unit</format>
+        <template>
+            [
                 {
+                    "index": index of unit as given in input,
                     "path": file path,
                     "content": compiled code
                 }
-            </template>
-            <example>
+            ]
+        </template>
+        <example>
+            [
                 {
+                    "index": 0,
                     "path": "com/my/package/file.py",
                     "content": "print('Hello, World')"
                 }
-            </example>
-        </output>
-        """
-    ),
-    _t(
-        """
-        <unit>
-            <type>{{ unit.type }}</type>
+            ]
+        </example>
+    </output>
+    """,
+    """
+    <path-template>
+        {{ rule.path }}
+    </path-template>
+    <code-template>
+        {{ rule.template }}
+    </code-template>
+    {% if workspace.attributes %}
+    <workspace-attributes>
+        {% for name, value in workspace.attributes | dictsort(true) %}
+        <{{ name }}>{{ value }}</{{ name }}>
+        {% endfor %}
+    </workspace-attributes>
+    {% endif %}
+    <units type="{{ rule.unit_type }}">
+        {% for index, unit in units %}
+        <unit index="{{ index }}">
+            {% if unit.slots %}
             <slots>
                 {% for name, value in unit.slots.items() %}
                 <{{ name }}>{{ value }}</{{ name }}>
                 {% endfor %}
             </slots>
+            {% endif %}
+            {% if unit.attributes %}
             <attributes>
-                {% for name, value in unit.attributes.items() %}
+                {% for name, value in unit.attributes | dictsort(true) %}
                 <{{ name }}>{{ value }}</{{ name }}>
                 {% endfor %}
             </attributes>
+            {% endif %}
         </unit>
-        <workspace-attributes>
-            {% for name, value in workspace.attributes.items() %}
-            <{{ name }}>{{ value }}</{{ name }}>
+        {% endfor %}
+    </units>
+    """,
+)
+
+LINK_REDUCE_PROMPT = Prompt(
+    """
+    <role>You're an AI-powered compiler.</role> 
+    <user-input>
+        A rule, workspace attributes and conflicts between
+        modifications proposed by independent passes of that rule
+        over parts of the unit list.
+    </user-input>
+    <task>
+        Based on given rule decide the final value of every
+        conflicting attribute.
+    </task>
+    <output>
+        <format>JSON list of modifications, one per conflict</format>
+        <template>
+            [
+                {
+                    "type": "set_workspace_attr", 
+                    "name": attr name, 
+                    "value": attr value
+                },
+                {
+                    "type": "set_unit_attr",
+                    "index": index of unit as given in conflict,
+                    "name": attr name, 
+                    "value": attr value
+                }
+            ]
+        </template>
+    </output>
+    """,
+    """
+    <rule>
+        {{ rule.rule }}
+    </rule>
+    {% if rule.writes is not none %}
+    <settable-workspace-attributes>
+        {{ rule.writes | join(", ") }}
+    </settable-workspace-attributes>
+    {% endif %}
+    {% if attributes %}
+    <workspace-attributes>
+        {% for name, value in attributes | dictsort(true) %}
+        <{{ name }}>{{ value }}</{{ name }}>
+        {% endfor %}
+    </workspace-attributes>
+    {% endif %}
+    <conflicts>
+        {% for conflict in conflicts %}
+        <conflict>
+            <type>{{ conflict.type }}</type>
+            {% if conflict.index is not none %}
+            <index>{{ conflict.index }}</index>
+            {% endif %}
+            <name>{{ conflict.name }}</name>
+            {% for value in conflict.values %}
+            <candidate>{{ value }}</candidate>
             {% endfor %}
-        </workspace-attributes>
-        <path-template>
-            {{ rule.path }}
-        </path-template>
-        <code-template>
-            {{ rule.template }}
-        </code-template>
-        """
-    )
+        </conflict>
+        {% endfor %}
+    </conflicts>
+    """,
 )
@@ -0,0 +1,273 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+# Task ids per statement, well below SQLite's limit of bound variables.
+_IDS_PER_QUERY = 500
+
+
+def _id_groups(task_ids: list[int]) -> list[list[int]]:
+    return [
+        task_ids[start:start + _IDS_PER_QUERY]
+        for start in range(0, len(task_ids), _IDS_PER_QUERY)
+    ]
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class RemoteTaskError(Exception):
+    def __init__(self, kind: str, error: str) -> None:
+        super().__init__(f"{kind} task failed: {error}")
+        self.kind = kind
+        self.error = error
+
+
+@dataclass
+class Task:
+    id: int
+    kind: str
+    payload: Any
+    attempts: int
+
+
+@dataclass
+class TaskOutcome:
+    id: int
+    result: Any
+    # None if the task succeeded.
+    error: str | None
+
+
+class TaskQueue:
+    """Durable queue of tasks shared by a coordinator and its workers.
+
+    Workers lease tasks and renew the lease while working on them. A
+    task whose lease ran out, because its worker crashed or lost the
+    filesystem, is issued again, at most `max_attempts` times. Hosts
+    sharing the queue must agree on the time.
+    """
+
+    def __init__(self, path: Path, max_attempts: int = 3) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " kind TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " state TEXT NOT NULL DEFAULT 'pending',"
+                " worker TEXT,"
+                " lease_until REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " result TEXT,"
+                " error TEXT,"
+                " created REAL NOT NULL"
+                ")"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # The default rollback journal rather than WAL, whose shared
+            # memory index does not work across hosts.
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def submit(self, kind: str, payload: Any) -> int:
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO tasks (kind, payload, created) VALUES (?, ?, ?)",
+                (kind, _dumps(payload), time.time()),
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker: str, lease: float) -> Task | None:
+        """Lease the oldest task that is pending or whose lease ran out."""
+        conn = self._connect()
+        now = time.time()
+        # Idle workers poll, so the write lock is only taken when there
+        # is something to claim.
+        if conn.execute(
+            "SELECT 1 FROM tasks WHERE state = 'pending' "
+            "OR (state = 'leased' AND lease_until < ?) LIMIT 1",
+            (now,),
+        ).fetchone() is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE tasks SET state = 'failed', error = ? "
+                "WHERE state = 'leased' AND lease_until < ? "
+                "AND attempts >= ?",
+                (
+                    f"Lease ran out {self.max_attempts} times",
+                    now,
+                    self.max_attempts,
+                ),
+            )
+            rows = conn.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, "
+                "lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = ("
+                " SELECT id FROM tasks WHERE state = 'pending'"
+                " OR (state = 'leased' AND lease_until < ?)"
+                " ORDER BY id LIMIT 1"
+                ") RETURNING id, kind, payload, attempts",
+                (worker, now + lease, now),
+            ).fetchall()
+        if not rows:
+            return None
+        task_id, kind, payload, attempts = rows[0]
+        return Task(task_id, kind, json.loads(payload), attempts)
+
+    def renew(self, worker: str, lease: float) -> None:
+        """Extend the leases of all tasks the worker holds."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE tasks SET lease_until = ? "
+                "WHERE state = 'leased' AND worker = ?",
+                (time.time() + lease, worker),
+            )
+
+    def complete(self, task_id: int, result: Any) -> None:
+        # The first worker to finish wins, also if its lease ran out.
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE tasks SET state = 'done', result = ? "
+                "WHERE id = ? AND state = 'leased'",
+                (_dumps(result), task_id),
+            )
+
+    def fail(self, task_id: int, error: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE tasks SET state = 'failed', error = ? "
+                "WHERE id = ? AND state = 'leased'",
+                (error, task_id),
+            )
+
+    def collect(self, task_ids: list[int]) -> list[TaskOutcome]:
+        """Outcomes of the finished ones among the tasks, which are
+        removed from the queue."""
+        conn = self._connect()
+        outcomes = []
+        with conn:
+            for ids in _id_groups(task_ids):
+                placeholders = ",".join("?" * len(ids))
+                rows = conn.execute(
+                    "DELETE FROM tasks WHERE id IN "
+                    f"({placeholders}) AND state IN ('done', 'failed') "
+                    "RETURNING id, result, error",
+                    ids,
+                ).fetchall()
+                outcomes += [
+                    TaskOutcome(
+                        task_id,
+                        None if result is None else json.loads(result),
+                        error,
+                    )
+                    for task_id, result, error in rows
+                ]
+        return outcomes
+
+    def cancel(self, task_ids: list[int]) -> None:
+        conn = self._connect()
+        with conn:
+            for ids in _id_groups(task_ids):
+                placeholders = ",".join("?" * len(ids))
+                conn.execute(
+                    f"DELETE FROM tasks WHERE id IN ({placeholders})", ids
+                )
+
+
+class TaskClient:
+    """Submits tasks and resolves their futures as workers finish them.
+
+    A single thread polls the queue for all unfinished tasks.
+    """
+
+    def __init__(self, queue: TaskQueue, poll_interval: float = 0.05) -> None:
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._futures: dict[int, tuple[str, Future[Any]]] = {}
+        self._lock = threading.Lock()
+        self._poller: threading.Thread | None = None
+
+    def submit(self, kind: str, payload: Any) -> Future[Any]:
+        future: Future[Any] = Future()
+        # Running futures cannot be cancelled, tasks are withdrawn by
+        # closing the client.
+        future.set_running_or_notify_cancel()
+        task_id = self.queue.submit(kind, payload)
+        with self._lock:
+            self._futures[task_id] = (kind, future)
+            if self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._poll, name="aint-queue", daemon=True
+                )
+                self._poller.start()
+        return future
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                # A client that was closed may have started another one.
+                if self._poller is not threading.current_thread():
+                    return
+                if not self._futures:
+                    self._poller = None
+                    return
+                task_ids = list(self._futures)
+            try:
+                outcomes = self.queue.collect(task_ids)
+            except sqlite3.Error as exc:
+                self._fail_all(exc)
+                return
+            for outcome in outcomes:
+                with self._lock:
+                    entry = self._futures.pop(outcome.id, None)
+                if entry is None:
+                    # Failed by closing the client meanwhile.
+                    continue
+                kind, future = entry
+                if outcome.error is None:
+                    future.set_result(outcome.result)
+                else:
+                    future.set_exception(
+                        RemoteTaskError(kind, outcome.error)
+                    )
+
+    def _fail_all(self, exc: BaseException) -> None:
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._poller = None
+        for _, future in futures:
+            if not future.done():
+                future.set_exception(exc)
+
+    def close(self) -> None:
+        """Withdraw the tasks that are not finished."""
+        with self._lock:
+            task_ids = list(self._futures)
+        if task_ids:
+            self.queue.cancel(task_ids)
+            self._fail_all(RuntimeError("Task client was closed"))
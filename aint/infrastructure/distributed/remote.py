@@ -0,0 +1,148 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any
+
+import adaptix
+
+from aint.domain.flow import AsyncUnitCompiler, CompilationError, SourceParser
+from aint.domain.gen import CompilationRule, GeneratedSource
+from aint.domain.syntax import ParseRule, SourceFile
+from aint.domain.tracing import tracer
+from aint.domain.units import LinkingRule, Unit, Workspace
+from aint.infrastructure.ai.impl import AIUnitLinker
+from aint.infrastructure.distributed.queue import RemoteTaskError, TaskClient
+from aint.infrastructure.distributed.tasks import (
+    COMPILE_TASK,
+    LINK_TASK,
+    PARSE_TASK,
+    CompileResult,
+    CompileTask,
+    LinkTask,
+    ParseTask,
+    UnitData,
+    dump_units,
+    load_units,
+    used_rules,
+)
+
+
+@dataclass
+class QueuedSourceParser(SourceParser):
+    """Has workers parse sources with the model."""
+
+    client: TaskClient
+
+    def parse_source(
+        self,
+        rules: dict[str, ParseRule],
+        source: SourceFile,
+        parse_algo: str
+    ) -> list[Unit]:
+        task = ParseTask(list(rules.values()), source, parse_algo)
+        with tracer.span("parse_task"):
+            result = self.client.submit(
+                PARSE_TASK, adaptix.dump(task)
+            ).result()
+        return load_units(adaptix.load(result, list[UnitData]), rules)
+
+
+@dataclass(kw_only=True)
+class QueuedUnitLinker(AIUnitLinker):
+    """Has workers request the changes of link shards.
+
+    Conflicts between shards are reconciled with this side's model.
+    """
+
+    client: TaskClient
+
+    def request_changes(
+        self,
+        attributes: dict[str, Any],
+        rule: LinkingRule,
+        indexed_units: list[tuple[int, Unit]],
+    ) -> list[list[dict[str, Any]]]:
+        units = [unit for _, unit in indexed_units]
+        task = LinkTask(
+            rule,
+            attributes,
+            used_rules(units),
+            dump_units(units),
+            [index for index, _ in indexed_units],
+        )
+        with tracer.span("link_task", units=len(units)):
+            return self.client.submit(
+                LINK_TASK, adaptix.dump(task)
+            ).result()
+
+
+@dataclass
+class QueuedUnitCompiler(AsyncUnitCompiler):
+    """Has workers compile units, `task_units` units per task.
+
+    Sources are yielded in unit order. Tasks are submitted at most twice
+    the jobs ahead of the oldest unfinished one.
+    """
+
+    client: TaskClient
+    batch_tokens: int | None = None
+    jobs: int = 8
+    task_units: int = 8
+
+    def _tasks(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> Iterator[CompileTask]:
+        units = workspace.units_of_types(rule.unit_type)
+        parse_rules = used_rules(units)
+        return (
+            CompileTask(
+                rule,
+                workspace.attributes,
+                parse_rules,
+                dump_units(units[start:start + self.task_units]),
+                self.batch_tokens,
+            )
+            for start in range(0, len(units), self.task_units)
+        )
+
+    async def compile(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> AsyncIterator[GeneratedSource]:
+        tasks = self._tasks(workspace, rule)
+        window = 2 * self.jobs
+        running: deque[asyncio.Future[Any]] = deque()
+        compiled = 0
+        errors: list[BaseException] = []
+        try:
+            while True:
+                for task in islice(tasks, window - len(running)):
+                    running.append(
+                        asyncio.wrap_future(
+                            self.client.submit(
+                                COMPILE_TASK, adaptix.dump(task)
+                            )
+                        )
+                    )
+                if not running:
+                    break
+                try:
+                    result = adaptix.load(
+                        await running.popleft(), CompileResult
+                    )
+                except Exception as exc:
+                    errors.append(exc)
+                    continue
+                errors += [
+                    RemoteTaskError(COMPILE_TASK, error)
+                    for error in result.errors
+                ]
+                for source in result.sources:
+                    compiled += 1
+                    yield source
+        finally:
+            for future in running:
+                future.cancel()
+        if errors:
+            raise CompilationError([], errors, compiled)
@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+from typing import Any
+
+from aint.domain.gen import CompilationRule, GeneratedSource
+from aint.domain.syntax import ParseRule, SourceFile, SourceSpan
+from aint.domain.units import LinkingRule, Unit
+
+PARSE_TASK = "parse"
+LINK_TASK = "link"
+COMPILE_TASK = "compile"
+
+
+@dataclass
+class UnitData:
+    rule: str
+    slots: dict[str, Any]
+    attributes: dict[str, Any]
+    span: SourceSpan | None = None
+
+
+def dump_units(units: list[Unit]) -> list[UnitData]:
+    return [
+        UnitData(unit.type, unit.slots, unit.attributes, unit.span)
+        for unit in units
+    ]
+
+
+def load_units(
+    data: list[UnitData], rules: dict[str, ParseRule]
+) -> list[Unit]:
+    return [
+        Unit(rules[unit.rule], unit.slots, unit.attributes, unit.span)
+        for unit in data
+    ]
+
+
+def used_rules(units: list[Unit]) -> list[ParseRule]:
+    return list({unit.type: unit.used_rule for unit in units}.values())
+
+
+# Tasks carry everything the model requests need, so that workers do
+# not have to load the definitions.
+
+
+@dataclass
+class ParseTask:
+    rules: list[ParseRule]
+    source: SourceFile
+    parse_algo: str
+
+
+@dataclass
+class LinkTask:
+    """Request the changes of a linking rule for a shard of its units."""
+
+    rule: LinkingRule
+    attributes: dict[str, Any]
+    parse_rules: list[ParseRule]
+    units: list[UnitData]
+    # Positions of the units among those the rule selects.
+    indexes: list[int]
+
+
+@dataclass
+class CompileTask:
+    rule: CompilationRule
+    attributes: dict[str, Any]
+    parse_rules: list[ParseRule]
+    units: list[UnitData]
+    batch_tokens: int | None = None
+
+
+@dataclass
+class CompileResult:
+    sources: list[GeneratedSource]
+    # Units that failed do not fail the whole task.
+    errors: list[str]
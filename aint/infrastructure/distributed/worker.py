@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+import adaptix
+
+from aint.domain.flow import CompilationError, iter_compiled
+from aint.domain.tracing import tracer
+from aint.domain.units import Workspace
+from aint.infrastructure.ai.client import AI
+from aint.infrastructure.ai.impl import (
+    AIAsyncUnitCompiler,
+    AISourceParser,
+    AIUnitLinker,
+)
+from aint.infrastructure.distributed.queue import Task, TaskQueue
+from aint.infrastructure.distributed.tasks import (
+    COMPILE_TASK,
+    LINK_TASK,
+    PARSE_TASK,
+    CompileResult,
+    CompileTask,
+    LinkTask,
+    ParseTask,
+    UnitData,
+    dump_units,
+    load_units,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WorkerStats:
+    done: int = 0
+    failed: int = 0
+
+
+class Worker:
+    """Runs queued tasks with its own model client until stopped.
+
+    Up to `jobs` tasks run at a time. Their leases are renewed every
+    third of the lease, so that only tasks of a worker that stopped
+    renewing them are issued again.
+    """
+
+    def __init__(
+        self,
+        queue: TaskQueue,
+        ai: AI,
+        jobs: int = 8,
+        lease: float = 60,
+        poll_interval: float = 0.2,
+        name: str | None = None,
+    ) -> None:
+        self.queue = queue
+        self.ai = ai
+        self.jobs = jobs
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stats = WorkerStats()
+        self._lock = threading.Lock()
+
+    def _parse(self, task: ParseTask) -> Any:
+        parser = AISourceParser(self.ai)
+        with tracer.span("parse", stage="parse", source=task.source.path):
+            units = parser.parse_source(
+                {rule.name: rule for rule in task.rules},
+                task.source,
+                task.parse_algo,
+            )
+        return adaptix.dump(dump_units(units), list[UnitData])
+
+    def _link(self, task: LinkTask) -> Any:
+        units = load_units(
+            task.units, {rule.name: rule for rule in task.parse_rules}
+        )
+        with tracer.span("link", stage="link", rule=task.rule.name):
+            return AIUnitLinker(self.ai).request_changes(
+                task.attributes,
+                task.rule,
+                list(zip(task.indexes, units)),
+            )
+
+    def _compile(self, task: CompileTask) -> Any:
+        workspace = Workspace(
+            load_units(
+                task.units, {rule.name: rule for rule in task.parse_rules}
+            ),
+            task.attributes,
+        )
+        compiler = AIAsyncUnitCompiler(
+            self.ai,
+            batch_tokens=task.batch_tokens,
+            jobs=self.jobs,
+        )
+        result = CompileResult([], [])
+
+        async def drain() -> None:
+            async for source in iter_compiled(
+                compiler, workspace, task.rule
+            ):
+                result.sources.append(source)
+
+        with tracer.span(
+            "compile", stage="compile", rule=task.rule.unit_type
+        ):
+            try:
+                asyncio.run(drain())
+            except CompilationError as exc:
+                result.errors = [repr(error) for error in exc.errors]
+            finally:
+                compiler.close()
+        return adaptix.dump(result)
+
+    def handle(self, task: Task) -> Any:
+        """Run the task and return its JSON serializable result."""
+        if task.kind == PARSE_TASK:
+            return self._parse(adaptix.load(task.payload, ParseTask))
+        if task.kind == LINK_TASK:
+            return self._link(adaptix.load(task.payload, LinkTask))
+        if task.kind == COMPILE_TASK:
+            return self._compile(adaptix.load(task.payload, CompileTask))
+        raise ValueError(f"Unknown task kind {task.kind!r}")
+
+    def _run_tasks(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            task = self.queue.claim(self.name, self.lease)
+            if task is None:
+                stop.wait(self.poll_interval)
+                continue
+            try:
+                result = self.handle(task)
+            except Exception as exc:
+                logger.exception("Task %s (%s) failed", task.id, task.kind)
+                self.queue.fail(task.id, repr(exc))
+                with self._lock:
+                    self.stats.failed += 1
+            else:
+                self.queue.complete(task.id, result)
+                with self._lock:
+                    self.stats.done += 1
+
+    def run(self, stop: threading.Event) -> None:
+        """Work until `stop` is set, then finish the tasks at hand."""
+        threads = [
+            threading.Thread(
+                target=self._run_tasks,
+                args=(stop,),
+                name=f"aint-worker-{number}",
+            )
+            for number in range(self.jobs)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while not stop.wait(self.lease / 3):
+                self.queue.renew(self.name, self.lease)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,104 @@
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from aint.domain.flow import SourceParser
+from aint.domain.syntax import ParseRule, SourceFile
+from aint.domain.tracing import bind_context, tracer
+from aint.domain.units import Unit
+
+
+def boundary_chars(rules: list[ParseRule]) -> frozenset[str]:
+    """Characters that end a top-level construct in the given grammar."""
+    chars = set()
+    for rule in rules:
+        lines = [
+            line.strip() for line in rule.pattern.splitlines()
+            if line.strip() and not line.strip().startswith("#")
+        ]
+        if lines and not lines[-1][-1].isalnum():
+            chars.add(lines[-1][-1])
+    return frozenset(chars)
+
+
+def split_lines(
+    lines: Iterable[str],
+    max_chars: int,
+    terminators: frozenset[str],
+) -> Iterator[tuple[int, str]]:
+    """Split lines into chunks of about max_chars at top-level boundaries.
+
+    Yields chunk offsets together with chunk text. A construct longer
+    than max_chars is never cut and ends up in a chunk of its own.
+    """
+    chunk: list[str] = []
+    chunk_size = 0
+    chunk_offset = 0
+    depth = 0
+    for line in lines:
+        chunk.append(line)
+        chunk_size += len(line)
+        depth = max(0, depth + line.count("{") - line.count("}"))
+        stripped = line.strip()
+        at_boundary = depth == 0 and (
+            not stripped or stripped[-1] in terminators
+        )
+        if at_boundary and chunk_size >= max_chars:
+            yield chunk_offset, "".join(chunk)
+            chunk_offset += chunk_size
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        yield chunk_offset, "".join(chunk)
+
+
+def split_source(
+    source: SourceFile, max_chars: int, terminators: frozenset[str]
+) -> list[SourceFile]:
+    return [
+        SourceFile(source.path, text, source.offset + offset)
+        for offset, text in split_lines(
+            source.content.splitlines(keepends=True), max_chars, terminators
+        )
+    ]
+
+
+@dataclass
+class ChunkedSourceParser(SourceParser):
+    inner: SourceParser
+    max_chars: int = 16 * 1024
+    jobs: int = 4
+
+    def _parse_chunk(
+        self, rules: dict[str, ParseRule], chunk: SourceFile, parse_algo: str
+    ) -> list[Unit]:
+        with tracer.span("parse_chunk", offset=chunk.offset):
+            return self.inner.parse_source(rules, chunk, parse_algo)
+
+    def parse_source(
+        self,
+        rules: dict[str, ParseRule],
+        source: SourceFile,
+        parse_algo: str
+    ) -> list[Unit]:
+        if len(source.content) <= self.max_chars:
+            return self.inner.parse_source(rules, source, parse_algo)
+        chunks = split_source(
+            source, self.max_chars, boundary_chars(list(rules.values()))
+        )
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.jobs, len(chunks))),
+            thread_name_prefix="aint-chunk",
+        ) as executor:
+            return [
+                unit
+                for chunk_units in executor.map(
+                    bind_context(
+                        lambda chunk: self._parse_chunk(
+                            rules, chunk, parse_algo
+                        )
+                    ),
+                    chunks,
+                )
+                for unit in chunk_units
+            ]
@@ -0,0 +1,116 @@
+from collections.abc import Callable, Iterable, Mapping
+from dataclasses import dataclass
+from functools import cache, lru_cache
+from typing import TYPE_CHECKING, Any
+
+from aint.domain.flow import UnitLinker
+from aint.domain.tracing import tracer
+from aint.domain.units import LinkingRule, Unit, Workspace
+
+if TYPE_CHECKING:
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+
+@cache
+def _environment() -> "ImmutableSandboxedEnvironment":
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+    # Expressions may read units and attributes but neither call private
+    # methods nor mutate lists and dicts.
+    return ImmutableSandboxedEnvironment()
+
+
+@lru_cache(maxsize=1024)
+def _compile_expression(expression: str) -> Callable[..., Any]:
+    return _environment().compile_expression(expression)
+
+
+def _plain(value: Any) -> Any:
+    # Filters such as `map` produce generators, attributes must stay
+    # serializable.
+    if isinstance(value, Iterable) and not isinstance(
+        value, (str, bytes, Mapping, list)
+    ):
+        return list(value)
+    return value
+
+
+def _evaluate(rule: LinkingRule, expression: str, context: dict) -> Any:
+    from jinja2 import TemplateError
+
+    try:
+        return _plain(_compile_expression(expression)(**context))
+    except TemplateError as exc:
+        raise ValueError(
+            f"Linking rule {rule.name!r} failed to evaluate "
+            f"{expression!r}: {exc}"
+        ) from exc
+
+
+def local_changes(
+    workspace: Workspace, rule: LinkingRule, units: list[Unit]
+) -> list[dict[str, Any]]:
+    """Changes of the rule's local expressions, in the form the model
+    answers with. Attributes whose expression gives none are not set."""
+    local = rule.local
+    undeclared = [name for name in local.workspace if not rule.may_write(name)]
+    if undeclared:
+        raise ValueError(
+            f"Linking rule {rule.name!r} sets workspace attributes it does "
+            f"not declare to write: {', '.join(undeclared)}"
+        )
+    context = {
+        "units": units,
+        "attributes": workspace.read_attributes(rule.reads),
+    }
+    for name, expression in local.let.items():
+        context[name] = _evaluate(rule, expression, context)
+    changes = []
+    for name, expression in local.workspace.items():
+        value = _evaluate(rule, expression, context)
+        if value is not None:
+            changes.append(
+                {"type": "set_workspace_attr", "name": name, "value": value}
+            )
+    for index, unit in enumerate(units):
+        unit_context = {**context, "unit": unit, "index": index}
+        for name, expression in local.units.items():
+            value = _evaluate(rule, expression, unit_context)
+            if value is not None:
+                changes.append(
+                    {
+                        "type": "set_unit_attr",
+                        "index": index,
+                        "name": name,
+                        "value": value,
+                    }
+                )
+    return changes
+
+
+@dataclass
+class LocalUnitLinker(UnitLinker):
+    """Runs linking rules that have local expressions in-process.
+
+    Rules given only in natural language go to the fallback linker.
+    """
+
+    fallback: UnitLinker
+
+    def apply_rule(self, workspace: Workspace, rule: LinkingRule) -> None:
+        if rule.local is None:
+            self.fallback.apply_rule(workspace, rule)
+            return
+        units = workspace.units_of_types(*rule.select)
+        with tracer.span("link_local", units=len(units)):
+            # All changes are computed before any is applied, as they
+            # would be by the model.
+            for change in local_changes(workspace, rule, units):
+                if change["type"] == "set_workspace_attr":
+                    workspace.set_attr(change["name"], change["value"])
+                else:
+                    workspace.set_unit_attr(
+                        units[change["index"]],
+                        change["name"],
+                        change["value"],
+                    )
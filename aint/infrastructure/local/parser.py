@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from aint.domain.flow import SourceParser
+from aint.domain.syntax import ParseRule, SourceFile, SourceSpan
+from aint.domain.tracing import tracer
+from aint.domain.units import Unit
+from aint.infrastructure.local.patterns import (
+    PatternMatch,
+    compile_matchers,
+    find_matches,
+)
+
+
+@dataclass
+class LocalPatternParser(SourceParser):
+    """Extracts strictly regular constructs locally.
+
+    Whatever the compiled patterns cannot claim unambiguously is handed
+    to the fallback parser span by span.
+    """
+
+    fallback: SourceParser
+    matchers: dict[str, str] | None = None
+    process_pool: ProcessPoolExecutor | None = None
+    process_threshold: int = 256 * 1024
+
+    def _find_matches(
+        self, matchers: dict[str, str], content: str
+    ) -> list[PatternMatch]:
+        if (
+            self.process_pool is not None
+            and len(content) >= self.process_threshold
+        ):
+            return self.process_pool.submit(
+                find_matches, matchers, content
+            ).result()
+        return find_matches(matchers, content)
+
+    def parse_source(
+        self,
+        rules: dict[str, ParseRule],
+        source: SourceFile,
+        parse_algo: str
+    ) -> list[Unit]:
+        matchers = self.matchers
+        if matchers is None:
+            matchers = compile_matchers(list(rules.values()))
+        with tracer.span("match_patterns") as metrics:
+            matches = (
+                self._find_matches(matchers, source.content)
+                if matchers else []
+            )
+            metrics["matched_units"] = len(matches)
+        units = []
+        position = 0
+        for match in [*matches, None]:
+            end = len(source.content) if match is None else match.start
+            leftover = source.content[position:end]
+            if leftover.strip():
+                units.extend(
+                    self.fallback.parse_source(
+                        rules,
+                        SourceFile(
+                            source.path, leftover, source.offset + position
+                        ),
+                        parse_algo,
+                    )
+                )
+            if match is not None:
+                units.append(
+                    Unit(
+                        used_rule=rules[match.rule],
+                        slots=match.slots,
+                        attributes={},
+                        span=SourceSpan(
+                            source.path,
+                            source.offset + match.start,
+                            source.offset + match.end,
+                        ),
+                    )
+                )
+                position = match.end
+        return units
@@ -0,0 +1,119 @@
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+
+from aint.domain.syntax import ParseRule
+
+_PLACEHOLDER = re.compile(r"\$([A-Za-z_]\w*)")
+_TOKEN = re.compile(r"\$([A-Za-z_]\w*)|(\s+)|([^$\s]+|\$)")
+
+
+@dataclass(frozen=True)
+class PatternMatch:
+    start: int
+    end: int
+    rule: str
+    slots: dict[str, str]
+
+
+@lru_cache(maxsize=1024)
+def compile_pattern(pattern: str, slots: frozenset[str]) -> str | None:
+    """Translate a rule pattern into a regex, if it is strictly regular.
+
+    Patterns with comments, repeated or undeclared placeholders, or two
+    placeholders without a literal between them need interpretation and
+    are left to the model.
+    """
+    text = pattern.strip()
+    if not text or "#" in text:
+        return None
+    placeholders = _PLACEHOLDER.findall(text)
+    if (
+        len(placeholders) != len(set(placeholders))
+        or set(placeholders) != slots
+    ):
+        return None
+    parts = [r"^[ \t]*"]
+    previous = None
+    tokens = list(_TOKEN.finditer(text))
+    for i, token in enumerate(tokens):
+        name, space, literal = token.groups()
+        if name is not None:
+            if previous == "slot":
+                return None
+            parts.append(rf"(?P<{name}>[^\n]+?)")
+            previous = "slot"
+        elif space is not None:
+            before = text[token.start() - 1]
+            after = text[token.end()] if i + 1 < len(tokens) else ""
+            if "\n" in space:
+                parts.append(r"\s*")
+            elif _is_word(before) and _is_word(after):
+                parts.append(r"\s+")
+            else:
+                parts.append(r"[ \t]*")
+        else:
+            parts.append(re.escape(literal))
+            previous = "literal"
+    parts.append(r"[ \t]*$")
+    return "".join(parts)
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char in "_$"
+
+
+def compile_matchers(rules: list[ParseRule]) -> dict[str, str]:
+    matchers = {}
+    for rule in rules:
+        regex = compile_pattern(rule.pattern, frozenset(rule.slots))
+        if regex is not None:
+            matchers[rule.name] = regex
+    return matchers
+
+
+@lru_cache(maxsize=256)
+def _compile_regex(regex: str) -> re.Pattern[str]:
+    return re.compile(regex, re.MULTILINE)
+
+
+def _top_level_lines(content: str) -> tuple[list[int], list[bool]]:
+    line_starts = []
+    top_level = []
+    depth = 0
+    position = 0
+    for line in content.splitlines(keepends=True):
+        line_starts.append(position)
+        top_level.append(depth == 0)
+        depth = max(0, depth + line.count("{") - line.count("}"))
+        position += len(line)
+    return line_starts, top_level
+
+
+def find_matches(
+    matchers: dict[str, str], content: str
+) -> list[PatternMatch]:
+    """Find top-level spans matched by exactly one rule, in source order."""
+    line_starts, top_level = _top_level_lines(content)
+    candidates: dict[tuple[int, int], list[PatternMatch]] = {}
+    for rule, regex in matchers.items():
+        for match in _compile_regex(regex).finditer(content):
+            line = bisect_right(line_starts, match.start()) - 1
+            if line >= 0 and not top_level[line]:
+                continue
+            candidates.setdefault((match.start(), match.end()), []).append(
+                PatternMatch(
+                    match.start(), match.end(), rule, match.groupdict()
+                )
+            )
+    spans = sorted(candidates)
+    matches = []
+    for i, span in enumerate(spans):
+        overlaps = (
+            i > 0 and spans[i - 1][1] > span[0]
+            or i + 1 < len(spans) and spans[i + 1][0] < span[1]
+        )
+        if len(candidates[span]) == 1 and not overlaps:
+            matches.append(candidates[span][0])
+    return matches
@@ -0,0 +1,118 @@
+import string
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+from aint.domain.flow import (
+    AsyncUnitCompiler,
+    CompilationError,
+    UnitCompiler,
+    iter_compiled,
+)
+from aint.domain.gen import CompilationRule, GeneratedSource
+from aint.domain.tracing import tracer
+from aint.domain.units import Unit, Workspace
+
+
+@lru_cache(maxsize=1024)
+def _compile_template(template: str) -> string.Template | None:
+    # `#` lines are instructions for the model, not substitutions.
+    if any(line.strip().startswith("#") for line in template.splitlines()):
+        return None
+    compiled = string.Template(template)
+    return compiled if compiled.is_valid() else None
+
+
+def substitution_values(
+    unit: Unit, workspace_attributes: dict[str, Any]
+) -> dict[str, str]:
+    """Scalar values a template may refer to, slots taking precedence
+    over unit attributes and those over workspace attributes."""
+    values = {}
+    for source in (workspace_attributes, unit.attributes, unit.slots):
+        for name, value in source.items():
+            if isinstance(value, (str, int, float)) and not isinstance(
+                value, bool
+            ):
+                values[name] = str(value)
+            else:
+                values.pop(name, None)
+    return values
+
+
+def render_template(template: str, values: dict[str, str]) -> str | None:
+    """Substitute `$name` placeholders, None if the template has
+    instructions or refers to anything missing from values."""
+    compiled = _compile_template(template)
+    if compiled is None:
+        return None
+    try:
+        return compiled.substitute(values)
+    except KeyError:
+        return None
+
+
+def _render_unit(
+    workspace: Workspace, rule: CompilationRule, unit: Unit
+) -> GeneratedSource | None:
+    values = substitution_values(unit, workspace.attributes)
+    path = render_template(rule.path, values)
+    content = render_template(rule.template, values)
+    if path is None or content is None:
+        return None
+    return GeneratedSource(path, content)
+
+
+@dataclass
+class LocalTemplateCompiler(AsyncUnitCompiler):
+    """Renders substitution-only templates without the model.
+
+    Units whose template has instructions or refers to values that are
+    not plain slots or attributes go to the fallback compiler. Sources
+    are yielded in unit order as they become available.
+    """
+
+    fallback: UnitCompiler | AsyncUnitCompiler
+
+    async def compile(
+        self, workspace: Workspace, rule: CompilationRule
+    ) -> AsyncIterator[GeneratedSource]:
+        units = workspace.units_of_types(rule.unit_type)
+        with tracer.span("render_templates") as metrics:
+            # Rendered again when yielded, so that contents are not held
+            # while waiting for the fallback.
+            local = [
+                _render_unit(workspace, rule, unit) is not None
+                for unit in units
+            ]
+            metrics["rendered_units"] = sum(local)
+        fallback_units = [
+            unit for unit, rendered in zip(units, local) if not rendered
+        ]
+        compiled = iter_compiled(
+            self.fallback,
+            Workspace(fallback_units, workspace.attributes),
+            rule,
+        )
+        count = 0
+        failure = None
+        for unit, rendered in zip(units, local):
+            if rendered:
+                source = _render_unit(workspace, rule, unit)
+            elif failure is not None:
+                continue
+            else:
+                try:
+                    source = await anext(compiled)
+                except CompilationError as exc:
+                    failure = exc
+                    continue
+            count += 1
+            yield source
+        if failure is not None:
+            raise CompilationError(
+                failure.generated,
+                failure.errors,
+                count + len(failure.generated),
+            ) from failure
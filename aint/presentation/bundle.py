@@ -0,0 +1,90 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import adaptix
+from adaptix.load_error import LoadError
+
+from aint.domain.flow import RuleExplainer, RuleParser
+from aint.domain.gen import CompilationRule
+from aint.domain.syntax import ParseRule
+from aint.domain.units import LinkingRule
+from aint.infrastructure.local.patterns import compile_matchers
+from aint.presentation.defaults import BUNDLE_FILENAME
+from aint.presentation.definition_loaders import YamlDefLoader
+
+BUNDLE_VERSION = 4
+
+
+@dataclass
+class GrammarBundle(RuleParser, RuleExplainer):
+    version: int
+    definitions_hash: str
+    parse_rules: list[ParseRule]
+    linking_rules: list[LinkingRule]
+    compilation_rules: list[CompilationRule]
+    parser_algo: str
+    matchers: dict[str, str]
+
+    def get_parse_rules(self) -> list[ParseRule]:
+        return self.parse_rules
+
+    def get_linking_rules(self) -> list[LinkingRule]:
+        return self.linking_rules
+
+    def get_compilation_rules(self) -> list[CompilationRule]:
+        return self.compilation_rules
+
+    def explain_rules(self, rules: list[ParseRule]) -> str:
+        return self.parser_algo
+
+
+def build_bundle(
+    loader: YamlDefLoader, explainer: RuleExplainer
+) -> GrammarBundle:
+    parse_rules = loader.get_parse_rules()
+    return GrammarBundle(
+        version=BUNDLE_VERSION,
+        definitions_hash=loader.fingerprint(),
+        parse_rules=parse_rules,
+        linking_rules=loader.get_linking_rules(),
+        compilation_rules=loader.get_compilation_rules(),
+        parser_algo=explainer.explain_rules(parse_rules),
+        matchers=compile_matchers(parse_rules),
+    )
+
+
+def default_bundle_path(output_base_dir: Path) -> Path:
+    """Where compilation into the directory keeps its bundle, next to
+    the build manifest."""
+    return output_base_dir / BUNDLE_FILENAME
+
+
+def save_bundle(path: Path, bundle: GrammarBundle) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(
+        json.dumps(adaptix.dump(bundle), indent=1, ensure_ascii=False)
+    )
+    tmp_path.replace(path)
+
+
+def load_fresh_bundle(
+    path: Path, loader: YamlDefLoader
+) -> GrammarBundle | None:
+    if not path.is_file():
+        return None
+    try:
+        data = json.loads(path.read_text())
+    except ValueError:
+        return None
+    if (
+        not isinstance(data, dict)
+        or data.get("version") != BUNDLE_VERSION
+        or data.get("definitions_hash") != loader.fingerprint()
+    ):
+        return None
+    try:
+        return adaptix.load(data, GrammarBundle)
+    except LoadError:
+        return None
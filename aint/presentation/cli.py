@@ -1,19 +1,26 @@
+import logging
 import os
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import click
-import openai
-
-from aint.domain.flow import run_compiler_flow
-from aint.domain.syntax import SourceFile
-from aint.infrastructure.ai.client import AI
-from aint.infrastructure.ai.impl import (
-    AIRuleExplainer,
-    AISourceParser,
-    AIUnitCompiler, AIUnitLinker,
+
+from aint.domain.tracing import SummaryRow, tracer
+from aint.infrastructure.ai.cache import DEFAULT_CACHE_DIR, ResponseCache
+from aint.presentation.defaults import (
+    BUNDLE_FILENAME,
+    DEFAULT_MODEL,
+    DEFAULT_SOCKET,
 )
-from aint.presentation.definition_loaders import YamlDefLoader
-from aint.presentation.sources import load_sources, save_generated
+
+# Commands import the model client, templates, YAML and serialization
+# libraries on first use, so that `--help` and quick commands start fast.
+if TYPE_CHECKING:
+    from aint.infrastructure.ai.client import AI
+    from aint.infrastructure.ai.engine import RequestEngine
+    from aint.infrastructure.ai.routing import ModelRouter
+    from aint.presentation.daemon import CompileJob, JobResult
+    from aint.presentation.session import CompilerSession
 
 
 def err_exit(text: str) -> None:
@@ -36,8 +43,111 @@ def aint_group():
     """Aint CLI tool."""
 
 
-@aint_group.command("compile")
-@click.argument("input_file", type=click.File("r"))
+def cache_options(command):
+    command = click.option(
+        "--clear-cache", is_flag=True, help="Clear the response cache first."
+    )(command)
+    command = click.option(
+        "--no-cache", is_flag=True, help="Bypass the response cache."
+    )(command)
+    return click.option(
+        "--cache-dir",
+        type=click.Path(dir_okay=True, file_okay=False),
+        default=str(DEFAULT_CACHE_DIR),
+        show_default=True,
+        help="Directory of the persistent response cache.",
+    )(command)
+
+
+def open_cache(
+    cache_dir: str, no_cache: bool, clear_cache: bool
+) -> ResponseCache | None:
+    if no_cache and not clear_cache:
+        return None
+    cache = ResponseCache(Path(cache_dir, "responses.sqlite3"))
+    if clear_cache:
+        cache.clear()
+    return None if no_cache else cache
+
+
+def model_options(command):
+    command = click.option(
+        "--models",
+        "models_path",
+        type=click.Path(dir_okay=False, file_okay=True, exists=True),
+        help="YAML file with model endpoints and per-stage/per-rule routes.",
+    )(command)
+    command = click.option(
+        "--json-mode",
+        is_flag=True,
+        help="Ask the default model for JSON objects (response_format).",
+    )(command)
+    return click.option(
+        "--model",
+        default=DEFAULT_MODEL,
+        show_default=True,
+        help="Model used where no route applies.",
+    )(command)
+
+
+def create_ai(
+    cache: ResponseCache | None,
+    engine: "RequestEngine | None" = None,
+    model: str = DEFAULT_MODEL,
+    models_path: str | None = None,
+    json_mode: bool = False,
+) -> "AI":
+    import yaml
+    from adaptix.load_error import LoadError
+
+    from aint.infrastructure.ai.client import AI
+    from aint.presentation.models import create_client, load_router
+
+    router = None
+    if models_path is not None:
+        try:
+            router = load_router(Path(models_path))
+        except (LoadError, ValueError, yaml.YAMLError) as exc:
+            err_exit(f"Invalid model configuration: {exc}")
+    return AI(
+        create_client(),
+        model,
+        cache=cache,
+        engine=engine,
+        router=router,
+        json_mode=json_mode,
+    )
+
+
+def print_routing(router: "ModelRouter") -> None:
+    for (stage, rule, endpoint), stats in sorted(router.stats.items()):
+        average = stats.latency / stats.requests if stats.requests else 0
+        click.echo(
+            f"route {stage}/{rule} -> {endpoint}: "
+            f"{stats.requests} requests ({stats.fallbacks} as fallback), "
+            f"{stats.failures} failures, {average:.2f} s average latency"
+        )
+
+
+def print_profile(rows: list[SummaryRow]) -> None:
+    header = (
+        f"{'stage':<10} {'rule':<24} {'reqs':>5} {'wall s':>8} "
+        f"{'queue s':>8} {'in tok':>8} {'out tok':>8} {'cached':>6} "
+        f"{'retry':>5} {'resp KiB':>8}"
+    )
+    click.echo(header)
+    click.echo("-" * len(header))
+    for row in rows:
+        click.echo(
+            f"{row.stage:<10} {row.rule[:24]:<24} {row.requests:>5} "
+            f"{row.wall_time:>8.2f} {row.queue_time:>8.2f} "
+            f"{row.prompt_tokens:>8} {row.completion_tokens:>8} "
+            f"{row.cache_hits:>6} {row.retries:>5} "
+            f"{row.response_bytes / 1024:>8.1f}"
+        )
+
+
+@aint_group.command("build-grammar")
 @click.argument(
     "definition_dir",
     type=click.Path(dir_okay=True, file_okay=False)
@@ -46,19 +156,415 @@ def aint_group():
     "output_base_dir",
     type=click.Path(dir_okay=True, file_okay=False)
 )
-def compile_command(input_file, definition_dir, output_base_dir):
-    client = openai.Client(
-        api_key=os.environ["OPENROUTER_API_KEY"],
-        base_url="https://openrouter.ai/api/v1"
+@click.option(
+    "-o", "--output",
+    type=click.Path(dir_okay=False, file_okay=True),
+    help=(
+        f"Bundle path. Defaults to OUTPUT_BASE_DIR/{BUNDLE_FILENAME}, "
+        "where compiling into OUTPUT_BASE_DIR looks for it."
+    ),
+)
+@model_options
+@cache_options
+def build_grammar_command(
+    definition_dir, output_base_dir, output, model, models_path, json_mode,
+    cache_dir, no_cache, clear_cache,
+):
+    from aint.infrastructure.ai.impl import AIRuleExplainer
+    from aint.presentation.bundle import (
+        build_bundle,
+        default_bundle_path,
+        save_bundle,
+    )
+    from aint.presentation.definition_loaders import YamlDefLoader
+
+    ai = create_ai(
+        open_cache(cache_dir, no_cache, clear_cache),
+        model=model,
+        models_path=models_path,
+        json_mode=json_mode,
     )
-    ai = AI(client, "kwaipilot/kat-coder-pro:free")
     loader = YamlDefLoader(Path(definition_dir))
-    explainer = AIRuleExplainer(ai)
-    parser = AISourceParser(ai)
-    linker = AIUnitLinker(ai)
-    compiler = AIUnitCompiler(ai)
-    sources = [SourceFile(input_file.name, input_file.read())]
-    generated = run_compiler_flow(
-        loader, explainer, sources, parser, linker, compiler
+    path = (
+        Path(output) if output is not None
+        else default_bundle_path(Path(output_base_dir))
+    )
+    with tracer.span("build_grammar", stage="explain"):
+        bundle = build_bundle(loader, AIRuleExplainer(ai))
+    save_bundle(path, bundle)
+    click.echo(f"grammar bundle written to {path}")
+
+
+def engine_options(command):
+    command = click.option(
+        "--max-retries",
+        type=click.IntRange(min=0),
+        default=5,
+        show_default=True,
+        help="Retries of a request after rate limiting or transient errors.",
+    )(command)
+    command = click.option(
+        "--tpm",
+        type=click.FloatRange(min=0, min_open=True),
+        help="Provider limit of tokens per minute.",
+    )(command)
+    command = click.option(
+        "--rpm",
+        type=click.FloatRange(min=0, min_open=True),
+        help="Provider limit of requests per minute.",
+    )(command)
+    command = click.option(
+        "-j", "--jobs",
+        type=click.IntRange(min=1),
+        default=8,
+        show_default=True,
+        help="Maximum number of concurrent model requests.",
+    )(command)
+    command = click.option(
+        "-v", "--verbose", is_flag=True, help="Log prompts and responses."
+    )(command)
+    return model_options(cache_options(command))
+
+
+def create_engine_ai(
+    jobs: int,
+    rpm: float | None,
+    tpm: float | None,
+    max_retries: int,
+    verbose: bool,
+    model: str,
+    models_path: str | None,
+    json_mode: bool,
+    cache_dir: str,
+    no_cache: bool,
+    clear_cache: bool,
+) -> "AI":
+    from aint.infrastructure.ai.engine import RequestEngine, RetryPolicy
+
+    if verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    engine = RequestEngine(
+        max_concurrency=jobs,
+        requests_per_minute=rpm,
+        tokens_per_minute=tpm,
+        retry=RetryPolicy(max_attempts=max_retries + 1),
+    )
+    return create_ai(
+        open_cache(cache_dir, no_cache, clear_cache),
+        engine,
+        model=model,
+        models_path=models_path,
+        json_mode=json_mode,
+    )
+
+
+def create_session(**engine_kwargs) -> "CompilerSession":
+    from aint.presentation.session import CompilerSession
+
+    return CompilerSession(
+        create_engine_ai(**engine_kwargs), jobs=engine_kwargs["jobs"]
+    )
+
+
+def flow_options(command):
+    command = click.option(
+        "--queue",
+        type=click.Path(dir_okay=False, file_okay=True),
+        help=(
+            "Have `aint worker` processes sharing this task queue make "
+            "the model requests. --jobs bounds the tasks in flight."
+        ),
+    )(command)
+    command = click.option(
+        "--bundle",
+        type=click.Path(dir_okay=False, file_okay=True),
+        help=(
+            "Grammar bundle to use, rebuilt when stale. "
+            f"Defaults to OUTPUT_BASE_DIR/{BUNDLE_FILENAME}."
+        ),
+    )(command)
+    command = click.option(
+        "--stream",
+        is_flag=True,
+        help=(
+            "Stream batched compile answers and write every file as soon "
+            "as it is decoded. Needs --batch-tokens, not used with --queue."
+        ),
+    )(command)
+    command = click.option(
+        "--shard-tokens",
+        type=click.IntRange(min=1),
+        help=(
+            "Split units selected by linking rules with scope: shard into "
+            "concurrent requests of about this many input tokens."
+        ),
+    )(command)
+    command = click.option(
+        "--batch-tokens",
+        type=click.IntRange(min=1),
+        help=(
+            "Pack units sharing a compilation rule into requests of about "
+            "this many input tokens."
+        ),
+    )(command)
+    command = click.option(
+        "--chunk-chars",
+        type=click.IntRange(min=1),
+        default=16 * 1024,
+        show_default=True,
+        help="Split sources sent to the model into chunks of about this size.",
+    )(command)
+    command = click.argument(
+        "output_base_dir",
+        type=click.Path(dir_okay=True, file_okay=False),
+    )(command)
+    command = click.argument(
+        "definition_dir",
+        type=click.Path(dir_okay=True, file_okay=False),
+    )(command)
+    return click.argument("inputs", nargs=-1, required=True)(command)
+
+
+def create_job(
+    inputs: tuple[str, ...],
+    definition_dir: str,
+    output_base_dir: str,
+    chunk_chars: int,
+    batch_tokens: int | None,
+    shard_tokens: int | None,
+    stream: bool,
+    bundle: str | None,
+    queue: str | None,
+    incremental: bool,
+) -> "CompileJob":
+    from aint.presentation.daemon import CompileJob
+    from aint.presentation.session import CompileOptions
+
+    if stream and batch_tokens is None:
+        raise click.UsageError("--stream requires --batch-tokens.")
+    # Paths are absolute, so that a server in another directory can
+    # run the job.
+    return CompileJob(
+        inputs=[
+            os.path.abspath(pattern) for pattern in inputs
+        ],
+        definition_dir=os.path.abspath(definition_dir),
+        output_base_dir=os.path.abspath(output_base_dir),
+        options=CompileOptions(
+            chunk_chars=chunk_chars,
+            batch_tokens=batch_tokens,
+            shard_tokens=shard_tokens,
+            stream=stream,
+            incremental=incremental,
+            bundle=os.path.abspath(bundle) if bundle is not None else None,
+            queue=os.path.abspath(queue) if queue is not None else None,
+        ),
+    )
+
+
+def print_result(result: "JobResult") -> None:
+    for line in result.lines:
+        click.echo(line)
+    for error in result.errors:
+        click.echo(click.style(error, fg="red"), err=True)
+
+
+@aint_group.command("compile")
+@flow_options
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only rebuild what changed since the last incremental run.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print per-stage and per-rule request statistics.",
+)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False, file_okay=True),
+    help="Write a Chrome/Perfetto trace of the run to this file.",
+)
+@engine_options
+def compile_command(
+    inputs,
+    definition_dir,
+    output_base_dir,
+    chunk_chars,
+    batch_tokens,
+    shard_tokens,
+    stream,
+    bundle,
+    queue,
+    incremental,
+    profile,
+    trace,
+    **engine_kwargs,
+):
+    from aint.presentation.daemon import run_job
+
+    tracer.reset(enabled=profile or trace is not None)
+    job = create_job(
+        inputs, definition_dir, output_base_dir, chunk_chars,
+        batch_tokens, shard_tokens, stream, bundle, queue, incremental,
+    )
+    with create_session(**engine_kwargs) as session:
+        result = run_job(session, job)
+    print_result(result)
+    if session.ai.router is not None:
+        print_routing(session.ai.router)
+    if trace is not None:
+        tracer.write_chrome_trace(Path(trace))
+    if profile:
+        print_profile(tracer.summary())
+    if not result.ok:
+        raise click.exceptions.Exit(1)
+
+
+@aint_group.command("watch")
+@flow_options
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=0.5,
+    show_default=True,
+    help="Seconds between checks for changed sources and definitions.",
+)
+@engine_options
+def watch_command(
+    inputs,
+    definition_dir,
+    output_base_dir,
+    chunk_chars,
+    batch_tokens,
+    shard_tokens,
+    stream,
+    bundle,
+    queue,
+    interval,
+    **engine_kwargs,
+):
+    """Recompile incrementally whenever sources or definitions change."""
+    from aint.presentation.daemon import watch
+
+    job = create_job(
+        inputs, definition_dir, output_base_dir, chunk_chars,
+        batch_tokens, shard_tokens, stream, bundle, queue,
+        incremental=True,
+    )
+    with create_session(**engine_kwargs) as session:
+        try:
+            watch(session, job, print_result, interval)
+        except KeyboardInterrupt:
+            pass
+
+
+@aint_group.command("serve")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False, file_okay=True),
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="Unix socket that only the user running the server can use.",
+)
+@engine_options
+def serve_command(socket_path, **engine_kwargs):
+    """Keep grammars, caches and connections warm for submitted jobs."""
+    from aint.presentation.daemon import CompileServer
+
+    path = Path(socket_path).expanduser()
+    with create_session(**engine_kwargs) as session:
+        try:
+            server = CompileServer(path, session)
+        except OSError as exc:
+            err_exit(f"Cannot serve: {exc}")
+        with server:
+            click.echo(f"serving on {path}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+@aint_group.command("submit")
+@flow_options
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Rebuild everything instead of only what changed.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False, file_okay=True),
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="Unix socket that only the user running the server can use.",
+)
+def submit_command(
+    inputs,
+    definition_dir,
+    output_base_dir,
+    chunk_chars,
+    batch_tokens,
+    shard_tokens,
+    stream,
+    bundle,
+    queue,
+    full,
+    socket_path,
+):
+    """Compile on a running `aint serve`."""
+    from aint.presentation.daemon import submit_job
+
+    job = create_job(
+        inputs, definition_dir, output_base_dir, chunk_chars,
+        batch_tokens, shard_tokens, stream, bundle, queue,
+        incremental=not full,
+    )
+    path = Path(socket_path).expanduser()
+    try:
+        result = submit_job(path, job)
+    except OSError as exc:
+        err_exit(f"Cannot reach aint server at {path}: {exc}")
+    print_result(result)
+    if not result.ok:
+        raise click.exceptions.Exit(1)
+
+
+@aint_group.command("worker")
+@click.argument("queue", type=click.Path(dir_okay=False, file_okay=True))
+@click.option(
+    "--lease",
+    type=click.FloatRange(min=1),
+    default=60,
+    show_default=True,
+    help=(
+        "Seconds after which tasks of a worker that stopped renewing "
+        "them are issued again."
+    ),
+)
+@engine_options
+def worker_command(queue, lease, **engine_kwargs):
+    """Make the model requests of compilations run with --queue."""
+    import threading
+
+    from aint.infrastructure.distributed.queue import TaskQueue
+    from aint.infrastructure.distributed.worker import Worker
+
+    worker = Worker(
+        TaskQueue(Path(queue)),
+        create_engine_ai(**engine_kwargs),
+        jobs=engine_kwargs["jobs"],
+        lease=lease,
+    )
+    click.echo(f"worker {worker.name} on {queue}")
+    try:
+        worker.run(threading.Event())
+    except KeyboardInterrupt:
+        pass
+    click.echo(
+        f"tasks: {worker.stats.done} done, {worker.stats.failed} failed"
     )
-    save_generated(output_base_dir, generated)
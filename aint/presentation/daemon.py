@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import adaptix
+from adaptix.load_error import LoadError
+
+from aint.domain.flow import CompilationError, LinkConflictError
+from aint.presentation.definition_loaders import YamlDefLoader
+from aint.presentation.session import CompileOptions, CompilerSession
+from aint.presentation.sources import expand_source_paths
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompileJob:
+    inputs: list[str]
+    definition_dir: str
+    output_base_dir: str
+    options: CompileOptions = field(default_factory=CompileOptions)
+
+
+@dataclass
+class JobResult:
+    ok: bool
+    lines: list[str] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+
+def run_job(session: CompilerSession, job: CompileJob) -> JobResult:
+    try:
+        report = session.compile(
+            job.inputs,
+            Path(job.definition_dir),
+            Path(job.output_base_dir),
+            job.options,
+        )
+    except CompilationError as exc:
+        return JobResult(
+            ok=False, errors=[*map(repr, exc.errors), str(exc)]
+        )
+    except (LinkConflictError, FileNotFoundError) as exc:
+        return JobResult(ok=False, errors=[str(exc)])
+    except Exception as exc:
+        # A failed job must not take the server or the watcher down.
+        logger.exception("Compile job failed")
+        return JobResult(ok=False, errors=[repr(exc)])
+    return JobResult(ok=True, lines=report.lines())
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    server: "CompileServer"
+
+    def handle(self) -> None:
+        # One JSON encoded job per line, answered by one result line.
+        for line in self.rfile:
+            try:
+                job = adaptix.load(json.loads(line), CompileJob)
+            except (ValueError, LoadError) as exc:
+                result = JobResult(ok=False, errors=[f"Invalid job: {exc}"])
+            else:
+                result = run_job(self.server.session, job)
+            self.wfile.write(
+                json.dumps(adaptix.dump(result)).encode() + b"\n"
+            )
+            self.wfile.flush()
+
+
+class CompileServer(socketserver.ThreadingUnixStreamServer):
+    """Runs compile jobs from clients on one warm session.
+
+    Jobs read and write any path the server can and spend its API key,
+    so the socket is only accessible to the user running the server.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, session: CompilerSession) -> None:
+        super().__init__(str(path), _JobHandler)
+        self.session = session
+
+    def server_bind(self) -> None:
+        path = Path(self.server_address)
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if path.is_socket():
+            try:
+                with socket.socket(socket.AF_UNIX) as conn:
+                    conn.connect(str(path))
+            except ConnectionRefusedError:
+                # Left behind by a server that did not shut down.
+                path.unlink()
+            else:
+                raise OSError(f"A server is already listening on {path}")
+        # The socket is created without group and other permissions,
+        # rather than restricted after other users could connect.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self) -> None:
+        super().server_close()
+        Path(self.server_address).unlink(missing_ok=True)
+
+
+def submit_job(path: Path, job: CompileJob) -> JobResult:
+    with socket.socket(socket.AF_UNIX) as conn:
+        conn.connect(str(path))
+        conn.sendall(json.dumps(adaptix.dump(job)).encode() + b"\n")
+        with conn.makefile("rb") as response:
+            line = response.readline()
+    if not line:
+        raise ConnectionError("Server closed the connection")
+    return adaptix.load(json.loads(line), JobResult)
+
+
+def _snapshot(
+    inputs: list[str], definition_dir: Path
+) -> dict[Path, tuple[int, int] | None]:
+    loader = YamlDefLoader(definition_dir)
+    paths = [
+        *expand_source_paths(inputs),
+        loader.parse_rules_path,
+        loader.link_rules_path,
+        loader.compile_rules_path,
+    ]
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            snapshot[path] = None
+        else:
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def watch(
+    session: CompilerSession,
+    job: CompileJob,
+    on_result: Callable[[JobResult], None],
+    interval: float = 0.5,
+) -> None:
+    """Recompile whenever sources or definitions change, until interrupted.
+
+    Changes are detected by polling mtimes and sizes. The job should be
+    incremental, so that only affected sources are parsed again and only
+    affected units are compiled again.
+    """
+    previous = None
+    while True:
+        snapshot = _snapshot(job.inputs, Path(job.definition_dir))
+        if snapshot != previous:
+            previous = snapshot
+            on_result(run_job(session, job))
+        time.sleep(interval)
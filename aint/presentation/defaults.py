@@ -0,0 +1,9 @@
+# Kept free of heavy imports, the CLI reads these to declare its options.
+DEFAULT_MODEL = "kwaipilot/kat-coder-pro:free"
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_API_KEY_ENV = "OPENROUTER_API_KEY"
+
+BUNDLE_FILENAME = ".aint-bundle.json"
+
+# Socket of `aint serve`, expanded to the home of the user running it.
+DEFAULT_SOCKET = "~/.aint/server.sock"
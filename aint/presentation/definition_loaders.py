@@ -1,5 +1,7 @@
-from dataclasses import dataclass
+import hashlib
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Literal
 
 import adaptix
 import yaml
@@ -7,7 +9,7 @@ import yaml
 from aint.domain.flow import RuleParser
 from aint.domain.gen import CompilationRule
 from aint.domain.syntax import ParseRule
-from aint.domain.units import LinkingRule
+from aint.domain.units import LinkingRule, LocalLinking
 
 
 @dataclass
@@ -16,10 +18,21 @@ class _ParseRuleDef:
     pattern: str
 
 
+@dataclass
+class _LocalLinkDef:
+    let: dict[str, str] = field(default_factory=dict)
+    workspace: dict[str, str] = field(default_factory=dict)
+    units: dict[str, str] = field(default_factory=dict)
+
+
 @dataclass
 class _LinkRuleDef:
     select: list[str]
-    rule: str
+    rule: str = ""
+    scope: Literal["global", "shard"] = "global"
+    reads: list[str] | None = None
+    writes: list[str] | None = None
+    local: _LocalLinkDef | None = None
 
 
 @dataclass
@@ -41,6 +54,18 @@ class YamlDefLoader(RuleParser):
         self.link_rules_path = base_path / link_rules_filename
         self.compile_rules_path = base_path / compile_rules_filename
 
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for path in (
+            self.parse_rules_path,
+            self.link_rules_path,
+            self.compile_rules_path,
+        ):
+            content = path.read_bytes()
+            digest.update(f"{path.name}:{len(content)}:".encode())
+            digest.update(content)
+        return digest.hexdigest()
+
     def get_parse_rules(self) -> list[ParseRule]:
         defs = adaptix.load(
             yaml.safe_load(self.parse_rules_path.read_text()),
@@ -56,8 +81,24 @@ class YamlDefLoader(RuleParser):
             yaml.safe_load(self.link_rules_path.read_text()),
             dict[str, _LinkRuleDef]
         )
+        for name, rule in defs.items():
+            if not rule.rule and rule.local is None:
+                raise ValueError(
+                    f"Linking rule {name!r} has neither a rule text "
+                    "nor local expressions"
+                )
         return [
-            LinkingRule(name, rule.select, rule.rule)
+            LinkingRule(
+                name,
+                rule.select,
+                rule.rule,
+                rule.scope,
+                rule.reads,
+                rule.writes,
+                None if rule.local is None else LocalLinking(
+                    rule.local.let, rule.local.workspace, rule.local.units
+                ),
+            )
             for name, rule in defs.items()
         ]
 
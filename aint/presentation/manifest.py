@@ -0,0 +1,27 @@
+import json
+from pathlib import Path
+
+import adaptix
+from adaptix.load_error import LoadError
+
+from aint.domain.incremental import BuildManifest
+
+MANIFEST_FILENAME = ".aint-manifest.json"
+
+
+def load_manifest(path: Path) -> BuildManifest | None:
+    if not path.is_file():
+        return None
+    try:
+        return adaptix.load(json.loads(path.read_text()), BuildManifest)
+    except (ValueError, LoadError):
+        return None
+
+
+def save_manifest(path: Path, manifest: BuildManifest) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(
+        json.dumps(adaptix.dump(manifest), indent=1, ensure_ascii=False)
+    )
+    tmp_path.replace(path)
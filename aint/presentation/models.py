@@ -0,0 +1,80 @@
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import adaptix
+import openai
+import yaml
+
+from aint.domain.flow import STAGES
+from aint.infrastructure.ai.routing import Endpoint, ModelRouter, Route
+from aint.presentation.defaults import DEFAULT_API_KEY_ENV, DEFAULT_BASE_URL
+
+
+@dataclass
+class _EndpointDef:
+    model: str
+    base_url: str = DEFAULT_BASE_URL
+    api_key_env: str = DEFAULT_API_KEY_ENV
+    max_latency: float | None = None
+    json_mode: bool = False
+
+
+@dataclass
+class _RouteDef:
+    endpoints: list[str]
+    stage: str | None = None
+    rule: str | None = None
+
+
+@dataclass
+class _ModelsDef:
+    endpoints: dict[str, _EndpointDef]
+    routes: list[_RouteDef] = field(default_factory=list)
+    max_failures: int = 2
+    cooldown: float = 60
+
+
+def create_client(
+    base_url: str = DEFAULT_BASE_URL,
+    api_key_env: str = DEFAULT_API_KEY_ENV,
+) -> openai.Client:
+    # Retries are done by the request engine.
+    return openai.Client(
+        api_key=os.environ[api_key_env], base_url=base_url, max_retries=0
+    )
+
+
+def load_router(path: Path) -> ModelRouter:
+    """Load endpoints and stage/rule routes from a YAML file."""
+    defs = adaptix.load(yaml.safe_load(path.read_text()), _ModelsDef)
+    for route in defs.routes:
+        if route.stage is not None and route.stage not in STAGES:
+            raise ValueError(
+                f"Route has unknown stage {route.stage!r}, expected one "
+                f"of {', '.join(STAGES)}"
+            )
+    clients: dict[tuple[str, str], openai.Client] = {}
+    endpoints = []
+    for name, endpoint in defs.endpoints.items():
+        key = (endpoint.base_url, endpoint.api_key_env)
+        if key not in clients:
+            clients[key] = create_client(*key)
+        endpoints.append(
+            Endpoint(
+                name,
+                clients[key],
+                endpoint.model,
+                endpoint.max_latency,
+                endpoint.json_mode,
+            )
+        )
+    return ModelRouter(
+        endpoints,
+        [
+            Route(route.endpoints, route.stage, route.rule)
+            for route in defs.routes
+        ],
+        max_failures=defs.max_failures,
+        cooldown=defs.cooldown,
+    )
@@ -0,0 +1,322 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import TypeVar
+
+from aint.domain.flow import (
+    AsyncUnitCompiler,
+    CompilationError,
+    SourceParser,
+    UnitLinker,
+    run_compiler_flow,
+)
+from aint.domain.incremental import BuildManifest, IncrementalBuild
+from aint.domain.tracing import tracer
+from aint.infrastructure.ai.cache import CacheStats
+from aint.infrastructure.ai.client import AI
+from aint.infrastructure.ai.engine import EngineStats
+from aint.infrastructure.ai.impl import (
+    AIAsyncUnitCompiler,
+    AIRuleExplainer,
+    AISourceParser,
+    AIUnitLinker,
+)
+from aint.infrastructure.distributed.queue import TaskClient, TaskQueue
+from aint.infrastructure.distributed.remote import (
+    QueuedSourceParser,
+    QueuedUnitCompiler,
+    QueuedUnitLinker,
+)
+from aint.infrastructure.local.chunking import ChunkedSourceParser
+from aint.infrastructure.local.linking import LocalUnitLinker
+from aint.infrastructure.local.parser import LocalPatternParser
+from aint.infrastructure.local.rendering import LocalTemplateCompiler
+from aint.presentation.bundle import (
+    GrammarBundle,
+    build_bundle,
+    default_bundle_path,
+    load_fresh_bundle,
+    save_bundle,
+)
+from aint.presentation.definition_loaders import YamlDefLoader
+from aint.presentation.manifest import (
+    MANIFEST_FILENAME,
+    load_manifest,
+    save_manifest,
+)
+from aint.presentation.sources import (
+    OutputWriter,
+    WriteStats,
+    expand_source_paths,
+    load_sources,
+)
+
+S = TypeVar("S", CacheStats, EngineStats)
+
+
+@dataclass
+class CompileOptions:
+    chunk_chars: int = 16 * 1024
+    batch_tokens: int | None = None
+    shard_tokens: int | None = None
+    # Whether batched compile answers are streamed.
+    stream: bool = False
+    incremental: bool = False
+    bundle: str | None = None
+    # Task queue of workers that make the model requests, if any.
+    queue: str | None = None
+
+
+@dataclass
+class CompileReport:
+    outputs: WriteStats
+    engine: EngineStats
+    cache: CacheStats | None
+
+    def lines(self) -> list[str]:
+        lines = [
+            f"outputs: {self.outputs.written} written, "
+            f"{self.outputs.unchanged} unchanged, "
+            f"{self.outputs.deleted} deleted"
+        ]
+        if self.cache is not None:
+            lines.append(
+                f"cache: {self.cache.hits} hits, "
+                f"{self.cache.misses} misses, "
+                f"{self.cache.coalesced} coalesced"
+            )
+        lines.append(
+            f"requests: {self.engine.requests}, "
+            f"retries: {self.engine.retries}, "
+            f"throttled: {self.engine.throttled}"
+        )
+        return lines
+
+
+def _stats_delta(after: S, before: S) -> S:
+    return replace(
+        after,
+        **{
+            name: getattr(after, name) - getattr(before, name)
+            for name in vars(after)
+        },
+    )
+
+
+def _load_manifest(
+    path: Path, output_base_dir: Path
+) -> BuildManifest | None:
+    manifest = load_manifest(path)
+    if manifest is not None:
+        # Units whose outputs were deleted are compiled again.
+        manifest.outputs = {
+            key: record
+            for key, record in manifest.outputs.items()
+            if all(
+                (output_base_dir / output).is_file()
+                for output in record.paths
+            )
+        }
+    return manifest
+
+
+class CompilerSession:
+    """State reused between compilations.
+
+    Keeps the model client with its pooled connections, the response
+    cache and explained grammars, so that repeated compilations only pay
+    for what changed. Build manifests are read from the output directory
+    on every compilation, so that outputs deleted meanwhile are written
+    again. Compilations run one at a time.
+    """
+
+    def __init__(self, ai: AI, jobs: int = 8) -> None:
+        self.ai = ai
+        self.jobs = jobs
+        self._grammars: dict[Path, GrammarBundle] = {}
+        self._process_pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "CompilerSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+
+    def grammar(self, definition_dir: Path, path: Path) -> GrammarBundle:
+        loader = YamlDefLoader(definition_dir)
+        bundle = self._grammars.get(path.resolve())
+        if bundle is not None and (
+            bundle.definitions_hash == loader.fingerprint()
+        ):
+            return bundle
+        bundle = load_fresh_bundle(path, loader)
+        if bundle is None:
+            with tracer.span("build_grammar", stage="explain"):
+                bundle = build_bundle(loader, AIRuleExplainer(self.ai))
+            save_bundle(path, bundle)
+        self._grammars[path.resolve()] = bundle
+        return bundle
+
+    def compile(
+        self,
+        inputs: list[str],
+        definition_dir: Path,
+        output_base_dir: Path,
+        options: CompileOptions,
+    ) -> CompileReport:
+        with self._lock:
+            return self._compile(
+                inputs, definition_dir, output_base_dir, options
+            )
+
+    def _compile(
+        self,
+        inputs: list[str],
+        definition_dir: Path,
+        output_base_dir: Path,
+        options: CompileOptions,
+    ) -> CompileReport:
+        source_paths = expand_source_paths(inputs)
+        missing = [path for path in source_paths if not path.is_file()]
+        if missing:
+            raise FileNotFoundError(f"Source file not found: {missing[0]}")
+        if not source_paths:
+            raise FileNotFoundError("No source files matched the given inputs")
+        cache_before = (
+            None if self.ai.cache is None else replace(self.ai.cache.stats)
+        )
+        engine_before = replace(self.ai.engine.stats)
+        grammar = self.grammar(
+            definition_dir,
+            Path(options.bundle)
+            if options.bundle is not None
+            else default_bundle_path(output_base_dir),
+        )
+        if self._process_pool is None:
+            # Parse threads submit to the pool, forking them could
+            # deadlock the children.
+            self._process_pool = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        with ExitStack() as stack:
+            source_parser, unit_linker, unit_compiler = (
+                self._model_stages(options, stack)
+            )
+            outputs = self._run_flow(
+                source_paths,
+                grammar,
+                output_base_dir,
+                options,
+                source_parser,
+                unit_linker,
+                unit_compiler,
+            )
+        return CompileReport(
+            outputs=outputs,
+            engine=_stats_delta(self.ai.engine.stats, engine_before),
+            cache=(
+                None if cache_before is None
+                else _stats_delta(self.ai.cache.stats, cache_before)
+            ),
+        )
+
+    def _model_stages(
+        self, options: CompileOptions, stack: ExitStack
+    ) -> tuple[SourceParser, UnitLinker, AsyncUnitCompiler]:
+        """Parser, linker and compiler of the stages that need the model,
+        their resources released by the stack."""
+        if options.queue is None:
+            unit_compiler = AIAsyncUnitCompiler(
+                self.ai,
+                jobs=self.jobs,
+                batch_tokens=options.batch_tokens,
+                stream=options.stream,
+            )
+            stack.callback(unit_compiler.close)
+            return (
+                AISourceParser(self.ai),
+                AIUnitLinker(
+                    self.ai, shard_tokens=options.shard_tokens, jobs=self.jobs
+                ),
+                unit_compiler,
+            )
+        # Workers make the model requests. Up to `jobs` parse and link
+        # tasks and twice as many compile tasks per rule are in flight,
+        # which should cover the jobs of all workers.
+        client = TaskClient(TaskQueue(Path(options.queue)))
+        stack.callback(client.close)
+        return (
+            QueuedSourceParser(client),
+            QueuedUnitLinker(
+                self.ai,
+                shard_tokens=options.shard_tokens,
+                jobs=self.jobs,
+                client=client,
+            ),
+            QueuedUnitCompiler(
+                client,
+                batch_tokens=options.batch_tokens,
+                jobs=self.jobs,
+            ),
+        )
+
+    def _run_flow(
+        self,
+        source_paths: list[Path],
+        grammar: GrammarBundle,
+        output_base_dir: Path,
+        options: CompileOptions,
+        source_parser: SourceParser,
+        unit_linker: UnitLinker,
+        unit_compiler: AsyncUnitCompiler,
+    ) -> WriteStats:
+        parser = LocalPatternParser(
+            ChunkedSourceParser(
+                source_parser,
+                max_chars=options.chunk_chars,
+                jobs=self.jobs,
+            ),
+            matchers=grammar.matchers,
+            process_pool=self._process_pool,
+        )
+        linker = LocalUnitLinker(unit_linker)
+        sources = load_sources(source_paths, jobs=self.jobs)
+        manifest_path = output_base_dir / MANIFEST_FILENAME
+        build = None
+        if options.incremental:
+            build = IncrementalBuild(
+                _load_manifest(manifest_path, output_base_dir),
+                grammar.definitions_hash,
+            )
+        with OutputWriter(output_base_dir, jobs=self.jobs) as writer:
+            try:
+                # Files are written as soon as they are compiled, so that
+                # a failed run keeps everything finished before it.
+                run_compiler_flow(
+                    grammar, grammar, sources, parser, linker,
+                    LocalTemplateCompiler(unit_compiler),
+                    parse_jobs=self.jobs,
+                    stage_jobs=self.jobs,
+                    incremental=build,
+                    sink=lambda source: writer.write([source]),
+                )
+            except CompilationError:
+                if build is not None:
+                    save_manifest(manifest_path, build.manifest)
+                raise
+            with tracer.span("save", stage="save"):
+                if build is not None:
+                    writer.delete(build.stale_outputs())
+                writer.flush()
+        if build is not None:
+            save_manifest(manifest_path, build.manifest)
+        return writer.stats
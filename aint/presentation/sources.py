@@ -1,21 +1,179 @@
+import glob
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
 from aint.domain.gen import GeneratedSource
 from aint.domain.syntax import SourceFile
 
 
-def load_sources(sources: list[Path]) -> list[SourceFile]:
-    return [
-        SourceFile(path=str(source), content=source.read_text())
-        for source in sources
-    ]
+def _is_glob(pattern: str) -> bool:
+    return any(char in pattern for char in "*?[")
+
+
+def expand_source_paths(patterns: list[str]) -> list[Path]:
+    paths = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            paths.extend(
+                sorted(child for child in path.rglob("*") if child.is_file())
+            )
+        elif _is_glob(pattern):
+            paths.extend(
+                Path(match)
+                for match in sorted(glob.glob(pattern, recursive=True))
+                if Path(match).is_file()
+            )
+        else:
+            paths.append(path)
+    return list(dict.fromkeys(paths))
+
+
+def load_sources(sources: list[Path], jobs: int = 1) -> list[SourceFile]:
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return list(
+            executor.map(
+                lambda source: SourceFile(
+                    path=str(source), content=source.read_text()
+                ),
+                sources,
+            )
+        )
+
+
+@dataclass
+class WriteStats:
+    written: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+
+class OutputWriter:
+    """Writes generated sources on a thread pool.
+
+    A file is only replaced when its content differs, so unchanged
+    outputs keep their mtime and downstream builds stay incremental.
+    Replacement goes through a temporary file and a rename, so readers
+    never see a partially written file. At most `jobs * 4` writes are in
+    flight, `write` waits for earlier ones when generating outpaces the
+    disk, so that queued content stays bounded.
+    """
+
+    def __init__(self, base_path: str | Path, jobs: int = 4) -> None:
+        self.base_path = Path(base_path)
+        self.stats = WriteStats()
+        self._lock = threading.Lock()
+        self._created_dirs: set[Path] = set()
+        self._path_locks: dict[Path, threading.Lock] = {}
+        self._pending: list[Future] = []
+        self._slots = threading.Semaphore(max(1, jobs) * 4)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, jobs), thread_name_prefix="aint-write"
+        )
+
+    def __enter__(self) -> "OutputWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _make_dirs(self, paths: list[Path]) -> None:
+        with self._lock:
+            dirs = {path.parent for path in paths} - self._created_dirs
+            # Creating the deepest directories creates their parents too.
+            for directory in sorted(dirs, reverse=True):
+                directory.mkdir(parents=True, exist_ok=True)
+            self._created_dirs |= dirs
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+    def _write_file(self, path: Path, content: str) -> None:
+        data = content.encode()
+        with self._lock:
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+        with path_lock:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stat = None
+            if (
+                stat is not None
+                and stat.st_size == len(data)
+                and path.read_bytes() == data
+            ):
+                self._count("unchanged")
+                return
+            tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                tmp_path.write_bytes(data)
+                if stat is not None:
+                    os.chmod(tmp_path, stat.st_mode)
+                os.replace(tmp_path, path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        self._count("written")
+
+    def write(self, generated: list[GeneratedSource]) -> None:
+        """Schedule writes, `flush` waits for them to finish."""
+        # Within a batch a later source for the same path wins.
+        contents = {
+            self.base_path / source.path: source.content
+            for source in generated
+        }
+        self._make_dirs(list(contents))
+        futures = []
+        for path, content in contents.items():
+            self._slots.acquire()
+            try:
+                future = self._executor.submit(self._write_file, path, content)
+            except BaseException:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+            futures.append(future)
+        with self._lock:
+            # Finished writes are dropped unless `flush` has to raise
+            # their error, so that long streams stay bounded.
+            self._pending = [
+                future
+                for future in self._pending
+                if not future.done() or future.exception() is not None
+            ]
+            self._pending.extend(futures)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def delete(self, paths: list[str]) -> None:
+        for path in paths:
+            try:
+                (self.base_path / path).unlink()
+            except FileNotFoundError:
+                continue
+            self._count("deleted")
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
 
 
 def save_generated(
     base_path: str | Path,
-    generated: list[GeneratedSource]
-) -> None:
-    for source in generated:
-        path = Path(base_path, source.path)
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(source.content)
+    generated: list[GeneratedSource],
+    jobs: int = 4,
+) -> WriteStats:
+    with OutputWriter(base_path, jobs) as writer:
+        writer.write(generated)
+    return writer.stats
@@ -0,0 +1,197 @@
+"""An in-process stand-in for `openai.Client`.
+
+Responses are synthesized by a responder from the prompt kind, the
+system and the user message. Latency, jitter and transient errors are
+simulated so that retries, rate limiting and concurrency behave as they
+would against a real provider, malformed responses so that decoding
+has to tolerate them.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any
+
+import httpx
+import openai
+
+from aint.infrastructure.ai.decoding import extract_json
+
+Responder = Callable[[str, str, str], str]
+
+_FAKE_URL = "http://fake-openai.local/v1/chat/completions"
+_STREAM_CHUNK_CHARS = 64
+
+
+def prompt_kind(system: str, user: str) -> str:
+    """Tell which of the prompts in `templates.py` a request was made of."""
+    if "<conflicts>" in user:
+        return "link_reduce"
+    if "<code-template>" in user:
+        return "compile_units" if re.search(r"<unit index=", user) else (
+            "compile_unit"
+        )
+    if "<units>" in user:
+        return "link"
+    if "<code>" in user:
+        return "parse"
+    if "<pattern>" in user:
+        return "explain"
+    raise ValueError("Unknown prompt kind")
+
+
+def count_tokens(text: str) -> int:
+    # Roughly what BPE tokenizers produce for English text and code.
+    return len(text) // 4 + 1
+
+
+@dataclass
+class FakeStats:
+    requests: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class FakeOpenAI:
+    """Accepts `chat.completions.create` calls the way `AI` makes them."""
+
+    def __init__(
+        self,
+        responder: Responder,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        malformed_rate: float = 0,
+        seed: int | None = None,
+    ) -> None:
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.stats = FakeStats()
+        self.kinds: dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self._create)
+        )
+
+    def _delay(self) -> float:
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _malform(self, content: str) -> str:
+        """Wrap the content in prose or an odd fence, or cut a list of
+        several elements off in the middle."""
+        with self._lock:
+            if self._random.random() >= self.malformed_rate:
+                return content
+            form = self._random.choice(("prose", "fence", "truncate"))
+        if form == "prose":
+            return f"Here is the result:\n{content}\nLet me know if..."
+        if form == "fence":
+            return f"```JSON\n{content}\n```"
+        try:
+            value = extract_json(content)
+        except ValueError:
+            return content
+        if isinstance(value, dict):
+            value = value.get("items")
+        if not isinstance(value, list) or len(value) < 2:
+            return content
+        return content[:len(content) // 2]
+
+    def _error(self) -> openai.APIStatusError:
+        with self._lock:
+            status = self._random.choice((429, 500, 503))
+        response = httpx.Response(
+            status,
+            headers={"retry-after-ms": "10"},
+            request=httpx.Request("POST", _FAKE_URL),
+        )
+        if status == 429:
+            return openai.RateLimitError(
+                "Rate limit reached", response=response, body=None
+            )
+        return openai.InternalServerError(
+            "Server error", response=response, body=None
+        )
+
+    def _create(
+        self,
+        messages: list[dict[str, str]],
+        model: str,
+        temperature: float = 0,
+        stream: bool = False,
+        stream_options: dict[str, Any] | None = None,
+        response_format: dict[str, str] | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        system, user = messages[0]["content"], messages[1]["content"]
+        kind = prompt_kind(system, user)
+        delay = self._delay()
+        if self._fails():
+            time.sleep(delay / 4)
+            with self._lock:
+                self.stats.requests += 1
+                self.stats.errors += 1
+            raise self._error()
+        content = self.responder(kind, system, user)
+        if response_format is not None:
+            # JSON mode answers with a bare object, lists come wrapped.
+            value = extract_json(content)
+            content = json.dumps(
+                {"items": value} if isinstance(value, list) else value
+            )
+        content = self._malform(content)
+        usage = SimpleNamespace(
+            prompt_tokens=count_tokens(system + user),
+            completion_tokens=count_tokens(content),
+        )
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.prompt_tokens += usage.prompt_tokens
+            self.stats.completion_tokens += usage.completion_tokens
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+        if stream:
+            include_usage = bool(
+                stream_options and stream_options.get("include_usage")
+            )
+            return self._stream(
+                content, usage if include_usage else None, delay
+            )
+        time.sleep(delay)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+        )
+
+    @staticmethod
+    def _stream(
+        content: str, usage: Any, delay: float
+    ) -> Iterator[SimpleNamespace]:
+        parts = [
+            content[i:i + _STREAM_CHUNK_CHARS]
+            for i in range(0, len(content), _STREAM_CHUNK_CHARS)
+        ]
+        # Half of the latency goes to the first token, the rest is spread
+        # over the remaining chunks.
+        time.sleep(delay / 2)
+        for part in parts:
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=part))],
+                usage=None,
+            )
+            time.sleep(delay / 2 / len(parts))
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
@@ -0,0 +1,265 @@
+"""Run the whole compiler flow against a local fake model.
+
+    python -m bench.flow_bench --sources 20 --units 400 --latency 0.2
+
+Reports wall time, model requests, tokens and peak memory of
+`run_compiler_flow`. With --cache the flow runs a second time over a
+warm response cache. With --sink generated sources are streamed to a
+sink that only keeps their paths instead of being collected. With
+--malformed-rate that share of responses comes wrapped in prose or an
+odd fence, or cut off. With --workers the model requests are made by
+that many worker processes through a task queue, each with its own fake
+model and --jobs concurrent requests.
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any
+
+from aint.domain.flow import run_compiler_flow
+from aint.infrastructure.ai.cache import ResponseCache
+from aint.infrastructure.ai.client import AI
+from aint.infrastructure.ai.engine import RequestEngine, RetryPolicy
+from aint.infrastructure.ai.impl import (
+    AIAsyncUnitCompiler,
+    AIRuleExplainer,
+    AISourceParser,
+    AIUnitLinker,
+)
+from aint.infrastructure.distributed.queue import TaskClient, TaskQueue
+from aint.infrastructure.distributed.remote import (
+    QueuedSourceParser,
+    QueuedUnitCompiler,
+    QueuedUnitLinker,
+)
+from aint.infrastructure.distributed.worker import Worker
+from aint.infrastructure.local.chunking import ChunkedSourceParser
+from aint.infrastructure.local.linking import LocalUnitLinker
+from aint.infrastructure.local.parser import LocalPatternParser
+from aint.infrastructure.local.rendering import LocalTemplateCompiler
+from aint.presentation.bundle import build_bundle
+from bench.fake_openai import FakeOpenAI, FakeStats
+from bench.scenarios import generate_sources, load_definitions, respond
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sources", type=int, default=10)
+    parser.add_argument("--units", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--chunk-chars", type=int, default=16 * 1024)
+    parser.add_argument("--batch-tokens", type=int)
+    parser.add_argument("--shard-tokens", type=int)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--json-mode", action="store_true")
+    parser.add_argument("--cache", action="store_true")
+    parser.add_argument("--sink", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def _fake_ai(
+    args: argparse.Namespace, cache: ResponseCache | None, seed: int
+) -> tuple[AI, FakeOpenAI]:
+    client = FakeOpenAI(
+        respond,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        seed=seed,
+    )
+    engine = RequestEngine(
+        max_concurrency=args.jobs,
+        retry=RetryPolicy(max_attempts=20, base_delay=0.01, max_delay=0.5),
+    )
+    ai = AI(
+        client, "fake", cache=cache, engine=engine, json_mode=args.json_mode
+    )
+    return ai, client
+
+
+def _work(
+    args: argparse.Namespace,
+    queue_path: Path,
+    number: int,
+    ready: Any,
+    stop: Any,
+    results: Any,
+) -> None:
+    ai, client = _fake_ai(args, None, args.seed + number + 1)
+    worker = Worker(
+        TaskQueue(queue_path), ai, jobs=args.jobs, poll_interval=0.01
+    )
+    ready.release()
+    worker.run(stop)
+    results.put((client.stats, client.kinds, ai.engine.stats.retries))
+
+
+def _model_stages(
+    args: argparse.Namespace, ai: AI, stack: ExitStack
+) -> tuple[Any, Any, Any]:
+    if not args.workers:
+        compiler = AIAsyncUnitCompiler(
+            ai,
+            jobs=args.jobs,
+            batch_tokens=args.batch_tokens,
+            stream=args.stream,
+        )
+        stack.callback(compiler.close)
+        return (
+            AISourceParser(ai),
+            AIUnitLinker(ai, shard_tokens=args.shard_tokens, jobs=args.jobs),
+            compiler,
+        )
+    queue_dir = stack.enter_context(tempfile.TemporaryDirectory())
+    queue_path = Path(queue_dir, "tasks.sqlite3")
+    task_client = TaskClient(TaskQueue(queue_path), poll_interval=0.01)
+    stack.callback(task_client.close)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Semaphore(0)
+    stop = context.Event()
+    results = context.Queue()
+    workers = [
+        context.Process(
+            target=_work,
+            args=(args, queue_path, number, ready, stop, results),
+        )
+        for number in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    # Workers are running before the timing starts, as they would be.
+    for _ in workers:
+        ready.acquire()
+
+    def collect() -> None:
+        stop.set()
+        stats, kinds, retries = FakeStats(), {}, 0
+        for _ in workers:
+            worker_stats, worker_kinds, worker_retries = results.get()
+            for name in vars(stats):
+                setattr(
+                    stats,
+                    name,
+                    getattr(stats, name) + getattr(worker_stats, name),
+                )
+            for kind, count in worker_kinds.items():
+                kinds[kind] = kinds.get(kind, 0) + count
+            retries += worker_retries
+        for worker in workers:
+            worker.join()
+        _print_requests("  worker requests", stats, kinds, retries)
+
+    stack.callback(collect)
+    # Enough tasks in flight to keep all workers busy.
+    jobs = args.jobs * args.workers
+    return (
+        QueuedSourceParser(task_client),
+        QueuedUnitLinker(
+            ai, shard_tokens=args.shard_tokens, jobs=jobs, client=task_client
+        ),
+        QueuedUnitCompiler(
+            task_client,
+            batch_tokens=args.batch_tokens,
+            jobs=jobs,
+        ),
+    )
+
+
+def _print_requests(
+    title: str, stats: FakeStats, kinds: dict[str, int], retries: int
+) -> None:
+    print(
+        f"{title}: {stats.requests} "
+        f"({stats.errors} failed, {retries} retried)"
+    )
+    print(
+        "  by prompt: "
+        + ", ".join(f"{kind} {n}" for kind, n in sorted(kinds.items()))
+    )
+    print(
+        f"  tokens: {stats.prompt_tokens} prompt, "
+        f"{stats.completion_tokens} completion"
+    )
+
+
+def _run(args: argparse.Namespace, cache: ResponseCache | None) -> None:
+    ai, client = _fake_ai(args, cache, args.seed)
+    sources = generate_sources(args.sources, args.units, seed=args.seed)
+    paths: list[str] = []
+    jobs = args.jobs * max(1, args.workers)
+    with ExitStack() as stack:
+        process_pool = stack.enter_context(
+            ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        )
+        source_parser, unit_linker, unit_compiler = _model_stages(
+            args, ai, stack
+        )
+        tracemalloc.start()
+        start = time.perf_counter()
+        grammar = build_bundle(load_definitions(), AIRuleExplainer(ai))
+        parser = LocalPatternParser(
+            ChunkedSourceParser(
+                source_parser, max_chars=args.chunk_chars, jobs=jobs
+            ),
+            matchers=grammar.matchers,
+            process_pool=process_pool,
+        )
+        generated = run_compiler_flow(
+            grammar,
+            grammar,
+            sources,
+            parser,
+            LocalUnitLinker(unit_linker),
+            LocalTemplateCompiler(unit_compiler),
+            parse_jobs=jobs,
+            stage_jobs=args.jobs,
+            sink=(lambda source: paths.append(source.path))
+            if args.sink else None,
+        )
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  time: {elapsed:.2f} s")
+        print(f"  generated files: {len(generated) + len(paths)}")
+        _print_requests(
+            "  requests", client.stats, client.kinds, ai.engine.stats.retries
+        )
+        print(f"  peak memory: {peak / 2**20:.1f} MiB")
+
+
+def main() -> None:
+    args = _parse_args()
+    print(
+        f"{args.sources} sources, {args.units} units, "
+        f"latency {args.latency}+{args.jitter} s, "
+        f"error rate {args.error_rate}, "
+        f"malformed rate {args.malformed_rate}, {args.jobs} jobs, "
+        f"{args.workers} workers"
+    )
+    if not args.cache:
+        _run(args, None)
+        return
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ResponseCache(Path(cache_dir, "responses.sqlite3"))
+        print("cold cache:")
+        _run(args, cache)
+        print("warm cache:")
+        _run(args, cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Measure import time of the CLI with `python -X importtime`.
+
+    python -m bench.import_bench --runs 5 --budget-ms 150
+
+Imports the CLI entrypoint in fresh interpreters and reports the best
+cumulative import time and the slowest imported packages. Exits with an
+error if the CLI imports one of the heavy libraries that only commands
+should load, or if it takes longer than --budget-ms.
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+# Loaded by the commands that need them, never by `aint --help`.
+LAZY_MODULES = ("openai", "httpx", "jinja2", "adaptix", "yaml")
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="aint.cli_entrypoint")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float)
+    return parser.parse_args()
+
+
+def _import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every imported module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    args = _parse_args()
+    best: dict[str, int] = defaultdict(lambda: sys.maxsize)
+    for _ in range(args.runs):
+        for name, cumulative in _import_times(args.module).items():
+            best[name] = min(best[name], cumulative)
+    total = best[args.module] / 1000
+    print(f"import {args.module}: {total:.1f} ms (best of {args.runs})")
+    packages = {
+        name: cumulative
+        for name, cumulative in best.items()
+        if "." not in name and name != args.module
+    }
+    for name, cumulative in sorted(
+        packages.items(), key=lambda item: item[1], reverse=True
+    )[:args.top]:
+        print(f"  {name:<24} {cumulative / 1000:>8.1f} ms")
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in best]
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if args.budget_ms is not None and total > args.budget_ms:
+        failures.append(f"over budget of {args.budget_ms:.1f} ms")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
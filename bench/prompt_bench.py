@@ -0,0 +1,147 @@
+"""Measure prompt sizes in verbose and compact renderings.
+
+    python -m bench.prompt_bench [SOURCES] [UNITS]
+
+For every prompt kind prints the average number of input tokens per
+request in both renderings and how much of each prompt is a prefix
+shared with the previous request of the same kind, which is what
+provider prompt caching can reuse.
+"""
+import os
+import sys
+
+from aint.domain.syntax import ParseRule
+from aint.domain.units import Unit, Workspace
+from aint.infrastructure.ai.decoding import extract_json
+from aint.infrastructure.ai.impl import _Conflict
+from aint.infrastructure.ai.templates import (
+    COMPILE_UNIT_PROMPT,
+    COMPILE_UNITS_PROMPT,
+    EXPLAIN_PROMPT,
+    LINK_REDUCE_PROMPT,
+    LINK_UNITS_PROMPT,
+    PARSE_SOURCE_PROMPT,
+    Prompt,
+    render_templates,
+)
+from aint.presentation.definition_loaders import YamlDefLoader
+from bench.fake_openai import count_tokens
+from bench.scenarios import generate_sources, load_definitions, respond
+
+_BATCH_SIZE = 8
+
+
+def _workspace(
+    rules: dict[str, ParseRule], sources: int, units: int
+) -> Workspace:
+    parsed = []
+    for source in generate_sources(sources, units):
+        answer = respond("parse", "", f"<code>{source.content}</code>")
+        for unit in extract_json(answer):
+            parsed.append(Unit(rules[unit["rule"]], unit["slots"], {}))
+    workspace = Workspace(parsed, attributes={})
+    workspace.set_attr("package", "bench.module0")
+    for unit in workspace.units_of_types("dataclass")[::3]:
+        workspace.set_unit_attr(unit, "imports", ["Entity0", "Entity1"])
+    return workspace
+
+
+def _requests(
+    loader: YamlDefLoader, workspace: Workspace, sources: int, units: int
+) -> list[tuple[str, Prompt, dict]]:
+    parse_rules = loader.get_parse_rules()
+    requests = [("explain", EXPLAIN_PROMPT, {"rules": parse_rules})]
+    requests += [
+        (
+            "parse",
+            PARSE_SOURCE_PROMPT,
+            {"parse_algo": respond("explain", "", ""), "code": source.content},
+        )
+        for source in generate_sources(sources, units)
+    ]
+    for rule in loader.get_linking_rules():
+        selected = workspace.units_of_types(*rule.select)
+        requests.append(
+            (
+                "link",
+                LINK_UNITS_PROMPT,
+                {
+                    "units": list(enumerate(selected)),
+                    "attributes": workspace.read_attributes(rule.reads),
+                    "rule": rule.rule,
+                },
+            )
+        )
+        requests.append(
+            (
+                "link_reduce",
+                LINK_REDUCE_PROMPT,
+                {
+                    "conflicts": [
+                        _Conflict("set_workspace_attr", None, "package", [
+                            "bench.module0", "com.my.app",
+                        ])
+                    ],
+                    "attributes": workspace.read_attributes(rule.reads),
+                    "rule": rule.rule,
+                },
+            )
+        )
+    for rule in loader.get_compilation_rules():
+        selected = workspace.units_of_types(rule.unit_type)
+        requests += [
+            (
+                "compile_unit",
+                COMPILE_UNIT_PROMPT,
+                {"unit": unit, "workspace": workspace, "rule": rule},
+            )
+            for unit in selected
+        ]
+        requests += [
+            (
+                "compile_units",
+                COMPILE_UNITS_PROMPT,
+                {
+                    "units": list(enumerate(selected[i:i + _BATCH_SIZE])),
+                    "workspace": workspace,
+                    "rule": rule,
+                },
+            )
+            for i in range(0, len(selected), _BATCH_SIZE)
+        ]
+    return requests
+
+
+def main(sources: int, units: int) -> None:
+    loader = load_definitions()
+    rules = {rule.name: rule for rule in loader.get_parse_rules()}
+    workspace = _workspace(rules, sources, units)
+    totals: dict[str, list[float]] = {}
+    previous: dict[str, str] = {}
+    for kind, prompt, data in _requests(loader, workspace, sources, units):
+        verbose = "".join(render_templates(prompt, data, compact=False))
+        compact = "".join(render_templates(prompt, data, compact=True))
+        shared = len(os.path.commonprefix([previous.get(kind, ""), compact]))
+        previous[kind] = compact
+        row = totals.setdefault(kind, [0, 0, 0, 0])
+        row[0] += 1
+        row[1] += count_tokens(verbose)
+        row[2] += count_tokens(compact)
+        row[3] += shared / len(compact)
+    print(
+        f"{'prompt':<14} {'requests':>8} {'verbose':>8} {'compact':>8} "
+        f"{'saved':>6} {'shared prefix':>13}"
+    )
+    for kind, (count, verbose, compact, shared) in totals.items():
+        print(
+            f"{kind:<14} {count:>8} {verbose / count:>8.0f} "
+            f"{compact / count:>8.0f} {1 - compact / verbose:>6.0%} "
+            f"{shared / count:>13.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+    )
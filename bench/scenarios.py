@@ -0,0 +1,192 @@
+"""Synthetic programs in the `test/` grammar and model answers for them."""
+import json
+import random
+import re
+from pathlib import Path
+
+from aint.domain.syntax import SourceFile
+from aint.presentation.definition_loaders import YamlDefLoader
+
+DEFINITION_DIR = Path(__file__).parent.parent / "test"
+LINK_RULES_PATH = Path(__file__).parent / "linking.yml"
+
+_PRIMITIVES = ("long", "int", "String", "boolean", "double")
+_PARSE_ALGO = """
+<steps>
+    <step>Find every package declaration and dataclass declaration.</step>
+    <step>Extract the slots of each construction.</step>
+</steps>
+"""
+
+_PACKAGE_RE = re.compile(r"^\s*package\s+([^;\n]+);", re.MULTILINE)
+_DATACLASS_RE = re.compile(r"dataclass\s+(\w+)\s*\{(.*?)\}", re.DOTALL)
+_FIELD_RE = re.compile(r"(\w+)\s+(\w+)\s*;")
+_UNIT_RE = re.compile(r'<unit(?: index="(\d+)")?>(.*?)</unit>', re.DOTALL)
+_CONFLICT_RE = re.compile(r"<conflict>(.*?)</conflict>", re.DOTALL)
+_FIELD_TYPE_RE = re.compile(r"'type': '(\w+)'")
+
+
+def _tag(name: str, text: str) -> str | None:
+    match = re.search(rf"<{name}>(.*?)</{name}>", text, re.DOTALL)
+    return match.group(1).strip() if match else None
+
+
+def load_definitions() -> YamlDefLoader:
+    """The `test/` definitions with the bench's linking rules."""
+    # An absolute file name replaces the definition directory.
+    return YamlDefLoader(
+        DEFINITION_DIR, link_rules_filename=str(LINK_RULES_PATH)
+    )
+
+
+def generate_sources(
+    sources: int, units: int, seed: int = 0
+) -> list[SourceFile]:
+    """Spread `units` dataclasses over `sources` files.
+
+    Every file starts with a package declaration, so the total number of
+    parsed units is `units + sources`. Some fields refer to dataclasses
+    declared earlier, which gives the dependency linking rule work to do.
+    """
+    rng = random.Random(seed)
+    files = []
+    declared: list[str] = []
+    for file_number in range(sources):
+        lines = [f"package bench.module{file_number};", ""]
+        count = units // sources + (file_number < units % sources)
+        for _ in range(count):
+            name = f"Entity{len(declared)}"
+            lines.append(f"dataclass {name} {{")
+            for field_number in range(rng.randint(2, 6)):
+                field_type = (
+                    rng.choice(declared)
+                    if declared and rng.random() < 0.3
+                    else rng.choice(_PRIMITIVES)
+                )
+                lines.append(f"    {field_type} field{field_number};")
+            lines.extend(["}", ""])
+            declared.append(name)
+        files.append(
+            SourceFile(f"module{file_number}.txt", "\n".join(lines))
+        )
+    return files
+
+
+def _parse(user: str) -> list[dict]:
+    code = _tag("code", user) or ""
+    found = [
+        (match.start(), {"rule": "package", "slots": {"name": match[1]}})
+        for match in _PACKAGE_RE.finditer(code)
+    ]
+    for match in _DATACLASS_RE.finditer(code):
+        fields = [
+            {"type": field_type, "name": field_name}
+            for field_type, field_name in _FIELD_RE.findall(match[2])
+        ]
+        found.append(
+            (
+                match.start(),
+                {
+                    "rule": "dataclass",
+                    "slots": {"name": match[1], "fields": fields},
+                },
+            )
+        )
+    return [unit for _, unit in sorted(found, key=lambda item: item[0])]
+
+
+def _link(user: str) -> list[dict]:
+    units = [
+        (int(index), _tag("type", body), _tag("name", body), body)
+        for index, body in _UNIT_RE.findall(user)
+    ]
+    rule = _tag("rule", user) or ""
+    if "package" in rule:
+        packages = [name for _, type_, name, _ in units if type_ == "package"]
+        return [
+            {
+                "type": "set_workspace_attr",
+                "name": "package",
+                "value": packages[0] if packages else "com.my.app",
+            }
+        ]
+    if "value_object" in rule:
+        return [
+            {
+                "type": "set_unit_attr",
+                "index": index,
+                "name": "value_object",
+                "value": True,
+            }
+            for index, type_, _, body in units
+            if type_ == "dataclass"
+            and set(
+                _FIELD_TYPE_RE.findall(_tag("fields", body) or "")
+            ) <= set(_PRIMITIVES)
+        ]
+    names = {name for _, type_, name, _ in units if type_ == "dataclass"}
+    changes = []
+    for index, type_, name, body in units:
+        fields = _tag("fields", body) or ""
+        imports = sorted(
+            other for other in names
+            if other != name and f"'{other}'" in fields
+        )
+        if type_ == "dataclass" and imports:
+            changes.append(
+                {
+                    "type": "set_unit_attr",
+                    "index": index,
+                    "name": "imports",
+                    "value": imports,
+                }
+            )
+    return changes
+
+
+def _reduce(user: str) -> list[dict]:
+    changes = []
+    for body in _CONFLICT_RE.findall(user):
+        change = {
+            "type": _tag("type", body),
+            "name": _tag("name", body),
+            "value": _tag("candidate", body),
+        }
+        index = _tag("index", body)
+        if index is not None:
+            change["index"] = int(index)
+        changes.append(change)
+    return changes
+
+
+def _compile(user: str, index: int | None, body: str) -> dict:
+    name = _tag("name", body) or "Unnamed"
+    package = _tag("package", _tag("workspace-attributes", user) or "")
+    path = (_tag("path-template", user) or "$name.java").replace("$name", name)
+    content = (_tag("code-template", user) or "").replace("$name", name)
+    if package:
+        content = f"package {package};\n\n{content}"
+    generated = {"path": path, "content": content}
+    if index is not None:
+        generated["index"] = index
+    return generated
+
+
+def respond(kind: str, system: str, user: str) -> str:
+    """Answer a prompt the way a well-behaved model would."""
+    if kind == "explain":
+        return _PARSE_ALGO
+    if kind == "parse":
+        result = _parse(user)
+    elif kind == "link":
+        result = _link(user)
+    elif kind == "link_reduce":
+        result = _reduce(user)
+    elif kind == "compile_unit":
+        result = _compile(user, None, _tag("unit", user) or "")
+    else:
+        result = [
+            _compile(user, int(index), body)
+            for index, body in _UNIT_RE.findall(user)
+        ]
+    return "```json" + json.dumps(result) + "```"
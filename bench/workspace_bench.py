@@ -0,0 +1,101 @@
+"""Compare the indexed Workspace with a plain list of unit dataclasses.
+
+    python -m bench.workspace_bench [UNITS]
+"""
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from aint.domain.syntax import ParseRule
+from aint.domain.units import Unit, Workspace
+
+RULES = [
+    ParseRule(f"type_{i}", {"name": "string"}, f"type_{i} $name;")
+    for i in range(20)
+]
+
+
+@dataclass
+class _PlainUnit:
+    used_rule: ParseRule
+    slots: dict[str, str]
+    attributes: dict[str, str]
+
+    @property
+    def type(self) -> str:
+        return self.used_rule.name
+
+
+def _raw_units(count: int) -> list[tuple[ParseRule, dict, dict]]:
+    # Keys come from decoded JSON, so every unit gets its own key strings.
+    return [
+        (
+            RULES[i % len(RULES)],
+            json.loads(f'{{"name": "Unit{i}", "fields": "f{i}"}}'),
+            json.loads(f'{{"package": "p{i % 7}", "imports": ""}}'),
+        )
+        for i in range(count)
+    ]
+
+
+def _measure(build) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained
+
+
+def main(count: int) -> None:
+    plain, plain_memory = _measure(
+        lambda: [_PlainUnit(*raw) for raw in _raw_units(count)]
+    )
+    workspace, indexed_memory = _measure(
+        lambda: Workspace(
+            [Unit(*raw) for raw in _raw_units(count)], attributes={}
+        )
+    )
+    selects = [("type_3",), ("type_5", "type_11")]
+
+    start = time.perf_counter()
+    for select in selects * 10:
+        [unit for unit in plain if unit.type in select]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for select in selects * 10:
+        workspace.units_of_types(*select)
+    indexed_time = time.perf_counter() - start
+
+    print(f"units: {count}")
+    print(
+        f"memory: plain {plain_memory / 2**20:.1f} MiB, "
+        f"indexed {indexed_memory / 2**20:.1f} MiB"
+    )
+    start = time.perf_counter()
+    for i in range(20):
+        [unit for unit in plain if unit.attributes["package"] == f"p{i % 7}"]
+    attr_scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(20):
+        workspace.units_with_attr("package", f"p{i % 7}")
+    attr_indexed_time = time.perf_counter() - start
+
+    print(
+        f"20 selections: scan {scan_time * 1000:.1f} ms, "
+        f"indexed {indexed_time * 1000:.1f} ms"
+    )
+    print(
+        f"20 attribute lookups: scan {attr_scan_time * 1000:.1f} ms, "
+        f"indexed {attr_indexed_time * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
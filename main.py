@@ -1,8 +1,5 @@
-import os
 from pathlib import Path
 
-from openai import Client
-
 from aint.domain.flow import run_compiler_flow
 from aint.infrastructure.ai.client import AI
 from aint.infrastructure.ai.impl import (
@@ -10,16 +7,14 @@ from aint.infrastructure.ai.impl import (
     AISourceParser,
     AIUnitCompiler, AIUnitLinker,
 )
+from aint.presentation.defaults import DEFAULT_MODEL
 from aint.presentation.definition_loaders import YamlDefLoader
+from aint.presentation.models import create_client
 from aint.presentation.sources import load_sources, save_generated
 
 
 def main():
-    client = Client(
-        api_key=os.environ["OPENROUTER_API_KEY"],
-        base_url="https://openrouter.ai/api/v1"
-    )
-    ai = AI(client, "kwaipilot/kat-coder-pro:free")
+    ai = AI(create_client(), DEFAULT_MODEL)
     loader = YamlDefLoader(Path("test"))
     explainer = AIRuleExplainer(ai)
     parser = AISourceParser(ai)
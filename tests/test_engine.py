@@ -0,0 +1,42 @@
+from aint.infrastructure.ai.engine import AdaptiveLimiter
+
+
+def test_limiter_keeps_limit_on_successes():
+    limiter = AdaptiveLimiter(8)
+    for _ in range(30):
+        limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_limiter_halves_on_throttle():
+    limiter = AdaptiveLimiter(8)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.limit == 1
+
+
+def test_limiter_shrinks_on_errors():
+    limiter = AdaptiveLimiter(8)
+    limiter.on_error()
+    assert 7 <= limiter.limit < 8
+
+
+def test_limiter_recovers_after_throttle():
+    limiter = AdaptiveLimiter(8)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_limiter_blocks_above_limit():
+    limiter = AdaptiveLimiter(2)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.active == 2
+    limiter.release()
+    limiter.acquire()
+    assert limiter.active == 2
@@ -0,0 +1,77 @@
+from aint.domain.incremental import IncrementalBuild
+from aint.domain.syntax import ParseRule
+from aint.domain.units import LinkingRule, Unit, Workspace, recording_writes
+
+PACKAGE = ParseRule("package", {"name": "package name"}, "package $name")
+CLASS = ParseRule("class", {"name": "class name"}, "class $name")
+
+PACKAGE_RULE = LinkingRule(
+    "package", ["package"], "Set the package", reads=[], writes=["package"]
+)
+
+
+def _workspace(package):
+    return Workspace(
+        [
+            Unit(PACKAGE, {"name": package}, {}),
+            Unit(CLASS, {"name": "A"}, {}),
+        ],
+        {},
+    )
+
+
+def _link(workspace, rules):
+    for rule in rules:
+        with recording_writes() as writes:
+            if rule.name == "package":
+                workspace.set_attr(
+                    "package", workspace.units[0].slots["name"]
+                )
+            else:
+                workspace.set_unit_attr(
+                    workspace.units[1],
+                    "qualified",
+                    f"{workspace.attributes['package']}.A",
+                )
+        yield rule, writes
+
+
+def _build(previous, package, rules):
+    build = IncrementalBuild(previous, "definitions")
+    workspace = _workspace(package)
+    rerun = build.prepare_linking(workspace, rules)
+    for rule, writes in _link(workspace, rerun):
+        build.record_rule_writes(rule, writes)
+    build.record_linking(workspace)
+    return build, workspace, rerun
+
+
+def test_rules_reading_attributes_of_rerun_rules_rerun():
+    qualify = LinkingRule("qualify", ["class"], "Qualify class names")
+    rules = [PACKAGE_RULE, qualify]
+    first, _, rerun = _build(None, "app", rules)
+    assert rerun == rules
+    _, workspace, rerun = _build(first.manifest, "lib", rules)
+    assert rerun == rules
+    assert workspace.units[1].attributes == {"qualified": "lib.A"}
+
+
+def test_rules_not_reading_writes_of_rerun_rules_are_kept():
+    qualify = LinkingRule(
+        "qualify", ["class"], "Qualify class names", reads=[], writes=[]
+    )
+    rules = [PACKAGE_RULE, qualify]
+    first, _, _ = _build(None, "app", rules)
+    _, workspace, rerun = _build(first.manifest, "lib", rules)
+    assert rerun == [PACKAGE_RULE]
+    assert workspace.units[1].attributes == {"qualified": "app.A"}
+
+
+def test_unchanged_build_reruns_nothing():
+    qualify = LinkingRule("qualify", ["class"], "Qualify class names")
+    rules = [PACKAGE_RULE, qualify]
+    first, _, _ = _build(None, "app", rules)
+    _, workspace, rerun = _build(first.manifest, "app", rules)
+    assert rerun == []
+    assert workspace.attributes == {"package": "app"}
+    assert workspace.units[1].attributes == {"qualified": "app.A"}
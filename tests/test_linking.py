@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from aint.domain.syntax import ParseRule
+from aint.domain.units import LinkingRule, LocalLinking, Unit, Workspace
+from aint.infrastructure.ai.impl import AIUnitLinker
+from aint.infrastructure.local.linking import LocalUnitLinker
+
+CLASS = ParseRule("class", {"name": "class name"}, "class $name")
+
+
+class FakeAI:
+    compact_prompts = True
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def request_json(self, system, user, decode):
+        return decode(json.dumps(self.changes))
+
+
+def _workspace(*names):
+    return Workspace(
+        [Unit(CLASS, {"name": name}, {}) for name in names],
+        {"package": "app"},
+    )
+
+
+def test_model_changes_outside_writes_are_dropped():
+    workspace = _workspace("A")
+    rule = LinkingRule("mark", ["class"], "Mark classes", writes=[])
+    ai = FakeAI([
+        {"type": "set_workspace_attr", "name": "package", "value": "x"},
+        {"type": "set_unit_attr", "index": 0, "name": "marked",
+         "value": True},
+    ])
+    AIUnitLinker(ai).apply_rule(workspace, rule)
+    assert workspace.attributes == {"package": "app"}
+    assert workspace.units[0].attributes == {"marked": True}
+
+
+def test_model_changes_of_declared_writes_are_applied():
+    workspace = _workspace("A")
+    rule = LinkingRule(
+        "package", ["class"], "Set the package", writes=["package"]
+    )
+    ai = FakeAI([
+        {"type": "set_workspace_attr", "name": "package", "value": "x"},
+    ])
+    AIUnitLinker(ai).apply_rule(workspace, rule)
+    assert workspace.attributes == {"package": "x"}
+
+
+def test_local_rule_writing_undeclared_attribute_fails():
+    workspace = _workspace("A")
+    rule = LinkingRule(
+        "count",
+        ["class"],
+        "",
+        writes=[],
+        local=LocalLinking(workspace={"count": "units | length"}),
+    )
+    linker = LocalUnitLinker(AIUnitLinker(FakeAI([])))
+    with pytest.raises(ValueError, match="count"):
+        linker.apply_rule(workspace, rule)
+    assert workspace.attributes == {"package": "app"}
+
+
+class ShardAI(FakeAI):
+    """Answers every shard by marking all units with the shard's first
+    unit name."""
+
+    def request_json(self, system, user, decode):
+        first = user.split("<name>", 1)[1].split("</name>", 1)[0]
+        return decode(json.dumps([
+            {"type": "set_unit_attr", "index": index, "name": "shard",
+             "value": first}
+            for index in range(3)
+        ]))
+
+
+def test_shards_change_only_their_units():
+    workspace = _workspace("A", "B", "C")
+    rule = LinkingRule(
+        "mark", ["class"], "Mark classes", scope="shard", writes=[]
+    )
+    AIUnitLinker(ShardAI([]), shard_tokens=1).apply_rule(workspace, rule)
+    assert [unit.attributes for unit in workspace.units] == [
+        {"shard": "A"}, {"shard": "B"}, {"shard": "C"}
+    ]